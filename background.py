@@ -0,0 +1,136 @@
+'''
+Background module - runs slow work (saving, loading, importing, benchmarks) outside of the tkinter event loop.
+
+Tkinter can only be used from the thread running mainloop, and while a button callback is running the window does not
+redraw or react to clicks. The BackgroundWorker runs functions in a thread pool instead, and the results come back through
+a queue. The queue is checked from the tkinter thread every 50 ms using after(), so the callbacks (on_done, on_error and
+on_progress) always run in the tkinter thread and can safely update the widgets.
+
+Task Class - one piece of work given to the worker.
+    The function is called with the task as its first argument, so it can call task.report(...) to send progress to on_progress,
+    and task.check() to stop early (check raises TaskCancelled if the task has been cancelled).
+    cancel - asks the task to stop. A task that has not started yet is never run, a running task stops at its next check().
+        The callbacks of a cancelled task are never called, even if it finished before reaching a check().
+
+BackgroundWorker Class
+    submit - starts a function in the background and returns its Task.
+        Tasks submitted with serial=True run one at a time, in the order they were submitted, on a separate thread.
+        This is used for saving, so changes are written in the same order they were made.
+    cancel_all - cancels every task that is not finished.
+    shutdown - waits for the running and queued tasks (so pending saves are written), and stops polling the queue.
+'''
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class TaskCancelled(Exception):
+    pass
+
+
+class Task:
+    def __init__(self, worker, fn, args, kwargs, on_done, on_error, on_progress, serial=False):
+        self._worker = worker
+        self.serial = serial
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.on_done = on_done
+        self.on_error = on_error
+        self.on_progress = on_progress
+        self._cancelled = threading.Event()
+        self.finished = False
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        if self._cancelled.is_set():
+            raise TaskCancelled()
+
+    def report(self, *progress):
+        self._worker._results.put((self, 'progress', progress))
+
+    def _run(self):
+        if self.cancelled:
+            self._worker._results.put((self, 'cancelled', None))
+            return
+        try:
+            result = self.fn(self, *self.args, **self.kwargs)
+        except TaskCancelled:
+            self._worker._results.put((self, 'cancelled', None))
+        except Exception as e:
+            self._worker._results.put((self, 'error', e))
+        else:
+            self._worker._results.put((self, 'done', result))
+
+
+class BackgroundWorker:
+    def __init__(self, master, max_workers=2, poll_interval=50):
+        self.master = master
+        self.poll_interval = poll_interval
+        self._pool = ThreadPoolExecutor(max_workers=max_workers)
+        self._serial = ThreadPoolExecutor(max_workers=1)
+        self._results = queue.Queue()
+        self._tasks = set()
+        self._after_id = None
+        self._poll()
+
+    def submit(self, fn, *args, on_done=None, on_error=None, on_progress=None, serial=False, **kwargs):
+        task = Task(self, fn, args, kwargs, on_done, on_error, on_progress, serial)
+        self._tasks.add(task)
+        (self._serial if serial else self._pool).submit(task._run)
+        return task
+
+    def cancel_all(self):
+        for task in self._tasks:
+            task.cancel()
+
+    def pending(self):
+        return len(self._tasks)
+
+    # Calling the callbacks for everything that has finished or reported progress since the last poll
+    def _poll(self):
+        try:
+            self.process_results()
+        finally:
+            self._after_id = self.master.after(self.poll_interval, self._poll)
+
+    def process_results(self):
+        while True:
+            try:
+                task, kind, value = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if kind == 'progress':
+                if task.on_progress is not None and not task.cancelled:
+                    task.on_progress(*value)
+                continue
+            task.finished = True
+            self._tasks.discard(task)
+            # A cancelled task can still finish without reaching check(), its result is not wanted any more
+            if task.cancelled:
+                continue
+            if kind == 'done' and task.on_done is not None:
+                task.on_done(value)
+            elif kind == 'error':
+                if task.on_error is not None:
+                    task.on_error(value)
+                else:
+                    raise value
+
+    def shutdown(self, cancel_pending=False):
+        if cancel_pending:
+            # Only the pool tasks are cancelled, serial tasks are writes that have to finish
+            for task in self._tasks:
+                if not task.serial:
+                    task.cancel()
+        if self._after_id is not None:
+            self.master.after_cancel(self._after_id)
+            self._after_id = None
+        self._pool.shutdown(wait=True)
+        self._serial.shutdown(wait=True)
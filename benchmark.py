@@ -0,0 +1,280 @@
+'''
+Benchmark module - a headless benchmark runner that measures the recipe operations over growing catalogue sizes.
+
+The performance dialog only measures the few recipes that are stored, and used to include the time spent writing recipes.json.
+This module builds synthetic catalogues of different sizes (by default 100 up to 1 000 000 recipes), and measures add, get
+and delete for each data structure in memory, using a MemoryStorage engine so no files are written. With persistence=True the
+dictionary is also measured with the journal storage engine (in a temporary folder), to see the cost of writing to disk separately.
+
+Key Components:
+- make_synthetic_recipes: creates n recipes with names, ingredients from a fixed list of ingredients, and instructions.
+- STRUCTURES: the data structures that can be measured, with the RecipeManager methods used for add, get and delete.
+- measure: measures one operation on one structure. Every sample times a batch of calls and divides by the number of calls,
+  since a single dictionary lookup is too fast to time on its own. The batch size is calibrated so a batch takes about 0.1 ms.
+  The catalogue size stays the same during the measurement - added recipes are deleted again and the other way around.
+- summarize: mean, min and percentiles (p50, p90, p99) of the samples, in seconds.
+- fit_complexity: fits the median times over the sizes to O(1), O(log n) and O(n) with least squares, and picks the best model
+  using the Akaike information criterion, which punishes the extra parameter so a flat curve is not called O(log n).
+  The errors are relative (divided by the measured time), otherwise the largest sizes would decide the fit on their own.
+  With a handful of sizes a little noise (or the CPU caches filling up) is enough for AIC to prefer a growing model, so:
+  fewer than MIN_FIT_SIZES sizes are 'inconclusive', a curve whose log-log slope is below FLAT_SLOPE is O(1) (at 0.05 the
+  time grows less than 1.6 times over four orders of magnitude), and a growing model has to beat O(1) by AIC_MARGIN,
+  otherwise the result is 'inconclusive' as well.
+- run_sweep: runs everything, and returns the results as a dictionary that can be saved as JSON (save_results),
+  so runs can be compared over time. From the command line the run is also stored in the benchmark history database
+  (see benchmark_history.py), unless --no-record is given.
+
+Usage:
+    python benchmark.py --sizes 100 1000 10000 100000 --samples 30 --output results.json
+'''
+import argparse
+import datetime
+import json
+import math
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from recipe_manager import RecipeManager
+from storage import JournalStorage, MemoryStorage
+from benchmark_history import record_run
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000, 1000000]
+OPERATIONS = ['Add', 'Get', 'Delete']
+RESULTS_DIR = 'benchmark_results'
+
+_INGREDIENTS = ['water', 'flour', 'yeast', 'salt', 'sugar', 'butter', 'eggs', 'milk', 'honey', 'garlic', 'onion', 'tomatoes',
+                'beans', 'chilies', 'rice', 'pasta', 'cheese', 'basil', 'pepper', 'olive oil', 'lemon', 'chicken', 'beef',
+                'carrots', 'potatoes', 'cream', 'coffeebeans', 'tea leaves', 'ginger', 'cinnamon']
+_WORDS = ['mix', 'stir', 'bake', 'boil', 'simmer', 'chop', 'fold', 'serve', 'rest', 'knead', 'fry', 'season', 'well',
+          'overnight', 'minutes', 'degrees', 'slowly', 'hot', 'cold', 'until', 'golden', 'then', 'and', 'for']
+
+# The RecipeManager methods used for each structure, as (add, get, delete)
+STRUCTURES = {
+    'dict': ('add_recipe_dict', 'get_recipe', 'delete_recipe_dict'),
+    'list': ('add_recipe_list', 'get_recipe_list', 'delete_recipe_list'),
+    'sorted': ('add_recipe_sorted', 'get_recipe_sorted', 'delete_recipe_sorted'),
+}
+MIN_FIT_SIZES = 4
+FLAT_SLOPE = 0.05
+AIC_MARGIN = 2.0
+MODELS = {
+    'O(1)': lambda n: np.zeros_like(n),
+    'O(log n)': np.log,
+    'O(n)': lambda n: n,
+}
+
+
+def make_synthetic_recipes(n, seed=0):
+    rng = random.Random(seed)
+    recipes = {}
+    for i in range(n):
+        recipes[f'Synthetic Recipe {i:07d}'] = {
+            'ingredients': rng.sample(_INGREDIENTS, rng.randint(2, 8)),
+            'instructions': ' '.join(rng.choice(_WORDS) for _ in range(rng.randint(5, 25))),
+        }
+    return recipes
+
+
+def make_manager(recipes, persistence=False, folder=None):
+    if persistence:
+        storage = JournalStorage(os.path.join(folder, 'recipes.json'), os.path.join(folder, 'recipes.journal'))
+        storage.save(recipes)
+        manager = RecipeManager(storage=storage)
+    else:
+        manager = RecipeManager(storage=MemoryStorage(dict(recipes)))
+    # Building the list of tuples and the ordered index before measuring, they are built on first use
+    manager.recipes_list
+    manager.recipes_sorted
+    return manager
+
+
+# Choosing how many calls go in one timed batch, so that the timer resolution does not matter
+def _calibrate(call, target=1e-4, max_number=1000):
+    start = time.perf_counter()
+    call()
+    single = max(time.perf_counter() - start, 1e-8)
+    return max(1, min(max_number, int(target / single)))
+
+
+def measure(manager, structure, operation, samples, rng, number=None):
+    add, get, delete = (getattr(manager, method) for method in STRUCTURES[structure])
+    existing = list(manager.recipes_dict.keys())
+    counter = [0]
+
+    def new_names(count):
+        counter[0] += count
+        return [f'Benchmark Recipe {counter[0] - i}' for i in range(count)]
+
+    if number is None:
+        if operation == 'Get':
+            number = _calibrate(lambda: get(rng.choice(existing)))
+        else:
+            name = new_names(1)[0]
+            number = _calibrate(lambda: add(name, ['water'], 'Mix.'))
+            delete(name)
+
+    times = []
+    for _ in range(samples):
+        if operation == 'Get':
+            names = [rng.choice(existing) for _ in range(number)]
+            start = time.perf_counter()
+            for name in names:
+                get(name)
+            elapsed = time.perf_counter() - start
+        elif operation == 'Add':
+            names = new_names(number)
+            start = time.perf_counter()
+            for name in names:
+                add(name, ['water'], 'Mix.')
+            elapsed = time.perf_counter() - start
+            for name in names:
+                delete(name)
+        else:
+            names = new_names(number)
+            for name in names:
+                add(name, ['water'], 'Mix.')
+            start = time.perf_counter()
+            for name in names:
+                delete(name)
+            elapsed = time.perf_counter() - start
+        times.append(elapsed / number)
+    return times
+
+
+def summarize(times):
+    times = np.asarray(times)
+    p50, p90, p99 = np.percentile(times, [50, 90, 99])
+    return {'mean': float(times.mean()), 'min': float(times.min()), 'p50': float(p50), 'p90': float(p90), 'p99': float(p99)}
+
+
+def fit_complexity(sizes, times):
+    n = np.asarray(sizes, dtype=float)
+    y = np.asarray(times, dtype=float)
+    # Weighted least squares with weights 1 / y, which minimizes the relative errors
+    weights = 1 / y
+    fits = {}
+    for model, transform in MODELS.items():
+        x = transform(n)
+        if model == 'O(1)':
+            coefficients = np.array([np.sum(weights) / np.sum(weights ** 2), 0.0])
+        else:
+            design = np.column_stack([np.ones_like(x), x]) * weights[:, None]
+            coefficients, *_ = np.linalg.lstsq(design, y * weights, rcond=None)
+            # A curve that goes down as the catalogue grows is not a useful O(log n) or O(n) fit
+            if coefficients[1] < 0:
+                continue
+        residual = float(np.sum(((y - (coefficients[0] + coefficients[1] * x)) * weights) ** 2))
+        parameters = 1 if model == 'O(1)' else 2
+        aic = len(y) * math.log(max(residual, 1e-300) / len(y)) + 2 * parameters
+        fits[model] = {'intercept': float(coefficients[0]), 'slope': float(coefficients[1]), 'residual': residual, 'aic': aic}
+    if len(n) < MIN_FIT_SIZES:
+        return {'best': 'inconclusive', 'models': fits, 'loglog_slope': None}
+    # How fast the time grows, the slope of log(time) against log(n): about 0 for O(1) and 1 for O(n)
+    loglog_slope = float(np.polyfit(np.log(n), np.log(y), 1)[0])
+    growing = [model for model in fits if model != 'O(1)']
+    if loglog_slope < FLAT_SLOPE or not growing:
+        best = 'O(1)'
+    else:
+        best = min(growing, key=lambda model: fits[model]['aic'])
+        if fits['O(1)']['aic'] - fits[best]['aic'] < AIC_MARGIN:
+            best = 'inconclusive'
+    return {'best': best, 'models': fits, 'loglog_slope': loglog_slope}
+
+
+def run_sweep(sizes=DEFAULT_SIZES, structures=tuple(STRUCTURES), operations=OPERATIONS, samples=30, seed=0,
+              persistence=False, progress=None, should_stop=None):
+    rng = random.Random(seed)
+    results = []
+    steps = len(sizes) * (len(structures) + (1 if persistence else 0)) * len(operations)
+    done = 0
+    for n in sizes:
+        recipes = make_synthetic_recipes(n, seed)
+        runs = [(structure, False) for structure in structures]
+        if persistence:
+            runs.append(('dict', True))
+        for structure, persisted in runs:
+            with tempfile.TemporaryDirectory() as folder:
+                manager = make_manager(recipes, persisted, folder)
+                label = structure + ('+journal' if persisted else '')
+                for operation in operations:
+                    if should_stop is not None:
+                        should_stop()
+                    times = measure(manager, structure, operation, samples, rng)
+                    results.append({'structure': label, 'operation': operation, 'n': n, 'samples': times, **summarize(times)})
+                    done += 1
+                    if progress is not None:
+                        progress(done, steps, f'{label} {operation} n={n}')
+                manager.close()
+
+    fits = {}
+    for label in dict.fromkeys(result['structure'] for result in results):
+        for operation in operations:
+            rows = [r for r in results if r['structure'] == label and r['operation'] == operation]
+            if len(rows) >= 3:
+                fits[f'{label} {operation}'] = fit_complexity([r['n'] for r in rows], [r['p50'] for r in rows])
+
+    return {
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'sizes': list(sizes),
+        'samples': samples,
+        'seed': seed,
+        'results': results,
+        'fits': fits,
+    }
+
+
+def save_results(run, path=None):
+    if path is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        stamp = run['timestamp'].replace(':', '-')
+        path = os.path.join(RESULTS_DIR, f'benchmark-{stamp}.json')
+    with open(path, 'w') as f:
+        json.dump(run, f, indent=2)
+    return path
+
+
+def format_results(run):
+    lines = [f"{'structure':<14}{'op':<8}{'n':>9}{'p50 (us)':>12}{'p90 (us)':>12}{'p99 (us)':>12}"]
+    for r in run['results']:
+        lines.append(f"{r['structure']:<14}{r['operation']:<8}{r['n']:>9}"
+                     f"{r['p50'] * 1e6:>12.3f}{r['p90'] * 1e6:>12.3f}{r['p99'] * 1e6:>12.3f}")
+    if run['fits']:
+        lines.append('')
+        for key, fit in run['fits'].items():
+            lines.append(f'{key}: {fit["best"]}')
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the recipe manager operations over growing catalogue sizes.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--structures', nargs='+', default=list(STRUCTURES), choices=list(STRUCTURES))
+    parser.add_argument('--operations', nargs='+', default=OPERATIONS, choices=OPERATIONS)
+    parser.add_argument('--samples', type=int, default=30)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--persistence', action='store_true', help='also measure the dictionary with the journal storage engine')
+    parser.add_argument('--output', help=f'where to save the JSON results (default: a new file in {RESULTS_DIR}/)')
+    parser.add_argument('--label', help='a note stored with the run in the benchmark history')
+    parser.add_argument('--no-record', action='store_true', help='do not store the run in the benchmark history database')
+    args = parser.parse_args(argv)
+
+    def progress(done, total, label):
+        print(f'[{done}/{total}] {label}', file=sys.stderr)
+
+    run = run_sweep(args.sizes, args.structures, args.operations, args.samples, args.seed, args.persistence, progress)
+    print(format_results(run))
+    print(f'\nSaved to {save_results(run, args.output)}')
+    if not args.no_record:
+        print(f'Recorded as run #{record_run(run, label=args.label)} in the benchmark history')
+
+
+if __name__ == '__main__':
+    main()
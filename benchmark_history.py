@@ -0,0 +1,240 @@
+'''
+Benchmark history module - stores every benchmark run in a local SQLite database, so runs can be compared over time.
+
+Each run is stored with the git commit it was run on, the Python version and the platform, and for every structure,
+operation and catalogue size (n) the summary times and all the samples. Keeping the samples makes it possible to check if
+a difference between two runs is real or just noise.
+
+Key Components:
+- record_run: stores a run as returned by benchmark.run_sweep, returning its id.
+- list_runs / load_run: reading the runs back. load_run raises ValueError for an unknown run id.
+- compare_runs: compares a candidate run against a baseline run for every (structure, operation, n) they both measured.
+  A measurement is flagged as a regression when the median got more than `threshold` slower (10% by default), and a
+  one-sided Mann-Whitney U test on the samples says the candidate is slower with p below `alpha`. The Mann-Whitney test
+  only uses the order of the samples, so a few very slow outliers do not decide the result.
+- plot_history: draws the median time against n for one structure and operation, one line per run.
+
+Usage (headless, for example in a script that runs after the benchmarks):
+    python benchmark_history.py list
+    python benchmark_history.py compare                   (latest run against the run before it)
+    python benchmark_history.py compare --baseline 3 --candidate 7
+    python benchmark_history.py plot --structure list --operation Get --output history.png
+compare exits with status 1 if a regression is found, so it can fail a build.
+'''
+import argparse
+import contextlib
+import json
+import math
+import sqlite3
+import subprocess
+import sys
+
+HISTORY_PATH = 'benchmark_history.db'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    git_commit TEXT,
+    python TEXT,
+    platform TEXT,
+    label TEXT
+);
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id INTEGER NOT NULL REFERENCES runs(id) ON DELETE CASCADE,
+    structure TEXT NOT NULL,
+    operation TEXT NOT NULL,
+    n INTEGER NOT NULL,
+    mean REAL,
+    p50 REAL,
+    p90 REAL,
+    p99 REAL,
+    samples TEXT,
+    PRIMARY KEY (run_id, structure, operation, n)
+);
+'''
+
+
+# Used as "with connect() as connection:", committing the changes (or rolling them back on an error) and closing the connection
+@contextlib.contextmanager
+def connect(path=HISTORY_PATH):
+    connection = sqlite3.connect(path)
+    try:
+        connection.row_factory = sqlite3.Row
+        connection.executescript(_SCHEMA)
+        with connection:
+            yield connection
+    finally:
+        connection.close()
+
+
+# The current git commit, with a '+dirty' suffix if there are uncommitted changes, or None outside a git repository
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('+dirty' if dirty else '')
+
+
+def record_run(run, path=HISTORY_PATH, label=None):
+    with connect(path) as connection:
+        cursor = connection.execute(
+            'INSERT INTO runs (timestamp, git_commit, python, platform, label) VALUES (?, ?, ?, ?, ?)',
+            (run['timestamp'], run.get('git_commit') or git_commit(), run.get('python'), run.get('platform'), label))
+        run_id = cursor.lastrowid
+        connection.executemany(
+            'INSERT OR REPLACE INTO measurements VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+            [(run_id, r['structure'], r['operation'], r['n'], r['mean'], r['p50'], r['p90'], r['p99'], json.dumps(r['samples']))
+             for r in run['results']])
+    return run_id
+
+
+def list_runs(path=HISTORY_PATH, limit=None):
+    with connect(path) as connection:
+        query = 'SELECT * FROM runs ORDER BY id DESC' + (' LIMIT ?' if limit else '')
+        rows = connection.execute(query, (limit,) if limit else ()).fetchall()
+    return [dict(row) for row in reversed(rows)]
+
+
+def load_run(run_id, path=HISTORY_PATH):
+    with connect(path) as connection:
+        run = connection.execute('SELECT * FROM runs WHERE id = ?', (run_id,)).fetchone()
+        if run is None:
+            raise ValueError(f'No benchmark run with id {run_id}')
+        rows = connection.execute('SELECT * FROM measurements WHERE run_id = ? ORDER BY structure, operation, n', (run_id,)).fetchall()
+    run = dict(run)
+    run['results'] = [dict(row, samples=json.loads(row['samples'])) for row in rows]
+    return run
+
+
+# One-sided Mann-Whitney U test, the p-value for "the samples in b are larger than the samples in a".
+# Uses the normal approximation with average ranks for ties, which is fine for the 15+ samples the benchmarks take.
+def mann_whitney_greater(a, b):
+    combined = sorted([(value, 0) for value in a] + [(value, 1) for value in b])
+    rank_sum_b = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        average_rank = (i + j) / 2 + 1
+        rank_sum_b += average_rank * sum(1 for k in range(i, j + 1) if combined[k][1] == 1)
+        i = j + 1
+    na, nb = len(a), len(b)
+    u = rank_sum_b - nb * (nb + 1) / 2
+    sigma = math.sqrt(na * nb * (na + nb + 1) / 12)
+    if sigma == 0:
+        return 1.0
+    z = (u - na * nb / 2 - 0.5) / sigma
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def compare_runs(baseline, candidate, threshold=0.10, alpha=0.01):
+    baseline_results = {(r['structure'], r['operation'], r['n']): r for r in baseline['results']}
+    comparisons = []
+    for r in candidate['results']:
+        key = (r['structure'], r['operation'], r['n'])
+        if key not in baseline_results:
+            continue
+        base = baseline_results[key]
+        ratio = r['p50'] / base['p50'] if base['p50'] else float('inf')
+        p_value = mann_whitney_greater(base['samples'], r['samples'])
+        comparisons.append({
+            'structure': key[0], 'operation': key[1], 'n': key[2],
+            'baseline_p50': base['p50'], 'candidate_p50': r['p50'], 'ratio': ratio, 'p_value': p_value,
+            'regression': ratio > 1 + threshold and p_value < alpha,
+        })
+    return comparisons
+
+
+def plot_history(ax, runs, structure, operation, regressions=()):
+    for run in runs:
+        points = sorted((r['n'], r['p50']) for r in run['results'] if r['structure'] == structure and r['operation'] == operation)
+        if not points:
+            continue
+        sizes, times = zip(*points)
+        ax.plot(sizes, [t * 1e6 for t in times], marker='o', label=f"#{run['id']} {run['git_commit'] or ''} ({run['timestamp']})")
+    # Marking the regressions of the latest run with red circles
+    for c in regressions:
+        if c['regression'] and c['structure'] == structure and c['operation'] == operation:
+            ax.plot(c['n'], c['candidate_p50'] * 1e6, 'o', markersize=14, markerfacecolor='none', markeredgecolor='red')
+    ax.set_xscale('log')
+    ax.set_yscale('log')
+    ax.set_xlabel('Number of recipes (n)')
+    ax.set_ylabel('Median time per operation (us)')
+    ax.set_title(f'{structure} {operation} - history')
+    ax.legend(fontsize='small')
+
+
+def format_comparisons(comparisons):
+    lines = [f"{'structure':<14}{'op':<8}{'n':>9}{'base (us)':>12}{'new (us)':>12}{'ratio':>8}{'p':>9}"]
+    for c in comparisons:
+        lines.append(f"{c['structure']:<14}{c['operation']:<8}{c['n']:>9}{c['baseline_p50'] * 1e6:>12.3f}"
+                     f"{c['candidate_p50'] * 1e6:>12.3f}{c['ratio']:>8.2f}{c['p_value']:>9.4f}"
+                     + ('  REGRESSION' if c['regression'] else ''))
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare stored benchmark runs.')
+    parser.add_argument('--db', default=HISTORY_PATH)
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('list')
+    compare = commands.add_parser('compare')
+    compare.add_argument('--baseline', type=int, help='run id (default: the run before the candidate)')
+    compare.add_argument('--candidate', type=int, help='run id (default: the latest run)')
+    compare.add_argument('--threshold', type=float, default=0.10, help='slowdown of the median that counts (default 0.10 = 10%%)')
+    compare.add_argument('--alpha', type=float, default=0.01, help='significance level (default 0.01)')
+    plot = commands.add_parser('plot')
+    plot.add_argument('--structure', default='dict')
+    plot.add_argument('--operation', default='Get')
+    plot.add_argument('--last', type=int, default=10, help='number of runs to plot')
+    plot.add_argument('--output', required=True)
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        for run in list_runs(args.db):
+            print(f"#{run['id']:<5}{run['timestamp']:<22}{run['git_commit'] or '-':<18}{run['python'] or '-':<10}{run['label'] or ''}")
+        return 0
+
+    if args.command == 'compare':
+        runs = list_runs(args.db)
+        ids = [run['id'] for run in runs]
+        candidate_id = args.candidate if args.candidate is not None else (ids[-1] if ids else None)
+        if args.baseline is not None:
+            baseline_id = args.baseline
+        else:
+            earlier = [run_id for run_id in ids if candidate_id is not None and run_id < candidate_id]
+            baseline_id = earlier[-1] if earlier else None
+        if candidate_id is None or baseline_id is None:
+            print('Need at least two benchmark runs to compare.', file=sys.stderr)
+            return 2
+        try:
+            baseline, candidate = load_run(baseline_id, args.db), load_run(candidate_id, args.db)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 2
+        comparisons = compare_runs(baseline, candidate, args.threshold, args.alpha)
+        print(f'Baseline #{baseline_id}, candidate #{candidate_id}')
+        print(format_comparisons(comparisons))
+        regressions = [c for c in comparisons if c['regression']]
+        print(f'\n{len(regressions)} regression(s) found.')
+        return 1 if regressions else 0
+
+    # Plotting without a window
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    runs = [load_run(run['id'], args.db) for run in list_runs(args.db, args.last)]
+    regressions = compare_runs(runs[-2], runs[-1]) if len(runs) >= 2 else []
+    fig, ax = plt.subplots(figsize=(10, 5))
+    plot_history(ax, runs, args.structure, args.operation, regressions)
+    fig.savefig(args.output, bbox_inches='tight')
+    print(f'Saved to {args.output}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,234 @@
+'''
+Cached storage module - a caching layer between RecipeManager and a storage engine.
+
+When the recipe files are on a slow disk or a network share, two things become slow: reading the same popular recipes again
+and again (every read decodes the recipe from the snapshot, or queries the database), and writing every add and delete to
+disk right away. CachedStorage wraps any storage engine and has the same methods, so it can be used wherever an engine is:
+    RecipeManager(storage=CachedStorage(JournalStorage()))
+or for the whole application with python main.py --cache.
+
+Read cache - load returns a CachedRecipeMapping around the engine's recipes dictionary. It keeps the most recently read
+    recipes (up to cache_size) in an LRU (least recently used) cache, so reading a popular recipe again does not go to the
+    engine. Adding or deleting a recipe through the mapping updates the cache as well, so it is never stale.
+
+Write-behind buffer - record_change(s) only put the changes in a buffer. The buffer is written to the engine, with one
+    record_changes call, when it holds flush_every changes, or flush_interval seconds after the first change was buffered
+    (by a timer thread), or when flush is called. Several changes to the same recipe are coalesced, only the last one is written.
+    If the engine fails to write, the changes stay in the buffer and are written by the next flush (or the next timer).
+
+Counters - stats returns the read cache hits and misses, and how many changes were buffered, coalesced and written in how many flushes.
+
+Shutdown - close flushes the buffer before closing the engine, and the buffer is also flushed when the program exits
+    (atexit), including when it stops because of an unhandled exception. atexit does not run when the process is killed by
+    a signal, so the entry points (main.py, cli.py and server.py) handle SIGTERM and SIGINT by closing the manager.
+    A crash that kills the process (or a power failure) can lose at most the changes of the last flush_interval seconds
+    (or flush_every changes), which is the price of the write-behind buffer. Set flush_every=1 to write every change right away and only keep the read cache.
+'''
+import atexit
+import threading
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+DEFAULT_CACHE_SIZE = 1024
+DEFAULT_FLUSH_EVERY = 100
+DEFAULT_FLUSH_INTERVAL = 1.0
+_MISSING = object()
+
+
+class CachedStorage:
+    def __init__(self, engine, cache_size=DEFAULT_CACHE_SIZE, flush_every=DEFAULT_FLUSH_EVERY, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        self.engine = engine
+        self.cache_size = cache_size
+        self.flush_every = flush_every
+        self.flush_interval = flush_interval
+        # name -> (action, details), in the order the recipes were first changed. The lock also keeps the writes to the
+        # engine in order, flushes can come from the timer thread and from the thread using the manager at the same time.
+        self._buffer = OrderedDict()
+        self._lock = threading.RLock()
+        self._timer = None
+        self._mappings = []
+        self.buffered = 0
+        self.coalesced = 0
+        self.written = 0
+        self.flushes = 0
+        atexit.register(self.flush)
+
+    # Other engine features, like the snapshot path or the SQLite ingredient index, are passed through to the engine
+    def __getattr__(self, name):
+        if name == 'engine':
+            raise AttributeError(name)
+        attribute = getattr(self.engine, name)
+        if name == 'ingredient_index':
+            return lambda: _FlushingIndex(self, attribute())
+        return attribute
+
+    def load(self):
+        with self._lock:
+            self.flush()
+            mapping = CachedRecipeMapping(self.engine.load(), self.cache_size)
+            # The mapping of an earlier load is replaced, keeping it would hold on to its cache for as long as the storage lives
+            self._mappings = [mapping]
+            return mapping
+
+    # Writing a full snapshot replaces everything, the buffered changes are already part of the recipes being saved
+    def save(self, recipes):
+        with self._lock:
+            self._cancel_timer()
+            self._buffer.clear()
+            self.engine.save(recipes)
+
+    def record_change(self, action, name, details=None):
+        self.record_changes([(action, name, details)])
+
+    def record_changes(self, changes):
+        with self._lock:
+            for action, name, details in changes:
+                if name in self._buffer:
+                    self.coalesced += 1
+                    # Moving the recipe to the end, so an add after a delete is still written after other changes
+                    del self._buffer[name]
+                self._buffer[name] = (action, details)
+                self.buffered += 1
+            if len(self._buffer) >= self.flush_every:
+                self.flush()
+            elif self._buffer and self._timer is None:
+                self._start_timer()
+
+    def _start_timer(self):
+        self._timer = threading.Timer(self.flush_interval, self._flush_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    # Nobody waits for the timer thread, so after a failed write the timer is started again to retry the write
+    def _flush_from_timer(self):
+        with self._lock:
+            self._timer = None
+            try:
+                self._write_buffer()
+            except Exception:
+                self._start_timer()
+                raise
+
+    def _cancel_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+    def _write_buffer(self):
+        if not self._buffer:
+            return
+        changes = [(action, name, details) for name, (action, details) in self._buffer.items()]
+        # Only cleared once the engine has written the changes, if it raises they stay buffered for the next flush
+        self.engine.record_changes(changes)
+        self._buffer.clear()
+        self.written += len(changes)
+        self.flushes += 1
+
+    def has_pending_changes(self):
+        return bool(self._buffer)
+
+    def flush(self):
+        with self._lock:
+            self._cancel_timer()
+            self._write_buffer()
+            self.engine.flush()
+
+    # The engine's state is only meaningful once the buffered changes are written
+    def state_token(self):
+        self.flush()
+        return self.engine.state_token()
+
+    def close(self):
+        self.flush()
+        atexit.unregister(self.flush)
+        self.engine.close()
+
+    def stats(self):
+        hits = sum(mapping.hits for mapping in self._mappings)
+        misses = sum(mapping.misses for mapping in self._mappings)
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.0,
+            'cached': sum(len(mapping.cache) for mapping in self._mappings),
+            'cache_size': self.cache_size,
+            'buffered': self.buffered,
+            'coalesced': self.coalesced,
+            'written': self.written,
+            'flushes': self.flushes,
+            'pending': len(self._buffer),
+        }
+
+
+class CachedRecipeMapping(MutableMapping):
+    def __init__(self, recipes, cache_size=DEFAULT_CACHE_SIZE):
+        self.recipes = recipes
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # The server reads from several threads, and move_to_end / popitem on the same OrderedDict are not thread-safe
+        self._lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self._lock:
+            details = self.cache.get(name, _MISSING)
+            if details is not _MISSING:
+                self.hits += 1
+                self.cache.move_to_end(name)
+                return details
+            self.misses += 1
+        details = self.recipes[name]
+        self._remember(name, details)
+        return details
+
+    def _remember(self, name, details):
+        if self.cache_size <= 0:
+            return
+        with self._lock:
+            self.cache[name] = details
+            self.cache.move_to_end(name)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+
+    def __setitem__(self, name, details):
+        self.recipes[name] = details
+        with self._lock:
+            self.cache.pop(name, None)
+        self._remember(name, self.recipes[name])
+
+    def __delitem__(self, name):
+        del self.recipes[name]
+        with self._lock:
+            self.cache.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self.cache or name in self.recipes
+
+    def __iter__(self):
+        return iter(self.recipes)
+
+    def __len__(self):
+        return len(self.recipes)
+
+    def copy(self):
+        return dict(self.items())
+
+    def close(self):
+        if hasattr(self.recipes, 'close'):
+            self.recipes.close()
+
+
+# An engine ingredient index (SQLiteIngredientIndex) only sees the changes written to the engine, so the buffer is flushed first
+class _FlushingIndex:
+    def __init__(self, storage, index):
+        self.storage = storage
+        self.index = index
+
+    def query(self, *args, **kwargs):
+        self.storage.flush()
+        return self.index.query(*args, **kwargs)
+
+    def recipes_for_pantry(self, *args, **kwargs):
+        self.storage.flush()
+        return self.index.recipes_for_pantry(*args, **kwargs)
@@ -0,0 +1,278 @@
+'''
+CLI module - the recipe manager without the GUI, for scripts, servers and terminals without a display.
+
+Commands (python cli.py <command> --help shows the options of each one):
+    add NAME -i "Water, flour" -s "Mix well."  - add a recipe
+    get NAME                                   - print a recipe, or the closest names if there is no recipe with that name
+    delete NAME                                - delete a recipe
+    list [--prefix Pot] [--limit 20]           - print the recipe names, one per line (with a prefix, every name starting
+                                                 with it in alphabetical order)
+    list --sorted [--start B] [--stop D] [--after NAME] [--limit 20]
+                                               - the names in alphabetical order, a page at a time (see ordered_index.py)
+    search QUERY [--limit 10]                  - full-text search, the best match first
+    import PATH                                - add the recipes from a .jsonl or .csv file (see importers.py)
+    export PATH                                - write all recipes to a .jsonl or .csv file, in the format import reads
+    bench [...]                                - run the benchmark sweep, the options are passed on to benchmark.py
+    serve [--host] [--port]                    - start the HTTP/JSON service (see server.py)
+
+The storage options come before the command and are the same as for main.py, for example
+    python cli.py --storage sqlite --cache import recipes.jsonl
+    python cli.py --storage file --codec marshal list
+--compact keeps the recipes in a CompactRecipeStore, which uses much less memory for a large catalogue (see memory_report.py).
+--storage file is the whole-file engine (JsonFileStorage), and --codec chooses its file format (see recipe_codecs.py).
+A binary codec uses a file of its own (recipes.marshal, recipes.msgpack), which is filled from recipes.json the first time.
+With --instrument the calls of the recipe manager and the storage engine are counted and timed (see instrumentation.py),
+and the table is printed to stderr when the command is done. The server serves them on GET /metrics instead.
+
+add_storage_arguments and configure_storage are also used by main.py and server.py, so all of them choose the storage
+engine in the same way. The commands exit with status 1 when the recipe is not found or can not be added.
+'''
+import argparse
+import csv
+import json
+import os
+import signal
+import sys
+
+from recipe_codecs import CODECS, get_codec
+from recipe_manager import RecipeManager
+from storage import SNAPSHOT_PATH, JournalStorage, JsonFileStorage, get_engine, set_engine
+
+
+def add_storage_arguments(parser):
+    parser.add_argument('--storage', choices=['journal', 'sqlite', 'file'], default='journal', help='where the recipes are stored')
+    parser.add_argument('--codec', choices=list(CODECS), default=None,
+                        help='file format of the file storage (default: JSON, with orjson when it is installed)')
+    parser.add_argument('--cache', action='store_true', help='cache recipe reads and buffer writes in front of the storage')
+    parser.add_argument('--cache-size', type=int, default=1024, help='number of recipes kept in the read cache')
+    parser.add_argument('--flush-every', type=int, default=100, help='write the buffered changes after this many changes')
+    parser.add_argument('--flush-interval', type=float, default=1.0, help='or this many seconds after the first buffered change')
+    parser.add_argument('--compact', action='store_true',
+                        help='keep the recipes in the compact in-memory layout (see compact_recipes.py), decoding them all at startup')
+
+
+def configure_storage(args):
+    if args.storage == 'sqlite':
+        from sqlite_storage import SQLiteStorage
+        set_engine(SQLiteStorage())
+    elif args.storage == 'file':
+        # JSON codecs keep using recipes.json, the binary formats get a file of their own.
+        # Without --codec the format of recipes.json is detected, so it can also hold a binary catalogue.
+        try:
+            codec = get_codec(args.codec) if args.codec else None
+            path = SNAPSHOT_PATH if codec is None or codec.extension == '.json' else 'recipes' + codec.extension
+            engine = JsonFileStorage(path, codec)
+            if path != SNAPSHOT_PATH and not os.path.exists(path) and os.path.exists(SNAPSHOT_PATH):
+                _copy_recipes(JournalStorage(), engine)
+            set_engine(engine)
+        except ImportError as e:
+            raise SystemExit(str(e))
+    if args.cache:
+        from cached_storage import CachedStorage
+        set_engine(CachedStorage(get_engine(), args.cache_size, args.flush_every, args.flush_interval))
+
+
+# A binary file is started from the recipes in recipes.json (and recipes.journal), instead of as an empty catalogue
+def _copy_recipes(source, engine):
+    try:
+        recipes = source.load()
+        engine.save(recipes)
+    except ValueError as e:
+        raise SystemExit(f'Could not copy the recipes from {SNAPSHOT_PATH} into {engine.path}: {e}')
+    finally:
+        source.close()
+    print(f'Copied {len(recipes)} recipes from {SNAPSHOT_PATH} into {engine.path}', file=sys.stderr)
+
+
+def _print_recipe(name, recipe):
+    print(name)
+    print('Ingredients: ' + ', '.join(recipe['ingredients']))
+    print('Instructions: ' + recipe['instructions'])
+
+
+def cmd_add(manager, args):
+    ingredients = [ingredient.strip() for ingredient in args.ingredients.split(',') if ingredient.strip()]
+    if not manager.add_recipe_dict(args.name, ingredients, args.instructions):
+        print(f'Recipe {args.name!r} already exists', file=sys.stderr)
+        return 1
+    print(f'Added {args.name!r}')
+    return 0
+
+
+def cmd_get(manager, args):
+    recipe = manager.get_recipe(args.name)
+    if recipe is None:
+        suggestions = [name for name, _ in manager.closest_recipe_names(args.name)]
+        message = f'No recipe named {args.name!r}'
+        if suggestions:
+            message += '. Did you mean: ' + ', '.join(suggestions) + '?'
+        print(message, file=sys.stderr)
+        return 1
+    _print_recipe(args.name, recipe)
+    return 0
+
+
+def cmd_delete(manager, args):
+    if not manager.delete_recipe_dict(args.name):
+        print(f'No recipe named {args.name!r}', file=sys.stderr)
+        return 1
+    print(f'Deleted {args.name!r}')
+    return 0
+
+
+def cmd_list(manager, args):
+    if args.sorted or args.prefix or args.start or args.stop or args.after:
+        if args.limit is not None:
+            names, cursor = manager.page_recipes(args.after, args.limit, args.prefix, args.start, args.stop)
+        else:
+            names, cursor = list(manager.ordered_index.range(args.start, args.stop, args.prefix, args.after)), None
+        for name in names:
+            print(name)
+        if cursor is not None:
+            print(f'More recipes follow, continue with --after {cursor!r}', file=sys.stderr)
+        return 0
+    names = manager.list_recipes()
+    if args.limit is not None:
+        names = names[:args.limit]
+    for name in names:
+        print(name)
+    return 0
+
+
+def cmd_search(manager, args):
+    for name, score in manager.search_recipes(args.query, args.limit):
+        print(f'{score:8.3f}  {name}')
+    return 0
+
+
+def cmd_import(manager, args):
+    if args.path.lower().endswith('.csv'):
+        result = manager.import_csv(args.path)
+    else:
+        result = manager.import_jsonl(args.path)
+    print(result)
+    for error in result.errors:
+        print('  ' + error, file=sys.stderr)
+    return 0
+
+
+# Writing one recipe at a time, so exporting a large catalogue does not build the whole file in memory
+def cmd_export(manager, args):
+    count = 0
+    with open(args.path, 'w', encoding='utf-8', newline='') as f:
+        if args.path.lower().endswith('.csv'):
+            writer = csv.writer(f)
+            writer.writerow(['name', 'ingredients', 'instructions'])
+            for name, recipe in manager.recipes_dict.items():
+                writer.writerow([name, ', '.join(recipe['ingredients']), recipe['instructions']])
+                count += 1
+        else:
+            for name, recipe in manager.recipes_dict.items():
+                record = {'name': name, 'ingredients': list(recipe['ingredients']), 'instructions': recipe['instructions']}
+                f.write(json.dumps(record, ensure_ascii=False) + '\n')
+                count += 1
+    print(f'Exported {count} recipes to {args.path}')
+    return 0
+
+
+def cmd_serve(manager, args):
+    import asyncio
+    from server import serve
+    try:
+        asyncio.run(serve(manager, args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+COMMANDS = {
+    'add': cmd_add,
+    'get': cmd_get,
+    'delete': cmd_delete,
+    'list': cmd_list,
+    'search': cmd_search,
+    'import': cmd_import,
+    'export': cmd_export,
+    'serve': cmd_serve,
+}
+
+
+def _positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'must be at least 1, got {number}')
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Recipe manager without the GUI.')
+    add_storage_arguments(parser)
+    parser.add_argument('--instrument', action='store_true', help='count and time the recipe manager and storage calls')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='add a recipe')
+    add.add_argument('name')
+    add.add_argument('-i', '--ingredients', required=True, help='comma separated ingredients')
+    add.add_argument('-s', '--instructions', required=True)
+
+    commands.add_parser('get', help='print a recipe').add_argument('name')
+    commands.add_parser('delete', help='delete a recipe').add_argument('name')
+
+    list_parser = commands.add_parser('list', help='print the recipe names')
+    list_parser.add_argument('--prefix', help='only the names starting with this, in alphabetical order')
+    list_parser.add_argument('--limit', type=_positive_int)
+    list_parser.add_argument('--sorted', action='store_true', help='in alphabetical order (implied by --prefix, --start, --stop and --after)')
+    list_parser.add_argument('--start', help='alphabetical order, from this name on')
+    list_parser.add_argument('--stop', help='alphabetical order, up to (not including) this name')
+    list_parser.add_argument('--after', help='alphabetical order, after this name (the cursor printed for the previous page)')
+
+    search = commands.add_parser('search', help='full-text search')
+    search.add_argument('query')
+    search.add_argument('--limit', type=_positive_int, default=10)
+
+    commands.add_parser('import', help='add recipes from a .jsonl or .csv file').add_argument('path')
+    commands.add_parser('export', help='write all recipes to a .jsonl or .csv file').add_argument('path')
+
+    commands.add_parser('bench', help='run the benchmark sweep (python cli.py bench --help for its options)', add_help=False)
+
+    serve = commands.add_parser('serve', help='start the HTTP/JSON service')
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8080)
+    serve.add_argument('--workers', type=int, default=4, help='threads running the recipe manager calls')
+    return parser
+
+
+# SIGTERM ends the program like Ctrl+C does, so the manager is still closed and buffered changes are written
+def _exit_on_signal(signum, frame):
+    raise SystemExit(128 + signum)
+
+
+def main(argv=None):
+    signal.signal(signal.SIGTERM, _exit_on_signal)
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+    if args.command == 'bench':
+        # The benchmark builds its own managers in memory, it does not use the recipe files
+        import benchmark
+        benchmark.main(extra)
+        return 0
+    if extra:
+        parser.error('unrecognized arguments: ' + ' '.join(extra))
+    configure_storage(args)
+    if args.instrument:
+        import instrumentation
+        instrumentation.enable()
+    try:
+        manager = RecipeManager(compact=args.compact)
+    except ValueError as e:
+        raise SystemExit(f'Could not load the recipes: {e}')
+    try:
+        return COMMANDS[args.command](manager, args)
+    finally:
+        manager.close()
+        if args.instrument and args.command != 'serve':
+            print(instrumentation.format_table(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+'''
+Codec benchmark module - compares the file formats in recipe_codecs.py on synthetic catalogues.
+
+For every catalogue size (by default 1 000 up to 1 000 000 recipes, made with benchmark.make_synthetic_recipes) every codec
+writes the recipes to a file in a temporary folder and reads them back, and the report shows:
+- size: the size of the file
+- encode / decode: the best of --repeat runs, in seconds, including writing and reading the file (from the file cache)
+- peak: with --memory, the most memory allocated by Python while encoding and decoding (measured with tracemalloc in a
+  separate run, since tracemalloc slows everything down)
+The 'json (whole)' row is the old way, json.dump and json.load on the whole dictionary, for comparison.
+Codecs whose package is not installed (orjson, msgpack) are skipped.
+
+Usage:
+    python codec_benchmark.py --sizes 1000 10000 100000 1000000 --memory
+'''
+import argparse
+import gc
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+from benchmark import make_synthetic_recipes
+from recipe_codecs import available_codecs, get_codec
+
+DEFAULT_SIZES = [1000, 10000, 100000, 1000000]
+WHOLE_JSON = 'json (whole)'
+
+
+class _WholeJson:
+    def dump(self, recipes, f):
+        f.write(json.dumps(recipes).encode('utf-8'))
+
+    def load(self, f):
+        return json.loads(f.read())
+
+
+def _codec(name):
+    return _WholeJson() if name == WHOLE_JSON else get_codec(name)
+
+
+def _encode(codec, recipes, path):
+    with open(path, 'wb') as f:
+        codec.dump(recipes, f)
+
+
+def _decode(codec, path):
+    with open(path, 'rb') as f:
+        return codec.load(f)
+
+
+def _best_time(call, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        call()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def _peak(call):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = call()
+        return tracemalloc.get_traced_memory()[1], result
+    finally:
+        tracemalloc.stop()
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, codecs=None, repeat=3, memory=False, seed=0, progress=print):
+    codecs = codecs or [WHOLE_JSON] + available_codecs()
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for n in sizes:
+            recipes = make_synthetic_recipes(n, seed)
+            for name in codecs:
+                if progress is not None:
+                    progress(f'{name} n={n}')
+                codec = _codec(name)
+                path = os.path.join(folder, f'recipes-{n}.bin')
+                result = {'codec': name, 'n': n}
+                result['encode'] = _best_time(lambda: _encode(codec, recipes, path), repeat)
+                result['size'] = os.path.getsize(path)
+                result['decode'] = _best_time(lambda: _decode(codec, path), repeat)
+                if _decode(codec, path) != recipes:
+                    raise AssertionError(f'{name} did not read back the recipes it wrote')
+                if memory:
+                    result['encode_peak'], _ = _peak(lambda: _encode(codec, recipes, path))
+                    result['decode_peak'], _ = _peak(lambda: _decode(codec, path))
+                results.append(result)
+                os.remove(path)
+    return results
+
+
+def format_results(results):
+    memory = 'encode_peak' in results[0] if results else False
+    header = f"{'codec':<14}{'n':>9}{'size (MB)':>11}{'encode (s)':>12}{'decode (s)':>12}"
+    if memory:
+        header += f"{'enc peak (MB)':>15}{'dec peak (MB)':>15}"
+    lines = [header]
+    for r in results:
+        line = f"{r['codec']:<14}{r['n']:>9}{r['size'] / 2 ** 20:>11.2f}{r['encode']:>12.3f}{r['decode']:>12.3f}"
+        if memory:
+            line += f"{r['encode_peak'] / 2 ** 20:>15.1f}{r['decode_peak'] / 2 ** 20:>15.1f}"
+        lines.append(line)
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the size, encode time and decode time of the recipe codecs.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--codecs', nargs='+', help=f'codecs to compare (default: {WHOLE_JSON!r} and every installed codec)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per measurement, the best one is reported')
+    parser.add_argument('--memory', action='store_true', help='also measure the peak memory with tracemalloc')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    results = run_benchmark(args.sizes, args.codecs, args.repeat, args.memory, args.seed)
+    print(format_results(results))
+
+
+if __name__ == '__main__':
+    main()
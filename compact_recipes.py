@@ -0,0 +1,105 @@
+'''
+Compact recipes module - a smaller in-memory representation of the recipes.
+
+A recipe is normally a dictionary with an 'ingredients' list of strings and an 'instructions' string. Every recipe has its
+own dictionary and list, and when the recipes are loaded from JSON every ingredient is its own string, so "water" is stored
+again for every recipe using water. With many recipes most of the memory goes to these small objects.
+
+IngredientTable Class - the shared table of ingredient names. Every different ingredient is stored once and gets a number (id).
+
+CompactRecipe Class - one recipe, using __slots__ so the object has no dictionary of its own.
+    The ingredients are stored as an array of ingredient ids (4 bytes each) instead of a list of strings.
+    It is read like the recipe dictionary - recipe['ingredients'] gives the list of ingredient names and recipe['instructions']
+    the instructions - so get_recipe and the GUI work unchanged. It is read-only, a changed recipe is stored as a new CompactRecipe.
+
+CompactRecipeStore Class - behaves like the recipes dictionary, storing every recipe as a CompactRecipe with one shared table.
+    Used by RecipeManager(compact=True). See memory_report.py for the bytes per recipe before and after.
+'''
+import sys
+from array import array
+from collections.abc import Mapping, MutableMapping
+
+
+class IngredientTable:
+    def __init__(self):
+        self._ids = {}
+        self._names = []
+
+    def __len__(self):
+        return len(self._names)
+
+    def intern(self, ingredient):
+        ingredient_id = self._ids.get(ingredient)
+        if ingredient_id is None:
+            ingredient_id = len(self._names)
+            # sys.intern makes equal ingredient strings from other places share this string as well
+            self._names.append(sys.intern(ingredient))
+            self._ids[self._names[-1]] = ingredient_id
+        return ingredient_id
+
+    def name(self, ingredient_id):
+        return self._names[ingredient_id]
+
+
+class CompactRecipe(Mapping):
+    __slots__ = ('table', 'ingredient_ids', 'instructions')
+
+    _KEYS = ('ingredients', 'instructions')
+
+    def __init__(self, table, ingredients, instructions):
+        self.table = table
+        self.ingredient_ids = array('I', [table.intern(ingredient) for ingredient in ingredients])
+        self.instructions = instructions
+
+    @classmethod
+    def from_details(cls, table, details):
+        return cls(table, details['ingredients'], details['instructions'])
+
+    def __getitem__(self, key):
+        if key == 'ingredients':
+            return [self.table.name(ingredient_id) for ingredient_id in self.ingredient_ids]
+        if key == 'instructions':
+            return self.instructions
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(self._KEYS)
+
+    def __len__(self):
+        return len(self._KEYS)
+
+    def __repr__(self):
+        return f'CompactRecipe({dict(self)!r})'
+
+
+class CompactRecipeStore(MutableMapping):
+    def __init__(self, recipes=(), table=None):
+        self.table = table if table is not None else IngredientTable()
+        self._recipes = {}
+        if isinstance(recipes, Mapping):
+            recipes = recipes.items()
+        for name, details in recipes:
+            self[name] = details
+
+    def __getitem__(self, name):
+        return self._recipes[name]
+
+    def __setitem__(self, name, details):
+        if not isinstance(details, CompactRecipe) or details.table is not self.table:
+            details = CompactRecipe.from_details(self.table, details)
+        self._recipes[name] = details
+
+    def __delitem__(self, name):
+        del self._recipes[name]
+
+    def __contains__(self, name):
+        return name in self._recipes
+
+    def __iter__(self):
+        return iter(self._recipes)
+
+    def __len__(self):
+        return len(self._recipes)
+
+    def copy(self):
+        return {name: dict(details) for name, details in self._recipes.items()}
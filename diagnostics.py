@@ -0,0 +1,129 @@
+'''
+Diagnostics module - a window showing the instrumentation numbers (see instrumentation.py) while the application runs.
+
+DiagnosticsDialog Class - opened with the "Diagnostics" button in the main window.
+    Instrumentation on/off - enables or disables the counters and histograms. When it is off nothing is measured and it
+        costs nothing, so it can be switched on only for the operation being looked at.
+    The table lists every instrumented function that has been called, the slowest in total first, with the number of calls
+        and errors, the total time, and the mean, p50 and p99 time per call. It is refreshed every second.
+    Below it the storage engine statistics are shown when the engine has them (the cache hits and writes of CachedStorage).
+    Reset clears the numbers, Export writes them to diagnostics_output/ as JSON and in the Prometheus text format.
+    Profile - starts a cProfile or tracemalloc session, and stopping it shows the top functions (or allocations) in a new window
+        and saves the full profile in diagnostics_output/. Closing the window stops a running session.
+'''
+import tkinter as tk
+from tkinter import messagebox
+
+import instrumentation
+from instrumentation import ProfileSession
+
+
+class DiagnosticsDialog(tk.Toplevel):
+    REFRESH_INTERVAL = 1000
+
+    def __init__(self, master, get_manager):
+        super().__init__(master)
+        self.title("Diagnostics")
+        self.geometry("760x480")
+        # A function returning the recipe manager, which is None while the recipes are loading
+        self.get_manager = get_manager
+        self.session = None
+
+        controls = tk.Frame(self)
+        controls.pack(fill=tk.X, padx=5, pady=5)
+        self.enabled_var = tk.BooleanVar(value=instrumentation.is_enabled())
+        tk.Checkbutton(controls, text="Instrumentation", variable=self.enabled_var, command=self.toggle_instrumentation).pack(side=tk.LEFT)
+        tk.Button(controls, text="Reset", command=self.reset, relief=tk.FLAT, bg='#f0f0f0').pack(side=tk.LEFT, padx=5)
+        tk.Button(controls, text="Export", command=self.export, relief=tk.FLAT, bg='#f0f0f0').pack(side=tk.LEFT, padx=5)
+
+        self.profiler_var = tk.StringVar(value=ProfileSession.KINDS[0])
+        self.profile_button = tk.Button(controls, text="Start profile", command=self.toggle_profile, relief=tk.FLAT, bg='#f0f0f0')
+        self.profile_button.pack(side=tk.RIGHT)
+        tk.OptionMenu(controls, self.profiler_var, *ProfileSession.KINDS).pack(side=tk.RIGHT, padx=5)
+
+        # Read-only table in a fixed width font, so the columns line up
+        self.table = tk.Text(self, wrap=tk.NONE, font=('Courier', 10))
+        self.table.pack(fill=tk.BOTH, expand=True, padx=5)
+        self.table.config(state=tk.DISABLED)
+
+        self.storage_var = tk.StringVar()
+        tk.Label(self, textvariable=self.storage_var, anchor='w', justify=tk.LEFT).pack(fill=tk.X, padx=5, pady=5)
+
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+        self._after_id = None
+        self.refresh()
+
+    def toggle_instrumentation(self):
+        if self.enabled_var.get():
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+        self.refresh()
+
+    def reset(self):
+        instrumentation.reset()
+        self.refresh()
+
+    def export(self):
+        try:
+            json_path = instrumentation.export_json()
+            prometheus_path = instrumentation.export_prometheus()
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not export the numbers: {e}", parent=self)
+            return
+        messagebox.showinfo("Exported", f"Saved to {json_path} and {prometheus_path}", parent=self)
+
+    def toggle_profile(self):
+        if self.session is None:
+            session = ProfileSession(self.profiler_var.get())
+            try:
+                session.start()
+            except ValueError as e:
+                # cProfile refuses to start while another profiler is running
+                messagebox.showerror("Error", f"Could not start the profiler: {e}", parent=self)
+                return
+            self.session = session
+            self.profile_button.config(text="Stop profile")
+            return
+        session, self.session = self.session, None
+        self.profile_button.config(text="Start profile")
+        _, report = session.stop()
+        ReportDialog(self, f"{session.kind} report", report)
+
+    # Redrawing the table and scheduling the next refresh, replacing the one already scheduled so there is only ever one
+    def refresh(self):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        self.table.config(state=tk.NORMAL)
+        self.table.delete('1.0', tk.END)
+        self.table.insert(tk.END, instrumentation.format_table())
+        self.table.config(state=tk.DISABLED)
+
+        manager = self.get_manager()
+        storage = manager.storage if manager is not None else None
+        if storage is not None and hasattr(storage, 'stats'):
+            self.storage_var.set(f"{type(storage).__name__}: " + ", ".join(f"{key} {value:.2f}" if isinstance(value, float)
+                                                                        else f"{key} {value}" for key, value in storage.stats().items()))
+        elif storage is not None:
+            self.storage_var.set(f"Storage engine: {type(storage).__name__}")
+        self._after_id = self.after(self.REFRESH_INTERVAL, self.refresh)
+
+    def on_close(self):
+        if self._after_id is not None:
+            self.after_cancel(self._after_id)
+            self._after_id = None
+        if self.session is not None:
+            self.session.stop()
+        self.destroy()
+
+
+class ReportDialog(tk.Toplevel):
+    def __init__(self, master, title, report):
+        super().__init__(master)
+        self.title(title)
+        self.geometry("900x500")
+        text = tk.Text(self, wrap=tk.NONE, font=('Courier', 10))
+        text.pack(fill=tk.BOTH, expand=True)
+        text.insert(tk.END, report)
+        text.config(state=tk.DISABLED)
@@ -0,0 +1,108 @@
+'''
+Fuzzy benchmark module - compares the trigram index in fuzzy_search.py with a brute-force scan using difflib.
+
+For every catalogue size, random recipe names are generated from made-up words (the synthetic names in benchmark.py only
+differ in their number, which is not how real names look). The queries are existing names with one or two random typos
+(a character inserted, deleted or changed). Both methods are asked for the 5 closest names:
+- difflib: difflib.get_close_matches, which compares the query with every name.
+- index: FuzzyNameIndex.closest.
+For each method the report shows the median time per query and how often the original name was among the results (recall).
+
+Usage:
+    python fuzzy_benchmark.py --sizes 1000 10000 100000 --queries 50
+'''
+import argparse
+import difflib
+import random
+import statistics
+import time
+
+from fuzzy_search import FuzzyNameIndex
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+
+_CONSONANTS = 'bcdfghjklmnprstvwz'
+_VOWELS = 'aeiou'
+
+
+# A made-up word of 1 to 3 syllables, like "tavo" or "rembiku"
+def _word(rng):
+    syllables = []
+    for _ in range(rng.randint(1, 3)):
+        syllable = rng.choice(_CONSONANTS) + rng.choice(_VOWELS)
+        if rng.random() < 0.3:
+            syllable += rng.choice(_CONSONANTS)
+        syllables.append(syllable)
+    return ''.join(syllables)
+
+
+def make_names(n, seed=0):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < n:
+        names.add(' '.join(_word(rng) for _ in range(rng.randint(2, 3))).title())
+    return sorted(names)
+
+
+def add_typos(name, rng, typos=1):
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    for _ in range(typos):
+        position = rng.randrange(len(name))
+        kind = rng.choice(('insert', 'delete', 'change'))
+        if kind == 'insert':
+            name = name[:position] + rng.choice(letters) + name[position:]
+        elif kind == 'delete' and len(name) > 1:
+            name = name[:position] + name[position + 1:]
+        else:
+            name = name[:position] + rng.choice(letters) + name[position + 1:]
+    return name
+
+
+def _run(method, queries):
+    times = []
+    hits = 0
+    for query, original in queries:
+        start = time.perf_counter()
+        results = method(query)
+        times.append(time.perf_counter() - start)
+        hits += original in results
+    return {'median': statistics.median(times), 'recall': hits / len(queries)}
+
+
+def run_benchmark(sizes=DEFAULT_SIZES, queries=50, limit=5, seed=0):
+    rng = random.Random(seed)
+    results = []
+    for n in sizes:
+        names = make_names(n, seed)
+        start = time.perf_counter()
+        index = FuzzyNameIndex.build(names)
+        build_time = time.perf_counter() - start
+        sample = [(add_typos(original, rng, rng.randint(1, 2)), original) for original in rng.sample(names, queries)]
+
+        brute = _run(lambda query: difflib.get_close_matches(query, names, limit), sample)
+        indexed = _run(lambda query: [name for name, _ in index.closest(query, limit)], sample)
+        results.append({'n': n, 'build': build_time, 'difflib': brute, 'index': indexed})
+    return results
+
+
+def format_results(results):
+    lines = [f"{'n':>9}{'build (s)':>11}{'difflib (ms)':>14}{'recall':>8}{'index (ms)':>12}{'recall':>8}{'speedup':>9}"]
+    for r in results:
+        brute, indexed = r['difflib'], r['index']
+        lines.append(f"{r['n']:>9}{r['build']:>11.2f}{brute['median'] * 1e3:>14.3f}{brute['recall']:>8.0%}"
+                     f"{indexed['median'] * 1e3:>12.3f}{indexed['recall']:>8.0%}{brute['median'] / indexed['median']:>8.0f}x")
+    return '\n'.join(lines)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare the fuzzy name index with a brute-force difflib scan.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--queries', type=int, default=50, help='number of misspelled names to look up for each size')
+    parser.add_argument('--limit', type=int, default=5, help='number of closest names asked for')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+    print(format_results(run_benchmark(args.sizes, args.queries, args.limit, args.seed)))
+
+
+if __name__ == '__main__':
+    main()
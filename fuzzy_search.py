@@ -0,0 +1,181 @@
+'''
+Fuzzy search module - typo-tolerant lookup of recipe names.
+
+get_recipe only finds a recipe when the name is typed exactly. The FuzzyNameIndex finds the recipe names closest to what was
+typed, measured in edit distance (Levenshtein distance, the number of characters that have to be inserted, deleted or changed).
+Names are compared case-folded, so "potbread" finds "PotBread" at distance 0 and "Frenchpress Cofee" finds
+"Frenchpress Coffee" at distance 1.
+
+Comparing the typed text with every recipe name takes time proportional to the size of the catalogue. Instead the index keeps
+a trigram index: every name is padded ("$$potbread$$") and split in the overlapping 3-character pieces it contains
+("$$p", "$po", "pot", ...), and each trigram maps to the names containing it. One typo changes at most 3 of the trigrams of a
+name, so a name within edit distance d of the query still shares all but 3 * d of the query's trigrams.
+A lookup only reads the lists of the query's own trigrams, and counts for each name found there how many trigrams it shares
+with the query. The count gives a lower bound on the distance. The names are then compared with the query character by
+character (the slow part) from the lowest bound up, stopping as soon as the names left cannot be closer than the ones found.
+So only names that look alike are compared, instead of the whole catalogue like difflib.get_close_matches does.
+
+FuzzyNameIndex Class
+    add_recipe / remove_recipe - keeps the index up to date when a recipe is added or deleted, like the other indexes.
+    closest - the closest names as (name, distance), nearest first.
+
+See fuzzy_benchmark.py for a comparison with a brute-force scan using difflib.
+'''
+from collections import Counter
+from itertools import chain
+
+_PAD = '$$'
+
+
+def _key(name):
+    return name.casefold()
+
+
+# The trigrams of a key, with how many times each appears
+def trigrams(key):
+    padded = _PAD + key + _PAD
+    counts = {}
+    for i in range(len(padded) - 2):
+        gram = padded[i:i + 3]
+        counts[gram] = counts.get(gram, 0) + 1
+    return counts
+
+
+# Levenshtein distance, giving up (returning max_distance + 1) as soon as the distance is known to be larger than max_distance
+def edit_distance(a, b, max_distance=None):
+    if max_distance is None:
+        max_distance = max(len(a), len(b))
+    too_far = max_distance + 1
+    if abs(len(a) - len(b)) > max_distance:
+        return too_far
+    if len(a) < len(b):
+        a, b = b, a
+    # Only the cells at most max_distance away from the diagonal can be within max_distance, the others count as too far
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        lo = max(1, i - max_distance)
+        hi = min(len(b), i + max_distance)
+        current = [too_far] * (len(b) + 1)
+        if lo == 1:
+            current[0] = i
+        row_min = current[0]
+        for j in range(lo, hi + 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != b[j - 1]))
+            current[j] = value
+            if value < row_min:
+                row_min = value
+        if row_min > max_distance:
+            return too_far
+        previous = current
+    return min(previous[-1], too_far)
+
+
+class FuzzyNameIndex:
+    def __init__(self):
+        # trigram -> set of keys (case-folded names) containing it
+        self._postings = {}
+        # key -> set of recipe names with that key, names differing only in case share a key
+        self._names = {}
+        # length -> set of keys of that length, for short queries that can be close to names sharing no trigram with them
+        self._lengths = {}
+
+    @classmethod
+    def build(cls, recipes):
+        index = cls()
+        for name in recipes:
+            index.add_recipe(name)
+        return index
+
+    def __len__(self):
+        return sum(len(names) for names in self._names.values())
+
+    # details is not used, the argument is there so the manager can update all indexes the same way
+    def add_recipe(self, name, details=None):
+        key = _key(name)
+        names = self._names.get(key)
+        if names is None:
+            names = self._names[key] = set()
+            for gram in trigrams(key):
+                self._postings.setdefault(gram, set()).add(key)
+            self._lengths.setdefault(len(key), set()).add(key)
+        names.add(name)
+
+    def remove_recipe(self, name):
+        key = _key(name)
+        names = self._names.get(key)
+        if names is None or name not in names:
+            return False
+        names.discard(name)
+        if not names:
+            del self._names[key]
+            for gram in trigrams(key):
+                keys = self._postings[gram]
+                keys.discard(key)
+                if not keys:
+                    del self._postings[gram]
+            keys = self._lengths[len(key)]
+            keys.discard(key)
+            if not keys:
+                del self._lengths[len(key)]
+        return True
+
+    # Returning up to limit (name, distance) tuples, nearest first and alphabetically for equal distances.
+    # max_distance defaults to a third of the length of the query (at least 2), names further away are never returned.
+    def closest(self, query, limit=5, max_distance=None):
+        query = _key(query.strip())
+        if not query or limit <= 0:
+            return []
+        if max_distance is None:
+            max_distance = max(2, len(query) // 3)
+        grams = trigrams(query)
+        size = sum(grams.values())
+
+        # Counting for every name how many of the query's trigrams it has, using the postings of the query's trigrams only
+        shared = Counter()
+        for gram, count in grams.items():
+            keys = self._postings.get(gram)
+            if keys:
+                shared.update(keys if count == 1 else dict.fromkeys(keys, count))
+
+        # Every typo removes at most 3 of the trigrams the query and the name have in common, which gives a lower bound
+        # on the distance without comparing the strings. The names are grouped by that bound.
+        waiting = {}
+        for key, count in shared.items():
+            bound = -(-(size - count) // 3)
+            if bound <= max_distance:
+                waiting.setdefault(bound, []).append(key)
+        # A name sharing no trigram at all is still within reach of a very short query (4 characters or less), but only
+        # if its length is within max_distance of the query's, so only the keys of those lengths are compared
+        unshared_bound = -(-size // 3)
+
+        # Going through the groups from the lowest bound, and stopping when the names left cannot be closer than the ones found.
+        # Once enough names are found, the edit distances are only computed up to the distance of the furthest of them.
+        matches = {}
+        cutoff = max_distance
+        for bound in range(max_distance + 1):
+            if bound > cutoff:
+                break
+            keys = waiting.get(bound, ())
+            if bound == unshared_bound:
+                lengths = range(max(0, len(query) - cutoff), len(query) + cutoff + 1)
+                keys = chain(keys, (key for length in lengths for key in self._lengths.get(length, ()) if key not in shared))
+            for key in keys:
+                distance = edit_distance(query, key, cutoff)
+                if distance <= cutoff:
+                    matches.setdefault(distance, []).extend(self._names[key])
+                    cutoff = self._cutoff(matches, limit, cutoff)
+
+        results = []
+        for distance in sorted(matches):
+            results.extend((name, distance) for name in sorted(matches[distance]))
+        return results[:limit]
+
+    # The smallest distance d with at least limit names found within d, the names further away are no longer needed
+    @staticmethod
+    def _cutoff(matches, limit, cutoff):
+        found = 0
+        for distance in sorted(matches):
+            found += len(matches[distance])
+            if found >= limit:
+                return min(distance, cutoff)
+        return cutoff
@@ -6,10 +6,21 @@ Importing tkinter library for creating the gui. from the recipe_manager file I a
 
 RecipeGUI Class - This class is the main application window, showing the recipe list and buttons for interacting with the application.
     Setup main application window
-    Initializing RecipeManager to handle recipe data
-    Creating a listbox for displaying recipe names
+    Initializing a BackgroundWorker (see background.py), which runs loading, saving and importing outside of the tkinter event loop
+    Initializing RecipeManager to handle recipe data, in the background. The buttons are enabled when the recipes are loaded.
+    Creating a filter box, the list is narrowed to the recipe names starting with the typed text on every keystroke
+    When no name starts with the typed text, the closest names are suggested in the status line (typos like "potbred" still
+    find "PotBread"), and pressing Enter in the filter box opens the closest recipe. The fuzzy index used for this is built
+    by the worker after the recipes are loaded, there are no suggestions until it is ready
+    Creating a virtual list view (see virtual_list.py) for displaying recipe names, it only draws the rows that are visible
     Creating buttons for refreshing the list, adding, viewing, and deleting recipes
-    Automatically refresh the listbox with current recipes on startup
+    Automatically refresh the list with current recipes on startup
+    Adding and deleting recipes only inserts or removes that one name in the list, instead of rebuilding the whole list
+    The recipe manager does not write to disk itself (autoflush=False), the changes are flushed by the worker after every add and delete
+    Importing recipes from a JSON-lines or CSV file, with progress in the status line and a cancel button
+    Closing the window waits for the pending writes and closes the recipe manager
+    The Diagnostics button opens a window with the call counts and times of the recipe manager and the storage engine,
+    and can profile a session with cProfile or tracemalloc (see diagnostics.py and instrumentation.py)
 
 AddRecipeDialog Class - This class creates a dialog for adding new recipes, to input a recipes name, ingredients, and instructions.
     Initializing dialog components
@@ -20,31 +31,51 @@ AddRecipeDialog Class - This class creates a dialog for adding new recipes, to i
 RecipeViewDialog Class - This class provides a window to view the detailed information of a recipe(ingredients and instructions).
     Display a new window with the selected recipe's details
     Layout components to show ingredients and instructions in a read-only format using the text widgets.
+    Below them a "More like this" list with the recipes using the most similar ingredients (see recommender.py),
+    double clicking one of them opens that recipe. The list is found by the worker and added when it is ready.
 
 
 '''
 import tkinter as tk
-from tkinter import simpledialog, messagebox
-from recipe_manager import RecipeManager
+from tkinter import simpledialog, messagebox, filedialog
+from recipe_manager import RecipeManager, BulkResult
+from importers import read_csv, read_jsonl
+from background import BackgroundWorker
 from performance_test import PerformanceDialog
+from diagnostics import DiagnosticsDialog
+from virtual_list import VirtualListView
 
 
 class RecipeGUI:
-    def __init__(self, master):
+    def __init__(self, master, compact=False):
         # Initialize the window of the main application
         self.master = master
+        # Passed to the RecipeManager, see compact_recipes.py
+        self.compact = compact
         master.title("Recipe Manager")
         # Setting the size of the dialog window initially, but does not restrict resizing.
-        master.geometry("300x300") 
+        master.geometry("300x390") 
         master.resizable(True, True)
+        # Flushing pending writes before the window is closed
+        master.protocol("WM_DELETE_WINDOW", self.on_close)
 
-        # Creating an instance based on the recipe manager class. 
-        self.recipe_manager = RecipeManager()
-        
+        # The worker running saves, loads and imports in the background, the results are handled in the tkinter thread
+        self.worker = BackgroundWorker(master)
+        # The recipe manager is created in the background, and is None until the recipes are loaded
+        self.recipe_manager = None
+        self.fuzzy_ready = False
+        self.import_task = None
 
-        # The listbox, where the recipe-names will be displayed
-        self.listbox = tk.Listbox(master)
-        self.listbox.pack()
+        # The filter box, narrowing the list of recipe-names as you type
+        self.filter_var = tk.StringVar()
+        self.filter_var.trace_add('write', lambda *args: self.on_filter())
+        self.filter_entry = tk.Entry(master, textvariable=self.filter_var)
+        self.filter_entry.bind('<Return>', lambda event: self.open_closest_recipe())
+        self.filter_entry.pack(fill=tk.X, padx=5, pady=(5, 0))
+
+        # The list view, where the recipe-names will be displayed
+        self.list_view = VirtualListView(master)
+        self.list_view.pack(fill=tk.BOTH, expand=True, padx=5, pady=5)
 
         # Adding buttons for the different functions, setting relief to flat to not 'pop out'.
         self.refresh_button = tk.Button(master, text="Refresh", command=self.refresh, relief=tk.FLAT, bg='#f0f0f0')
@@ -56,59 +87,223 @@ class RecipeGUI:
         self.view_button = tk.Button(master, text="View Recipe", command=self.view_recipe, relief=tk.FLAT, bg='#f0f0f0')
         self.view_button.pack()
 
-        self.view_button = tk.Button(master, text="Delete Recipe", command=self.delete_recipe, relief=tk.FLAT, bg='#f0f0f0')
-        self.view_button.pack()
+        self.delete_button = tk.Button(master, text="Delete Recipe", command=self.delete_recipe, relief=tk.FLAT, bg='#f0f0f0')
+        self.delete_button.pack()
+
+        self.import_button = tk.Button(master, text="Import Recipes", command=self.import_recipes, relief=tk.FLAT, bg='#f0f0f0')
+        self.import_button.pack()
 
         self.performance_button = tk.Button(master, text="Performance testing", command=self.show_performance, relief=tk.FLAT, bg='#f0f0f0')
         self.performance_button.pack()
 
+        self.diagnostics_button = tk.Button(master, text="Diagnostics", command=self.show_diagnostics, relief=tk.FLAT, bg='#f0f0f0')
+        self.diagnostics_button.pack()
+
+        # Status line at the bottom, with a cancel button for long running imports
+        status_frame = tk.Frame(master)
+        status_frame.pack(fill=tk.X, side=tk.BOTTOM)
+        self.status_var = tk.StringVar(value="Loading recipes...")
+        tk.Label(status_frame, textvariable=self.status_var, anchor='w').pack(side=tk.LEFT, fill=tk.X, expand=True)
+        self.cancel_button = tk.Button(status_frame, text="Cancel", command=self.cancel_import, relief=tk.FLAT, bg='#f0f0f0')
+
+        # Buttons that need the recipes, disabled until they are loaded
+        self.recipe_buttons = [self.refresh_button, self.add_button, self.view_button, self.delete_button, self.import_button]
+        self.set_buttons_state(tk.DISABLED)
+        self.worker.submit(load_manager, self.compact, on_done=self.on_loaded, on_error=self.on_load_error)
+
+    def set_buttons_state(self, state):
+        for button in self.recipe_buttons:
+            button.config(state=state)
+
+    def on_loaded(self, recipe_manager):
+        self.recipe_manager = recipe_manager
+        self.set_buttons_state(tk.NORMAL)
         self.refresh()
+        # The name suggestions need the fuzzy index, which is built by the worker instead of on the first keystroke
+        self.worker.submit(lambda task: recipe_manager.fuzzy_index, on_done=self.on_fuzzy_index_ready)
+
+    def on_fuzzy_index_ready(self, fuzzy_index):
+        self.fuzzy_ready = True
+        self.on_filter()
+
+    def on_load_error(self, error):
+        self.status_var.set("Recipes could not be loaded.")
+        messagebox.showerror("Error", f"Recipes could not be loaded: {error}")
 
-    # Clearing the listbox, then loading and displaying recipe names from the recipe manager
+    # Loading and displaying all recipe names from the recipe manager
     def refresh(self):
-        self.listbox.delete(0, tk.END)
-        for recipe_name in self.recipe_manager.list_recipes():
-            self.listbox.insert(tk.END, recipe_name)
+        self.list_view.set_index(self.recipe_manager.ordered_index)
+        self.status_var.set(f"{len(self.recipe_manager.recipes_dict)} recipes")
 
-    # Opening a dialog window for adding a recipe. Processes the result, adding the recipe and then refreshing the listbox again.
+    # Narrowing the list, and suggesting the closest names when nothing starts with the typed text
+    def on_filter(self):
+        text = self.filter_var.get()
+        self.list_view.set_filter(text)
+        if self.recipe_manager is None:
+            return
+        if text.strip() and self.list_view.visible_count() == 0 and self.fuzzy_ready:
+            suggestions = [name for name, _ in self.recipe_manager.closest_recipe_names(text, limit=3)]
+            if suggestions:
+                self.status_var.set(f"Did you mean: {', '.join(suggestions)}?")
+            else:
+                self.status_var.set("No matching recipes.")
+        else:
+            self.status_var.set(f"{len(self.recipe_manager.recipes_dict)} recipes")
+
+    # Opening the recipe with the typed name, or the closest name if there is no recipe with exactly that name
+    def open_closest_recipe(self):
+        text = self.filter_var.get().strip()
+        if self.recipe_manager is None or not text:
+            return
+        if self.recipe_manager.get_recipe(text) is not None:
+            self.show_recipe(text)
+            return
+        manager = self.recipe_manager
+        self.worker.submit(lambda task: manager.closest_recipe_names(text, limit=1),
+                           on_done=lambda closest: self.on_closest_found(text, closest))
+
+    def on_closest_found(self, text, closest):
+        if closest:
+            self.show_recipe(closest[0][0])
+        else:
+            messagebox.showerror("Error", f"No recipe found close to '{text}'.")
+
+    # Changes are made in memory right away, and written to disk by the worker. Serial tasks keep the writes in order.
+    def save_in_background(self):
+        self.worker.submit(lambda task: self.recipe_manager.flush(), serial=True, on_error=self.on_save_error)
+
+    def on_save_error(self, error):
+        messagebox.showerror("Error", f"Recipes could not be saved: {error}\n\nThey are saved again with the next change, or when the window is closed.")
+
+    # Opening a dialog window for adding a recipe. Processes the result, adding the recipe and then inserting the name in the list.
     def add_recipe(self):
         dialog = AddRecipeDialog(self.master)
         if dialog.result:
             name, ingredients, instructions = dialog.result
             added = self.recipe_manager.add_recipe_dict(name, ingredients, instructions)
             if added:
-                self.refresh()
+                self.list_view.changed()
+                self.list_view.see(name)
+                self.save_in_background()
             else:
                 messagebox.showerror("Error", "Recipe could not be added. It may already exist.")
 
     # Opening a dialog window for viewing a recipe that is selected in the listbox above. Display the details of the selected recipes. 
     def view_recipe(self):
-        try:
-            selection = self.listbox.curselection()[0]
-            recipe_name = self.listbox.get(selection)
-            recipe = self.recipe_manager.get_recipe(recipe_name)
-            ingredients = "\n".join(recipe["ingredients"])  
-            instructions = recipe["instructions"]
-            RecipeViewDialog(self.master, recipe_name, ingredients, instructions)
-        except IndexError:
+        recipe_name = self.list_view.selected()
+        if recipe_name is None:
             messagebox.showerror("Error", "No recipe selected.")
+            return
+        self.show_recipe(recipe_name)
+
+    # The similar recipes are found by the worker, building the recommender the first time takes a while with a large catalogue
+    def show_recipe(self, recipe_name):
+        recipe = self.recipe_manager.get_recipe(recipe_name)
+        ingredients = "\n".join(recipe["ingredients"])  
+        instructions = recipe["instructions"]
+        dialog = RecipeViewDialog(self.master, recipe_name, ingredients, instructions, on_open=self.show_recipe)
+        manager = self.recipe_manager
+        self.worker.submit(lambda task: [name for name, _ in manager.similar_recipes(recipe_name)], on_done=dialog.show_similar,
+                           on_error=lambda error: dialog.show_similar([]))
     
-    # When a recipe name is selected in the listbox, the delete function is called from the delete button. Using the recipe manager to delete the the recipe, and refreshing the list again.
+    # When a recipe name is selected in the list, the delete function is called from the delete button. Using the recipe manager to delete the the recipe, and removing the name from the list.
     def delete_recipe(self):
-        try:
-            selection = self.listbox.curselection()[0]
-            recipe_name = self.listbox.get(selection)
-            deleted = self.recipe_manager.delete_recipe_dict(recipe_name)
-            if deleted:
-                self.refresh()
-            else:
-                messagebox.showerror("Error", "Recipe could not be deleted. It may not exist.")
-        except IndexError:
+        recipe_name = self.list_view.selected()
+        if recipe_name is None:
             messagebox.showerror("Error", "No recipe selected.")
-    
+            return
+        deleted = self.recipe_manager.delete_recipe_dict(recipe_name)
+        if deleted:
+            self.list_view.changed()
+            self.save_in_background()
+        else:
+            messagebox.showerror("Error", "Recipe could not be deleted. It may not exist.")
+
+    # Importing recipes from a JSON-lines or CSV file. The file is read in the background and sent back in chunks,
+    # each chunk is added to the recipe manager in the tkinter thread, so the manager is only ever changed from one thread.
+    def import_recipes(self):
+        path = filedialog.askopenfilename(title="Import recipes", filetypes=[("Recipe files", "*.jsonl *.csv"), ("All files", "*.*")])
+        if not path:
+            return
+        self.import_button.config(state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.RIGHT)
+        self.import_result = BulkResult('added')
+        self.import_task = self.worker.submit(read_import_file, path, on_progress=self.on_import_chunk,
+                                              on_done=self.on_import_done, on_error=self.on_import_error)
+
+    def on_import_chunk(self, chunk):
+        self.import_result.merge(self.recipe_manager.add_recipes_bulk(chunk))
+        self.list_view.changed()
+        self.status_var.set(f"Importing... {self.import_result}")
+
+    def on_import_done(self, result):
+        self.finish_import()
+        messagebox.showinfo("Import", f"Import finished: {self.import_result}")
+
+    def on_import_error(self, error):
+        self.finish_import()
+        messagebox.showerror("Error", f"Import failed: {error}")
+
+    def cancel_import(self):
+        if self.import_task is not None:
+            self.import_task.cancel()
+            self.finish_import()
+
+    def finish_import(self):
+        self.import_task = None
+        self.cancel_button.pack_forget()
+        self.import_button.config(state=tk.NORMAL)
+        self.refresh()
+        self.save_in_background()
+
     def show_performance(self):
         PerformanceDialog(self.master)
 
+    def show_diagnostics(self):
+        DiagnosticsDialog(self.master, lambda: self.recipe_manager)
+
+    # Closing the window - cancelling imports, waiting for the pending writes and closing the recipe manager
+    def on_close(self):
+        self.status_var.set("Saving...")
+        self.master.update_idletasks()
+        if self.recipe_manager is not None:
+            self.save_in_background()
+        # An open performance window has its own worker, a running test or sweep would keep the program alive until it ends
+        for window in self.master.winfo_children():
+            if isinstance(window, PerformanceDialog):
+                window.on_close()
+        self.worker.shutdown(cancel_pending=True)
+        while self.recipe_manager is not None:
+            try:
+                self.recipe_manager.close()
+                break
+            except Exception as e:
+                # The changes are still waiting in the manager, asking before closing the window loses them
+                if not messagebox.askretrycancel("Error", f"Recipes could not be saved: {e}\n\nCancel closes without saving them."):
+                    break
+        self.master.destroy()
+
+
+# Loading the recipes in the background, with the ordered index the list view shows
+def load_manager(task, compact=False):
+    recipe_manager = RecipeManager(autoflush=False, compact=compact)
+    recipe_manager.ordered_index
+    return recipe_manager
+
+
+# Reading an import file in the background, sending the records to the tkinter thread in chunks
+def read_import_file(task, path, chunk_size=1000):
+    reader = read_csv if path.lower().endswith('.csv') else read_jsonl
+    chunk = []
+    for record in reader(path):
+        chunk.append(record)
+        if len(chunk) >= chunk_size:
+            task.check()
+            task.report(chunk)
+            chunk = []
+    if chunk:
+        task.report(chunk)
+
 
 class AddRecipeDialog(simpledialog.Dialog):
     def body(self, master):
@@ -139,12 +334,13 @@ class AddRecipeDialog(simpledialog.Dialog):
         self.result = (name, ingredients, instructions)
 
 class RecipeViewDialog(tk.Toplevel):
-    def __init__(self, master, title, ingredients, instructions):
+    def __init__(self, master, title, ingredients, instructions, similar=(), on_open=None):
         super().__init__(master)
         # Setup window title, size, and disable resizing
         self.title(title)
         self.geometry("400x300")
         self.resizable(False, False)
+        self.on_open = on_open
 
         # Create and layout labels and text boxes for displaying the ingredients
         tk.Label(self, text="Ingredients:", font=('Arial', 14, 'bold')).pack(pady=(10, 0))
@@ -160,5 +356,23 @@ class RecipeViewDialog(tk.Toplevel):
         instructions_text.pack(padx=10, pady=(0,10))
         instructions_text.insert(tk.END, instructions)
         # Read-only
-        instructions_text.config(state=tk.DISABLED)  
+        instructions_text.config(state=tk.DISABLED)
+
+        if similar:
+            self.show_similar(similar)
+
+    # The recipes with the most similar ingredients, double clicking one opens it in a new window.
+    # Called when the worker has found them, so the window may have been closed in the meantime.
+    def show_similar(self, similar):
+        if not similar or not self.winfo_exists():
+            return
+        self.geometry("400x420")
+        tk.Label(self, text="More like this:", font=('Arial', 14, 'bold')).pack()
+        similar_list = tk.Listbox(self, height=len(similar))
+        similar_list.pack(fill=tk.X, padx=10, pady=(0, 10))
+        for name in similar:
+            similar_list.insert(tk.END, name)
+        if self.on_open is not None:
+            similar_list.bind('<Double-Button-1>',
+                              lambda event: similar_list.curselection() and self.on_open(similar_list.get(similar_list.curselection()[0])))
 
@@ -0,0 +1,70 @@
+'''
+Importers module - reads recipes from JSON-lines and CSV files, one recipe at a time.
+
+Both readers are generators, so only the line being read is in memory and the source file can be much bigger than the memory.
+The records they produce are dictionaries with 'name', 'ingredients' and 'instructions', which is what RecipeManager.add_recipes_bulk takes.
+
+read_jsonl - one JSON object per line, for example
+    {"name": "PotBread", "ingredients": ["Water", "flour"], "instructions": "Mix well."}
+    Empty lines are skipped. A line that is not valid JSON becomes a BadRecord, so the import can count it as failed and carry on.
+
+read_csv - a CSV file with a header row containing name, ingredients and instructions.
+    The ingredients column is a comma separated list (quoted in the CSV file), split the same way AddRecipeDialog.apply does it.
+
+parse_record - checks a record and returns (name, ingredients, instructions), raising ValueError if the record can not be used.
+    Ingredients given as a string are split on commas and stripped, ingredients given as a list are stripped.
+'''
+import csv
+import json
+
+
+class BadRecord:
+    def __init__(self, location, reason):
+        self.location = location
+        self.reason = reason
+
+    def __repr__(self):
+        return f'BadRecord({self.location!r}, {self.reason!r})'
+
+
+def read_jsonl(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError as e:
+                yield BadRecord(f'{path}:{line_number}', str(e))
+
+
+def read_csv(path):
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for row in csv.DictReader(f):
+            yield row
+
+
+def parse_record(record):
+    if isinstance(record, BadRecord):
+        raise ValueError(f'{record.location}: {record.reason}')
+    if isinstance(record, (tuple, list)):
+        if len(record) != 3:
+            raise ValueError(f'Expected (name, ingredients, instructions), got {len(record)} values')
+        name, ingredients, instructions = record
+    elif isinstance(record, dict):
+        name = record.get('name')
+        ingredients = record.get('ingredients') or []
+        instructions = record.get('instructions') or ''
+    else:
+        raise ValueError(f'Unsupported record type {type(record).__name__}')
+
+    if not isinstance(name, str) or not name.strip():
+        raise ValueError('Recipe is missing a name')
+    if isinstance(ingredients, str):
+        ingredients = ingredients.split(',')
+    if not isinstance(ingredients, list) or not all(isinstance(i, str) for i in ingredients):
+        raise ValueError(f'Ingredients of {name!r} must be a list of strings')
+    if not isinstance(instructions, str):
+        raise ValueError(f'Instructions of {name!r} must be a string')
+    return name, [i.strip() for i in ingredients], instructions
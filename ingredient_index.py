@@ -0,0 +1,125 @@
+'''
+Ingredient index module - an inverted index from ingredients to the names of the recipes using them.
+
+Finding recipes by ingredient without an index means looking through the ingredients list of every recipe.
+The IngredientIndex keeps a dictionary from each normalized ingredient to the set of recipe names that use it,
+so a lookup only touches the recipes that actually contain the ingredient.
+
+Ingredients are normalized the same way AddRecipeDialog.apply splits them - on commas, with surrounding whitespace stripped -
+and are also case-folded, so "Water", " water" and "WATER" are the same ingredient.
+
+IngredientIndex Class
+    build - creates an index from an existing recipes dictionary.
+    add_recipe / remove_recipe - keeps the index up to date when a recipe is added or deleted.
+    query - AND / OR / NOT queries. all_of must all be present, at least one of any_of must be present, none of none_of may be present.
+        Starts from the smallest set of recipes for the all_of ingredients and intersects, so the work depends on the size of the answer.
+    recipes_for_pantry - "what can I cook" with the ingredients I have. Counts for each recipe how many of its ingredients
+        are in the pantry, and ranks the recipes by coverage (share of the recipe's ingredients that are in the pantry).
+'''
+from collections import Counter
+
+
+def normalize_ingredient(ingredient):
+    return ingredient.strip().casefold()
+
+
+# Accepting either a comma separated string (as typed in the add recipe dialog) or a list of ingredients. Empty entries are skipped.
+def normalize_ingredients(ingredients):
+    if isinstance(ingredients, str):
+        ingredients = ingredients.split(',')
+    tokens = (normalize_ingredient(i) for i in ingredients)
+    return {token for token in tokens if token}
+
+
+class IngredientIndex:
+    def __init__(self):
+        # ingredient -> set of recipe names
+        self._postings = {}
+        # recipe name -> frozenset of its ingredients, used when deleting and for the pantry coverage
+        self._recipe_ingredients = {}
+
+    @classmethod
+    def build(cls, recipes):
+        index = cls()
+        for name, details in recipes.items():
+            index.add_recipe(name, details)
+        return index
+
+    def __len__(self):
+        return len(self._recipe_ingredients)
+
+    def __contains__(self, ingredient):
+        return normalize_ingredient(ingredient) in self._postings
+
+    def add_recipe(self, name, details):
+        if name in self._recipe_ingredients:
+            self.remove_recipe(name)
+        tokens = frozenset(normalize_ingredients(details['ingredients']))
+        self._recipe_ingredients[name] = tokens
+        for token in tokens:
+            self._postings.setdefault(token, set()).add(name)
+
+    def remove_recipe(self, name):
+        tokens = self._recipe_ingredients.pop(name, None)
+        if tokens is None:
+            return False
+        for token in tokens:
+            names = self._postings[token]
+            names.discard(name)
+            # Removing ingredients that are no longer used, so the index does not grow forever
+            if not names:
+                del self._postings[token]
+        return True
+
+    def recipes_with(self, ingredient):
+        return set(self._postings.get(normalize_ingredient(ingredient), ()))
+
+    def ingredients_of(self, name):
+        return self._recipe_ingredients.get(name, frozenset())
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        all_of = normalize_ingredients(all_of)
+        any_of = normalize_ingredients(any_of)
+        none_of = normalize_ingredients(none_of)
+
+        if all_of:
+            postings = sorted((self._postings.get(token, set()) for token in all_of), key=len)
+            result = set(postings[0])
+            for names in postings[1:]:
+                if not result:
+                    break
+                result &= names
+            if any_of:
+                result = {name for name in result if not self._recipe_ingredients[name].isdisjoint(any_of)}
+        elif any_of:
+            result = set()
+            for token in any_of:
+                result |= self._postings.get(token, set())
+        else:
+            # Only NOT ingredients given, so start from every recipe
+            result = set(self._recipe_ingredients)
+
+        for token in none_of:
+            if not result:
+                break
+            result -= self._postings.get(token, set())
+        return sorted(result)
+
+    # Returning (name, coverage, missing ingredients) tuples, best coverage first, then fewest missing ingredients, then by name
+    def recipes_for_pantry(self, pantry, min_coverage=0.0, limit=None):
+        pantry = normalize_ingredients(pantry)
+        counts = Counter()
+        for token in pantry:
+            counts.update(self._postings.get(token, ()))
+
+        matches = []
+        for name, count in counts.items():
+            total = len(self._recipe_ingredients[name])
+            coverage = count / total
+            if coverage >= min_coverage:
+                matches.append((name, coverage, total - count))
+        matches.sort(key=lambda match: (-match[1], match[2], match[0]))
+        if limit is not None:
+            matches = matches[:limit]
+
+        return [(name, coverage, sorted(self._recipe_ingredients[name] - pantry)) for name, coverage, _ in matches]
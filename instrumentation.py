@@ -0,0 +1,306 @@
+'''
+Instrumentation module - counts and times the RecipeManager methods and the storage engine calls, and profiles sessions.
+
+Questions like "how much of an add is the dictionary insert and how much is writing JSON", or "how long does loading the
+recipes take at startup", need numbers from the running program. This module collects them:
+
+Counters and latency histograms - enable() replaces every public method (and property) of RecipeManager, every public method
+    of the storage engines (JsonFileStorage, JournalStorage, MemoryStorage, SQLiteStorage, CachedStorage), the module level
+    storage functions, and the encoding in the storage module (_encode_entry for journal lines, _read_snapshot and
+    _atomic_write for the files of JsonFileStorage) with a wrapper that counts the calls and errors, and adds the time of every call to a histogram.
+    The histogram buckets grow by 1, 2.5, 5 per power of ten from 1 us to 10 s, the same scale Prometheus uses, and the
+    percentiles are estimated from the buckets, so the memory used does not grow with the number of calls.
+    A call of add_recipe_dict is then "RecipeManager.add_recipe_dict", and the journal write it makes
+    "JournalStorage.record_change" and "storage._encode_entry", so the difference is the time spent in memory.
+    disable() puts the original functions back, so when instrumentation is off nothing is wrapped and it costs nothing at all.
+    Since the methods are replaced on the classes, managers and engines that already exist are measured as well.
+    To also measure the startup (loading the recipes), enable it before the manager is created: python main.py --instrument.
+
+Profiling sessions - ProfileSession('cprofile') or ProfileSession('tracemalloc'), started and stopped by hand (or from the
+    Diagnostics window). cProfile records the time spent in every function of the thread that started the session (the GUI
+    thread), tracemalloc the memory allocated from any thread by line. stop() returns a text report of the top entries
+    and saves the full profile (a .prof file for pstats / snakeviz, or the top allocations as text) in diagnostics_output/
+
+Export - export_json and export_prometheus write the counters and histograms as JSON or in the Prometheus text format,
+    which a Prometheus server (or node_exporter's textfile collector) can read. The HTTP server also serves the Prometheus
+    text on GET /metrics.
+
+The Diagnostics window (diagnostics.py) shows the same numbers while the application runs.
+'''
+import bisect
+import datetime
+import functools
+import json
+import os
+import threading
+import time
+
+DIAGNOSTICS_DIR = 'diagnostics_output'
+BUCKETS = [mantissa * 10.0 ** exponent for exponent in range(-6, 1) for mantissa in (1, 2.5, 5)] + [10.0]
+
+# name -> CallStats, and (owner, attribute) -> the original function, while instrumentation is enabled
+_stats = {}
+_originals = {}
+_lock = threading.Lock()
+
+
+class CallStats:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        # One count per bucket in BUCKETS, and one for the calls slower than the last bucket
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, failed=False):
+        bucket = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            self.calls += 1
+            self.errors += failed
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+            self.buckets[bucket] += 1
+
+    # Estimating a percentile by interpolating inside the bucket it falls in
+    def percentile(self, fraction):
+        if not self.calls:
+            return 0.0
+        rank = fraction * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            if count and seen + count >= rank:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else self.max
+                return min(self.max, lower + (upper - lower) * (rank - seen) / count)
+            seen += count
+        return self.max
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'total': self.total,
+            'mean': self.total / self.calls if self.calls else 0.0,
+            'max': self.max,
+            'p50': self.percentile(0.5),
+            'p90': self.percentile(0.9),
+            'p99': self.percentile(0.99),
+            'buckets': dict(zip([str(bound) for bound in BUCKETS] + ['+Inf'], self.buckets)),
+        }
+
+
+def _stats_for(name):
+    with _lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = CallStats(name)
+        return stats
+
+
+def _timed(fn, name):
+    stats = _stats_for(name)
+    perf_counter = time.perf_counter
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            stats.observe(perf_counter() - start, failed=True)
+            raise
+        stats.observe(perf_counter() - start)
+        return result
+    return wrapper
+
+
+# The classes and functions that are instrumented, imported when enable() is called
+def _targets():
+    import storage
+    from recipe_manager import RecipeManager
+    from sqlite_storage import SQLiteStorage
+    from cached_storage import CachedStorage
+    classes = [RecipeManager, storage.JsonFileStorage, storage.JournalStorage, storage.MemoryStorage, SQLiteStorage, CachedStorage]
+    functions = [(storage, name) for name in ('save_recipes', 'load_recipes', 'record_change', '_encode_entry', '_read_snapshot', '_atomic_write')]
+    return classes, functions
+
+
+# Context managers (like batch) only run until their first yield when called, so timing the call would say nothing
+_SKIPPED = {'batch'}
+
+
+def _patch(owner, attribute, replacement):
+    _originals[(owner, attribute)] = owner.__dict__[attribute]
+    setattr(owner, attribute, replacement)
+
+
+def enable():
+    if _originals:
+        return
+    classes, functions = _targets()
+    for cls in classes:
+        for attribute, value in list(vars(cls).items()):
+            if attribute in _SKIPPED or (attribute.startswith('_') and attribute != '__init__'):
+                continue
+            name = f'{cls.__name__}.{attribute}'
+            if isinstance(value, property) and value.fget is not None:
+                _patch(cls, attribute, property(_timed(value.fget, name), value.fset, value.fdel, value.__doc__))
+            elif callable(value) and not isinstance(value, (type, staticmethod, classmethod)):
+                _patch(cls, attribute, _timed(value, name))
+    for module, attribute in functions:
+        _patch(module, attribute, _timed(getattr(module, attribute), f'{module.__name__}.{attribute}'))
+
+
+def disable():
+    for (owner, attribute), original in _originals.items():
+        setattr(owner, attribute, original)
+    _originals.clear()
+
+
+def is_enabled():
+    return bool(_originals)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+    # The wrappers keep a reference to their CallStats, so they are put in again with new ones
+    if is_enabled():
+        disable()
+        enable()
+
+
+def snapshot():
+    with _lock:
+        stats = list(_stats.values())
+    return {s.name: s.as_dict() for s in sorted(stats, key=lambda s: s.name) if s.calls}
+
+
+def _default_path(extension):
+    os.makedirs(DIAGNOSTICS_DIR, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+    return os.path.join(DIAGNOSTICS_DIR, f'metrics-{timestamp}.{extension}')
+
+
+def export_json(path=None):
+    path = path or _default_path('json')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'timestamp': datetime.datetime.now().isoformat(timespec='seconds'), 'calls': snapshot()}, f, indent=2)
+    return path
+
+
+def _label(name):
+    return name.replace('\\', '\\\\').replace('"', '\\"')
+
+
+def prometheus_text():
+    lines = [
+        '# HELP recipes_calls_total Calls of instrumented recipe manager and storage functions.',
+        '# TYPE recipes_calls_total counter',
+    ]
+    stats = snapshot()
+    lines.extend(f'recipes_calls_total{{function="{_label(name)}"}} {s["calls"]}' for name, s in stats.items())
+    lines.append('# HELP recipes_call_errors_total Calls that raised an exception.')
+    lines.append('# TYPE recipes_call_errors_total counter')
+    lines.extend(f'recipes_call_errors_total{{function="{_label(name)}"}} {s["errors"]}' for name, s in stats.items())
+    lines.append('# HELP recipes_call_duration_seconds Time spent in instrumented functions.')
+    lines.append('# TYPE recipes_call_duration_seconds histogram')
+    for name, s in stats.items():
+        label = _label(name)
+        cumulative = 0
+        for bound, count in s['buckets'].items():
+            cumulative += count
+            le = bound if bound == '+Inf' else repr(float(bound))
+            lines.append(f'recipes_call_duration_seconds_bucket{{function="{label}",le="{le}"}} {cumulative}')
+        lines.append(f'recipes_call_duration_seconds_sum{{function="{label}"}} {s["total"]!r}')
+        lines.append(f'recipes_call_duration_seconds_count{{function="{label}"}} {s["calls"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def export_prometheus(path=None):
+    path = path or _default_path('prom')
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(prometheus_text())
+    return path
+
+
+class ProfileSession:
+    KINDS = ('cprofile', 'tracemalloc')
+
+    def __init__(self, kind='cprofile', top=30):
+        if kind not in self.KINDS:
+            raise ValueError(f'Unknown profiler {kind!r}, expected one of {", ".join(self.KINDS)}')
+        self.kind = kind
+        self.top = top
+        self.profiler = None
+        self.started = None
+
+    @property
+    def running(self):
+        return self.started is not None
+
+    def start(self):
+        if self.kind == 'cprofile':
+            import cProfile
+            profiler = cProfile.Profile()
+            # Raises ValueError when another profiler is already active (Python 3.12 and later)
+            profiler.enable()
+            self.profiler = profiler
+        else:
+            import tracemalloc
+            tracemalloc.start(10)
+        self.started = time.perf_counter()
+
+    # Stopping the session, saving the profile and returning (path, report text)
+    def stop(self):
+        if not self.running:
+            raise RuntimeError('The profiling session is not running')
+        elapsed = time.perf_counter() - self.started
+        self.started = None
+        os.makedirs(DIAGNOSTICS_DIR, exist_ok=True)
+        timestamp = datetime.datetime.now().strftime('%Y%m%d-%H%M%S')
+        if self.kind == 'cprofile':
+            return self._stop_cprofile(elapsed, os.path.join(DIAGNOSTICS_DIR, f'profile-{timestamp}.prof'))
+        return self._stop_tracemalloc(elapsed, os.path.join(DIAGNOSTICS_DIR, f'memory-{timestamp}.txt'))
+
+    def _stop_cprofile(self, elapsed, path):
+        import io
+        import pstats
+        self.profiler.disable()
+        self.profiler.dump_stats(path)
+        out = io.StringIO()
+        pstats.Stats(self.profiler, stream=out).sort_stats('cumulative').print_stats(self.top)
+        self.profiler = None
+        return path, f'cProfile session of {elapsed:.1f} s, saved to {path}\n{out.getvalue()}'
+
+    def _stop_tracemalloc(self, elapsed, path):
+        import tracemalloc
+        snapshot = tracemalloc.take_snapshot()
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        statistics = snapshot.statistics('lineno')
+        lines = [f'tracemalloc session of {elapsed:.1f} s - allocated now {current / 2 ** 20:.2f} MB, peak {peak / 2 ** 20:.2f} MB',
+                 f'Top {self.top} lines by allocated memory:']
+        lines.extend(str(stat) for stat in statistics[:self.top])
+        report = '\n'.join(lines)
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(report + '\n')
+            f.write('\n'.join(str(stat) for stat in statistics[self.top:]) + '\n')
+        return path, report
+
+
+def format_table(stats=None):
+    stats = snapshot() if stats is None else stats
+    if not stats:
+        return 'No calls recorded.' if is_enabled() else 'Instrumentation is off.'
+    width = max(len(name) for name in stats)
+    lines = [f"{'function':<{width}}{'calls':>9}{'errors':>8}{'total (ms)':>12}{'mean (us)':>11}{'p50 (us)':>10}{'p99 (us)':>10}"]
+    for name, s in sorted(stats.items(), key=lambda item: -item[1]['total']):
+        lines.append(f"{name:<{width}}{s['calls']:>9}{s['errors']:>8}{s['total'] * 1e3:>12.2f}{s['mean'] * 1e6:>11.1f}"
+                     f"{s['p50'] * 1e6:>10.1f}{s['p99'] * 1e6:>10.1f}")
+    return '\n'.join(lines)
+
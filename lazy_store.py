@@ -0,0 +1,252 @@
+'''
+Lazy store module - reads recipes from the snapshot file only when they are asked for.
+
+Parsing the whole recipes.json at startup makes the startup time and memory grow with the size of the catalogue, even though
+the main window only shows the recipe names. Instead the snapshot is memory-mapped, and an offset table is kept next to it
+in recipes.json.idx. The offset table maps every recipe name to the start and end byte of its details in recipes.json.
+The offset table is one JSON header line, one line with the JSON list of names, and then the start and end positions as a
+binary array, so reading it is much cheaper than parsing the recipes themselves.
+
+write_snapshot - writes recipes.json one recipe at a time, remembering where each recipe starts and ends, and then writes
+    the offset table. The file is still ordinary JSON, so it can be read by anything that reads the old format.
+    The records are encoded with the fastest JSON codec that is installed (orjson, see recipe_codecs.py). The snapshot has to
+    stay JSON for the offsets and the journal, so the binary codecs are only used by the whole-file engine.
+    Both files are written to a temporary file first and then renamed, like the rest of the storage.
+    The offset table also stores the size and modification time of the snapshot it belongs to. If recipes.json has been
+    changed by something else (or the offset table is missing), the offsets are rebuilt by scanning the file once.
+    A file that is not a complete JSON object raises ValueError, like JsonFileStorage does, instead of loading as no recipes.
+
+LazyRecipeStore Class - behaves like the recipes dictionary (a MutableMapping).
+    Listing names or checking if a recipe exists only uses the offset table.
+    Getting a recipe decodes just that one record from the memory-mapped file.
+    Added recipes are kept in an overlay dictionary and deleted recipes in a set, the snapshot file itself is never changed.
+    encoded_items - the encoded JSON for every recipe, unchanged recipes are copied straight from the file without decoding,
+        which is what the journal compaction uses to write the next snapshot.
+'''
+import json
+import mmap
+import os
+from array import array
+from collections.abc import MutableMapping
+
+from recipe_codecs import best_json_codec
+
+_WHITESPACE = ' \t\n\r'
+# Encoding one recipe as JSON bytes, with orjson when it is installed
+_dumps = best_json_codec().dumps
+
+
+def _offsets_path(snapshot_path):
+    return snapshot_path + '.idx'
+
+
+def _file_state(path):
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+# Writing the snapshot from (name, encoded details) pairs, returning the names and the array of start and end positions
+def _write_records(f, encoded_items):
+    names = []
+    spans = array('Q')
+    f.write(b'{')
+    position = 1
+    first = True
+    for name, encoded in encoded_items:
+        prefix = (b'' if first else b', ') + _dumps(name) + b': '
+        first = False
+        start = position + len(prefix)
+        f.write(prefix)
+        f.write(encoded)
+        position = start + len(encoded)
+        names.append(name)
+        spans.append(start)
+        spans.append(position)
+    f.write(b'}')
+    return names, spans
+
+
+def write_snapshot(path, recipes):
+    if isinstance(recipes, LazyRecipeStore):
+        encoded_items = recipes.encoded_items()
+    else:
+        encoded_items = ((name, _dumps(details)) for name, details in recipes.items())
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        names, spans = _write_records(f, encoded_items)
+        f.flush()
+        os.fsync(f.fileno())
+    state = _file_state(tmp_path)
+    os.replace(tmp_path, path)
+    _write_offsets(path, state, names, spans)
+
+
+def _write_offsets(snapshot_path, state, names, spans):
+    index_path = _offsets_path(snapshot_path)
+    tmp_path = index_path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(json.dumps({'state': state, 'count': len(names)}).encode('utf-8') + b'\n')
+        f.write(json.dumps(names).encode('utf-8') + b'\n')
+        spans.tofile(f)
+    os.replace(tmp_path, index_path)
+
+
+def _read_offsets(snapshot_path, state):
+    try:
+        with open(_offsets_path(snapshot_path), 'rb') as f:
+            header = json.loads(f.readline())
+            if header.get('state') != state:
+                return None
+            names = json.loads(f.readline())
+            spans = array('Q')
+            spans.fromfile(f, 2 * header['count'])
+    except (FileNotFoundError, ValueError, EOFError):
+        return None
+    return names, spans
+
+
+def _skip_whitespace(text, position):
+    while position < len(text) and text[position] in _WHITESPACE:
+        position += 1
+    return position
+
+
+# The character at position, raising ValueError when the text ends before it
+def _expect(text, position, expected):
+    if position >= len(text):
+        raise ValueError('Unexpected end of the file at position %d' % position)
+    if text[position] not in expected:
+        raise ValueError('Expected %s at position %d' % (' or '.join('"%s"' % c for c in expected), position))
+    return text[position]
+
+
+# Finding the byte span of every recipe in a JSON file that was not written by write_snapshot.
+# The bytes are decoded as latin-1 so that string positions are the same as byte positions, and only the names are decoded as UTF-8.
+# An empty (or blank) file has no recipes, anything else that is not a complete JSON object raises ValueError.
+def scan_offsets(data):
+    text = data.decode('latin-1')
+    decoder = json.JSONDecoder()
+    names = []
+    spans = array('Q')
+    position = _skip_whitespace(text, 0)
+    if position >= len(text):
+        return names, spans
+    _expect(text, position, '{')
+    position = _skip_whitespace(text, position + 1)
+    if position < len(text) and text[position] == '}':
+        return names, spans
+    while True:
+        _, key_end = decoder.raw_decode(text, position)
+        name = json.loads(data[position:key_end].decode('utf-8'))
+        position = _skip_whitespace(text, key_end)
+        _expect(text, position, ':')
+        start = _skip_whitespace(text, position + 1)
+        _, end = decoder.raw_decode(text, start)
+        names.append(name)
+        spans.append(start)
+        spans.append(end)
+        position = _skip_whitespace(text, end)
+        if _expect(text, position, '},') == '}':
+            break
+        position = _skip_whitespace(text, position + 1)
+    return names, spans
+
+
+class LazyRecipeStore(MutableMapping):
+    def __init__(self, snapshot_path):
+        self.snapshot_path = snapshot_path
+        self._map = None
+        # Names in snapshot order, the position of each name, and the start and end byte of record i at spans[2 * i]
+        self._names = []
+        self._positions = {}
+        self._spans = array('Q')
+        # Changes since the snapshot was written
+        self._overlay = {}
+        self._deleted = set()
+        self._open()
+        self._size = len(self._names)
+
+    def _open(self):
+        try:
+            f = open(self.snapshot_path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            state = _file_state(self.snapshot_path)
+            if state[0] == 0:
+                return
+            # The map stays valid after the file object is closed
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        offsets = _read_offsets(self.snapshot_path, state)
+        if offsets is None:
+            try:
+                offsets = scan_offsets(self._map[:])
+            except ValueError as e:
+                # Loading a damaged file as an empty catalogue would let the next compaction overwrite it with only the journal
+                self.close()
+                raise ValueError(f'{self.snapshot_path} is not a valid recipes file: {e}') from e
+            try:
+                _write_offsets(self.snapshot_path, state, *offsets)
+            except OSError:
+                # Not being able to save the offset table only means it is rebuilt next time
+                pass
+        self._names, self._spans = offsets
+        self._positions = dict(zip(self._names, range(len(self._names))))
+
+    def _raw(self, name):
+        i = 2 * self._positions[name]
+        return self._map[self._spans[i]:self._spans[i + 1]]
+
+    def __getitem__(self, name):
+        if name in self._overlay:
+            return self._overlay[name]
+        if name in self._deleted:
+            raise KeyError(name)
+        return json.loads(self._raw(name))
+
+    def __setitem__(self, name, details):
+        if name not in self:
+            self._size += 1
+        self._overlay[name] = details
+        self._deleted.discard(name)
+
+    def __delitem__(self, name):
+        if name not in self:
+            raise KeyError(name)
+        self._overlay.pop(name, None)
+        if name in self._positions:
+            self._deleted.add(name)
+        self._size -= 1
+
+    def __contains__(self, name):
+        if name in self._overlay:
+            return True
+        return name in self._positions and name not in self._deleted
+
+    # Names in the order of the snapshot, followed by the names added since
+    def __iter__(self):
+        for name in self._names:
+            if name not in self._deleted:
+                yield name
+        for name in self._overlay:
+            if name not in self._positions:
+                yield name
+
+    def __len__(self):
+        return self._size
+
+    def copy(self):
+        return dict(self.items())
+
+    def encoded_items(self):
+        for name in self:
+            if name in self._overlay:
+                yield name, _dumps(self._overlay[name])
+            else:
+                yield name, self._raw(name)
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
@@ -0,0 +1,218 @@
+'''
+Load generator module - sends requests to a running recipe server (server.py) and reports the throughput and latency.
+
+A number of clients (--connections) each keep one connection open and send requests one after another for --duration seconds.
+Each request is chosen at random with the weights in --mix:
+    get     - GET /recipes/<name> of a recipe that exists
+    search  - GET /search?q=<a word from the recipe names>
+    closest - GET /closest?q=<a recipe name with a typo>
+    list    - GET /recipes?limit=<--list-limit>, a streamed list
+    add     - POST /recipes with a new recipe (named "Load test <number>")
+    delete  - DELETE /recipes/<name> of a recipe added by this run
+The recipes added by the run are deleted again at the end, unless --keep is given.
+
+The report shows, for every kind of request, the number of requests, the requests per second, and the median (p50) and
+99th percentile (p99) latency in milliseconds, and the same for all requests together. Errors (status 400 and up, or a
+lost connection) are counted separately, a 404 for a recipe deleted by another client in the meantime is not an error.
+
+Usage:
+    python cli.py serve --port 8080 &
+    python load_generator.py --port 8080 --connections 32 --duration 10 --mix get=70 search=10 closest=5 list=5 add=5 delete=5
+'''
+import argparse
+import asyncio
+import itertools
+import json
+import random
+import time
+from urllib.parse import quote
+
+from fuzzy_benchmark import add_typos
+
+DEFAULT_MIX = {'get': 70, 'search': 10, 'closest': 5, 'list': 5, 'add': 5, 'delete': 5}
+
+
+class Client:
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def request(self, method, path, payload=None):
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        body = json.dumps(payload).encode('utf-8') if payload is not None else b''
+        head = f'{method} {path} HTTP/1.1\r\nHost: {self.host}\r\nContent-Length: {len(body)}\r\n\r\n'
+        self.writer.write(head.encode('latin-1') + body)
+        await self.writer.drain()
+        try:
+            return await self._read_response()
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            self.close()
+            raise ConnectionError('Lost the connection to the server')
+
+    async def _read_response(self):
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError('The server closed the connection')
+        status = int(status_line.split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding') == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).strip(), 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+                chunks.append(chunk[:-2])
+            body = b''.join(chunks)
+        else:
+            body = await self.reader.readexactly(int(headers.get('content-length') or 0))
+        if headers.get('connection') == 'close':
+            self.close()
+        return status, json.loads(body) if body else None
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(fraction * len(sorted_values)))]
+
+
+class LoadGenerator:
+    def __init__(self, host, port, connections=16, duration=10.0, mix=DEFAULT_MIX, list_limit=1000, seed=0):
+        self.host = host
+        self.port = port
+        self.connections = connections
+        self.duration = duration
+        self.mix = {kind: weight for kind, weight in mix.items() if weight > 0}
+        self.list_limit = list_limit
+        self.rng = random.Random(seed)
+        self.names = []
+        self.words = []
+        self.added = []
+        self.counter = itertools.count()
+        self.latencies = {kind: [] for kind in self.mix}
+        self.errors = {kind: 0 for kind in self.mix}
+
+    async def prepare(self):
+        client = Client(self.host, self.port)
+        try:
+            _, names = await client.request('GET', '/recipes?limit=10000')
+        finally:
+            client.close()
+        self.names = names or ['PotBread']
+        self.words = sorted({word for name in self.names for word in name.split() if len(word) > 2}) or ['bread']
+
+    def _next_request(self, kind):
+        rng = self.rng
+        if kind == 'get':
+            return 'GET', '/recipes/' + quote(rng.choice(self.names), safe=''), None
+        if kind == 'search':
+            return 'GET', '/search?q=' + quote(rng.choice(self.words)), None
+        if kind == 'closest':
+            return 'GET', '/closest?q=' + quote(add_typos(rng.choice(self.names), rng)), None
+        if kind == 'list':
+            return 'GET', f'/recipes?limit={self.list_limit}', None
+        if kind == 'add':
+            name = f'Load test {next(self.counter)}'
+            self.added.append(name)
+            return 'POST', '/recipes', {'name': name, 'ingredients': rng.sample(self.words, min(3, len(self.words))),
+                                        'instructions': 'Added by the load generator.'}
+        if self.added:
+            name = self.added.pop(rng.randrange(len(self.added)))
+        else:
+            name = 'Load test missing'
+        return 'DELETE', '/recipes/' + quote(name, safe=''), None
+
+    async def _worker(self, deadline):
+        client = Client(self.host, self.port)
+        kinds, weights = list(self.mix), list(self.mix.values())
+        try:
+            while time.perf_counter() < deadline:
+                kind = self.rng.choices(kinds, weights)[0]
+                method, path, payload = self._next_request(kind)
+                start = time.perf_counter()
+                try:
+                    status, _ = await client.request(method, path, payload)
+                except ConnectionError:
+                    self.errors[kind] += 1
+                    continue
+                self.latencies[kind].append(time.perf_counter() - start)
+                if status >= 400 and not (status == 404 and kind in ('get', 'delete')):
+                    self.errors[kind] += 1
+        finally:
+            client.close()
+
+    async def run(self):
+        await self.prepare()
+        start = time.perf_counter()
+        await asyncio.gather(*(self._worker(start + self.duration) for _ in range(self.connections)))
+        return time.perf_counter() - start
+
+    async def cleanup(self):
+        client = Client(self.host, self.port)
+        try:
+            for name in self.added:
+                await client.request('DELETE', '/recipes/' + quote(name, safe=''))
+        finally:
+            client.close()
+        self.added = []
+
+    def report(self, elapsed):
+        rows = [(kind, sorted(latencies), self.errors[kind]) for kind, latencies in self.latencies.items()]
+        rows.append(('all', sorted(itertools.chain.from_iterable(self.latencies.values())), sum(self.errors.values())))
+        lines = [f"{'request':<10}{'count':>9}{'req/s':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}{'errors':>8}"]
+        for kind, latencies, errors in rows:
+            lines.append(f'{kind:<10}{len(latencies):>9}{len(latencies) / elapsed:>10.0f}'
+                         f'{percentile(latencies, 0.5) * 1e3:>10.2f}{percentile(latencies, 0.99) * 1e3:>10.2f}{errors:>8}')
+        return '\n'.join(lines)
+
+
+def parse_mix(items):
+    mix = {kind: 0 for kind in DEFAULT_MIX}
+    for item in items:
+        kind, _, weight = item.partition('=')
+        if kind not in mix:
+            raise argparse.ArgumentTypeError(f'Unknown request kind {kind!r}, expected one of {", ".join(mix)}')
+        mix[kind] = float(weight)
+    return mix
+
+
+async def _main(args):
+    generator = LoadGenerator(args.host, args.port, args.connections, args.duration,
+                              parse_mix(args.mix) if args.mix else DEFAULT_MIX, args.list_limit, args.seed)
+    elapsed = await generator.run()
+    print(f'{args.connections} connections, {elapsed:.1f} s against http://{args.host}:{args.port}')
+    print(generator.report(elapsed))
+    if not args.keep:
+        await generator.cleanup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Measure the throughput and latency of a running recipe server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--connections', type=int, default=16, help='number of clients sending requests at the same time')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to send requests for')
+    parser.add_argument('--mix', nargs='+', metavar='KIND=WEIGHT', help='request weights, like get=80 add=20 (the others are 0)')
+    parser.add_argument('--list-limit', type=int, default=1000, help='number of names asked for by the list requests')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--keep', action='store_true', help='keep the recipes added by the run')
+    asyncio.run(_main(parser.parse_args(argv)))
+
+
+if __name__ == '__main__':
+    main()
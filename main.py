@@ -12,13 +12,45 @@ Finally, checking if the script is the main program being started. It ensures th
 allowing gui.py (where RecipeGUI is defined) to be imported in other scripts without automatically launching the GUI. Setting up the application in this way as it is suggested to improve easier development in modules. 
 
 If the check is true, then it runs directly by calling the main function.
+
+The --storage option chooses where the recipes are kept: 'journal' (recipes.json plus the change journal, the default)
+or 'sqlite' (the recipes.db database, see sqlite_storage.py, which copies the JSON recipes the first time it is used)
+or 'file' (the whole catalogue in one file, in the format chosen with --codec, see recipe_codecs.py).
+The --cache option puts a read cache and a write-behind buffer in front of the storage (see cached_storage.py), which helps
+when the recipe files are on a slow disk or a network share.
+The --instrument option turns on the call counters and timers (see instrumentation.py) before the recipes are loaded, so the
+startup is measured as well. They can also be turned on later in the Diagnostics window.
+The storage options are shared with the command line tool, see cli.py, which runs the manager without the GUI.
+
+SIGTERM and SIGINT (Ctrl+C in the terminal) close the window the same way the close button does, so the changes waiting in
+the manager or in a write-behind buffer are written before the program ends.
 '''
+import argparse
+import signal
 import tkinter as tk
 from gui import RecipeGUI
+from cli import add_storage_arguments, configure_storage
+
+SIGNAL_CHECK_INTERVAL = 250
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Recipe manager')
+    add_storage_arguments(parser)
+    parser.add_argument('--instrument', action='store_true', help='count and time the recipe manager and storage calls from the start')
+    args = parser.parse_args(argv)
+    configure_storage(args)
+    if args.instrument:
+        import instrumentation
+        instrumentation.enable()
 
-def main():
     root = tk.Tk()
-    app = RecipeGUI(root)
+    app = RecipeGUI(root, compact=args.compact)
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda signum, frame: app.on_close())
+    # Python signal handlers only run when Python code runs, so the event loop wakes up regularly while the window is idle
+    def wake_up():
+        root.after(SIGNAL_CHECK_INTERVAL, wake_up)
+    wake_up()
     root.mainloop()
 
 if __name__ == "__main__":
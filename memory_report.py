@@ -0,0 +1,66 @@
+'''
+Memory report module - measures how many bytes each recipe takes in memory, before and after the compact representation.
+
+The recipes are generated with benchmark.make_synthetic_recipes and sent through JSON once, so the strings are separate
+objects just like when they are loaded from recipes.json. The memory is measured with tracemalloc, which counts every
+allocation Python makes while the structure is built.
+
+Layouts measured:
+- dict + list: the original layout, the recipes dictionary plus the list of tuples that RecipeManager used to build at startup.
+- dict: the recipes dictionary alone (recipes_list is now only built when it is used).
+- compact: a CompactRecipeStore (see compact_recipes.py) with the shared ingredient table.
+
+Usage:
+    python memory_report.py --n 100000
+'''
+import argparse
+import gc
+import json
+import tracemalloc
+
+from benchmark import make_synthetic_recipes
+from compact_recipes import CompactRecipeStore
+
+
+def _measure(build):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = build()
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, size
+
+
+def memory_report(n):
+    encoded = json.dumps(make_synthetic_recipes(n))
+
+    def original():
+        recipes = json.loads(encoded)
+        return recipes, [(name, details) for name, details in recipes.items()]
+
+    report = {}
+    for label, build in (('dict + list', original),
+                         ('dict', lambda: json.loads(encoded)),
+                         ('compact', lambda: CompactRecipeStore(json.loads(encoded)))):
+        result, size = _measure(build)
+        report[label] = {'bytes': size, 'bytes_per_recipe': size / n}
+        del result
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Report the memory used per recipe by the different layouts.')
+    parser.add_argument('--n', type=int, default=100000, help='number of synthetic recipes')
+    args = parser.parse_args(argv)
+
+    report = memory_report(args.n)
+    baseline = report['dict + list']['bytes_per_recipe']
+    print(f"{'layout':<14}{'total (MB)':>12}{'bytes/recipe':>14}{'vs original':>13}")
+    for label, row in report.items():
+        print(f"{label:<14}{row['bytes'] / 1e6:>12.1f}{row['bytes_per_recipe']:>14.0f}{row['bytes_per_recipe'] / baseline:>12.0%}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+'''
+Ordered index module - the recipe names in alphabetical order, kept sorted as recipes are added and deleted.
+
+The recipes dictionary keeps the names in the order they were added, so an alphabetical list (or one page of it) means sorting
+the whole catalogue every time, and a plain sorted list (like the one the list view used before) moves up to n names on every
+insert. The OrderedIndex keeps the names in blocks instead - a list of small sorted lists, each at most 2 * load names long:
+- Finding a name is a binary search over the last key of every block (maxes), then a binary search inside one block.
+- Inserting or removing moves at most one block of names. A block that grows too big is split in two, and a block that
+  shrinks too much is merged with its neighbour, so the blocks stay between load / 2 and 2 * load names.
+- A Fenwick tree (binary indexed tree) over the block sizes turns a position into a block and back in O(log n), so the
+  list view can ask for "the names at positions 5000 to 5020" without counting the blocks before them.
+With the default load of 512, a million names are about 2000 blocks, so every operation is a couple of binary searches and
+a list insert of a few hundred pointers: O(log n) for a lookup and O(log n + k) for a range of k names.
+
+The names are ordered case-insensitively (by their casefold), and names that only differ in case by the name itself, so the
+order is stable - the same names always come out in the same order, whatever order they were added in.
+
+OrderedIndex Class
+    insert / remove / position / get / len / in / index[position] - like a sorted list that can also keep a value per name.
+    add_recipe / remove_recipe - the index interface of RecipeManager, so it is kept up to date by the add and delete methods.
+    range(start, stop, prefix, after, limit) - the names from start (inclusive) to stop (exclusive), compared case-insensitively,
+        only the names starting with prefix, and only the names after the name 'after'. Returns an iterator, so only the names
+        that are used are looked at.
+    page(cursor, limit, prefix, start, stop) - one page of the same range, and the cursor for the next page (None on the last
+        page). limit must be at least 1. The cursor is the last name of the page, so adding or deleting recipes between two calls never skips or repeats
+        a name, unlike an offset.
+    prefix_range(prefix) - the start and end position of the names starting with prefix, used by the list view's filter.
+'''
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+DEFAULT_LOAD = 512
+# Larger than any character, used as the end of a prefix range
+_MAX_CHAR = chr(0x10FFFF)
+
+
+# The sort key, the casefold first and the name itself to order names that only differ in case
+def _key(name):
+    return name.casefold() + '\x00' + name
+
+
+class OrderedIndex:
+    def __init__(self, names=(), load=DEFAULT_LOAD):
+        self.load = load
+        self._build(sorted((_key(name), name, None) for name in names))
+
+    @classmethod
+    def from_items(cls, items, load=DEFAULT_LOAD):
+        index = cls(load=load)
+        index._build(sorted((_key(name), name, value) for name, value in items))
+        return index
+
+    def _build(self, entries):
+        self._keys = []
+        self._names = []
+        self._values = []
+        for start in range(0, len(entries), self.load):
+            block = entries[start:start + self.load]
+            self._keys.append([key for key, _, _ in block])
+            self._names.append([name for _, name, _ in block])
+            self._values.append([value for _, _, value in block])
+        self._maxes = [keys[-1] for keys in self._keys]
+        self._len = len(entries)
+        self._build_tree()
+
+    # Fenwick tree over the block sizes, tree[i] is the size of the blocks (i & (i + 1)) to i
+    def _build_tree(self):
+        tree = [len(keys) for keys in self._keys]
+        for i in range(len(tree)):
+            parent = i | (i + 1)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _tree_add(self, block, delta):
+        tree = self._tree
+        while block < len(tree):
+            tree[block] += delta
+            block |= block + 1
+
+    # The number of names in the blocks before block
+    def _before(self, block):
+        total = 0
+        block -= 1
+        while block >= 0:
+            total += self._tree[block]
+            block = (block & (block + 1)) - 1
+        return total
+
+    # The block holding a position, and the position inside that block
+    def _locate(self, position):
+        tree = self._tree
+        block = 0
+        step = 1 << (len(tree).bit_length() - 1) if tree else 0
+        while step:
+            upper = block + step
+            if upper <= len(tree) and tree[upper - 1] <= position:
+                block = upper
+                position -= tree[upper - 1]
+            step >>= 1
+        return block, position
+
+    # The block and offset where key is, or would be inserted
+    def _seek(self, key, right=False):
+        search = bisect_right if right else bisect_left
+        block = search(self._maxes, key)
+        if block == len(self._maxes):
+            return block, 0
+        return block, search(self._keys[block], key)
+
+    def _find(self, name):
+        block, offset = self._seek(_key(name))
+        if block < len(self._keys) and offset < len(self._keys[block]) and self._names[block][offset] == name:
+            return block, offset
+        return None
+
+    def __len__(self):
+        return self._len
+
+    def __contains__(self, name):
+        return self._find(name) is not None
+
+    def __iter__(self):
+        for names in self._names:
+            yield from names
+
+    def __getitem__(self, position):
+        if position < 0:
+            position += self._len
+        if not 0 <= position < self._len:
+            raise IndexError('OrderedIndex position out of range')
+        block, offset = self._locate(position)
+        return self._names[block][offset]
+
+    def position(self, name):
+        found = self._find(name)
+        if found is None:
+            return None
+        return self._before(found[0]) + found[1]
+
+    def get(self, name, default=None):
+        found = self._find(name)
+        if found is None:
+            return default
+        return self._values[found[0]][found[1]]
+
+    # Adding a name (or replacing its value if it is already there), returning its position
+    def insert(self, name, value=None):
+        key = _key(name)
+        if not self._keys:
+            self._build([(key, name, value)])
+            return 0
+        block, offset = self._seek(key)
+        if block == len(self._keys):
+            block = len(self._keys) - 1
+            offset = len(self._keys[block])
+        keys = self._keys[block]
+        if offset < len(keys) and keys[offset] == key:
+            self._values[block][offset] = value
+            return self._before(block) + offset
+        position = self._before(block) + offset
+        keys.insert(offset, key)
+        self._names[block].insert(offset, name)
+        self._values[block].insert(offset, value)
+        self._maxes[block] = keys[-1]
+        self._len += 1
+        if len(keys) > 2 * self.load:
+            self._split(block)
+        else:
+            self._tree_add(block, 1)
+        return position
+
+    # Removing a name, returning the position it had (or None if it was not there)
+    def remove(self, name):
+        found = self._find(name)
+        if found is None:
+            return None
+        block, offset = found
+        position = self._before(block) + offset
+        keys = self._keys[block]
+        del keys[offset]
+        del self._names[block][offset]
+        del self._values[block][offset]
+        self._len -= 1
+        if len(keys) < self.load // 2 and len(self._keys) > 1:
+            self._merge(block)
+        elif not keys:
+            self._build([])
+        else:
+            self._maxes[block] = keys[-1]
+            self._tree_add(block, -1)
+        return position
+
+    def _split(self, block):
+        half = len(self._keys[block]) // 2
+        for blocks in (self._keys, self._names, self._values):
+            blocks.insert(block + 1, blocks[block][half:])
+            del blocks[block][half:]
+        self._maxes[block:block + 1] = [self._keys[block][-1], self._keys[block + 1][-1]]
+        self._build_tree()
+
+    # Merging a small block into its neighbour, splitting the result again if it is too big
+    def _merge(self, block):
+        left = block - 1 if block > 0 else block
+        for blocks in (self._keys, self._names, self._values):
+            blocks[left].extend(blocks[left + 1])
+            del blocks[left + 1]
+        del self._maxes[left + 1]
+        self._maxes[left] = self._keys[left][-1]
+        if len(self._keys[left]) > 2 * self.load:
+            self._split(left)
+        else:
+            self._build_tree()
+
+    # The RecipeManager index interface
+    def add_recipe(self, name, details=None):
+        self.insert(name)
+
+    def remove_recipe(self, name):
+        self.remove(name)
+
+    def _iter_from(self, block, offset):
+        for i in range(block, len(self._names)):
+            yield from islice(self._names[i], offset, None) if offset else self._names[i]
+            offset = 0
+
+    def _iter_keys_from(self, block, offset):
+        for i in range(block, len(self._keys)):
+            keys, names = self._keys[i], self._names[i]
+            for j in range(offset, len(keys)):
+                yield keys[j], names[j]
+            offset = 0
+
+    def range(self, start=None, stop=None, prefix=None, after=None, limit=None):
+        lower = start.casefold() if start is not None else ''
+        upper = stop.casefold() if stop is not None else None
+        if prefix:
+            lower = max(lower, prefix.casefold())
+            end = prefix.casefold() + _MAX_CHAR
+            upper = end if upper is None else min(upper, end)
+        block, offset = self._seek(lower)
+        if after is not None:
+            block, offset = max((block, offset), self._seek(_key(after), right=True))
+        if upper is None:
+            names = self._iter_from(block, offset)
+        else:
+            # Stopping at the first key past the upper bound instead of filtering the rest of the index
+            names = _take_while_below(self._iter_keys_from(block, offset), upper)
+        return islice(names, limit) if limit is not None else names
+
+    def page(self, cursor=None, limit=50, prefix=None, start=None, stop=None):
+        # An empty page would have no last name to continue after
+        if limit < 1:
+            raise ValueError('The page limit must be at least 1')
+        names = list(self.range(start, stop, prefix, after=cursor, limit=limit + 1))
+        if len(names) > limit:
+            return names[:limit], names[limit - 1]
+        return names, None
+
+    def prefix_range(self, prefix):
+        key = prefix.casefold()
+        if not key:
+            return 0, self._len
+        return self._position_of(self._seek(key)), self._position_of(self._seek(key + _MAX_CHAR))
+
+    def _position_of(self, found):
+        block, offset = found
+        if block == len(self._keys):
+            return self._len
+        return self._before(block) + offset
+
+
+def _take_while_below(pairs, upper):
+    for key, name in pairs:
+        if key >= upper:
+            return
+        yield name
@@ -0,0 +1,127 @@
+'''
+Parallel benchmark module - runs the performance dialog tests on several processes at the same time.
+
+PerformanceDialog.measure_operations runs every test one after another, and each test times add, get and delete 5 x 10 times
+for every structure, so a few thousand tests take minutes on one core while the others do nothing. The tests do not depend
+on each other (every test starts from a fresh copy of the recipes), so they can be split over a pool of processes.
+Processes are used instead of threads, since threads would take turns on the GIL and time each other's work.
+
+How it works:
+- The test numbers 0..num_tests-1 are split in chunks, and every chunk is one job for the process pool. The chunks are small
+  enough that there are several per worker, so partial results come back regularly and a cancel does not wait long.
+- Every worker gets the recipes once, when it starts (init_worker), instead of with every job.
+- Pinning - on systems that support it (os.sched_setaffinity, Linux), every worker is pinned to its own core, so the operating
+  system does not move it between cores in the middle of a measurement (which empties the CPU caches). When there is more
+  than one core, the first core is left to the GUI and the other programs, so they do not disturb the workers either.
+- The times are merged back by test number, into the same {operation: [times]} dictionaries as measure_operations returns
+  (one per structure, see benchmark.STRUCTURES), so the results look the same as running the tests one after another.
+- on_partial is called after every chunk with the times measured so far, so the chart can be drawn while the tests run.
+
+The processes are started with 'spawn', which is safe to use from a program with threads (the GUI and its BackgroundWorker).
+
+Usage:
+    times = run_parallel(recipes, 1000, on_partial=lambda done, total, times: print(done, total))
+    times_dict, times_list, times_sorted = times['dict'], times['list'], times['sorted']
+'''
+import math
+import multiprocessing
+import os
+import queue
+import timeit
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from benchmark import OPERATIONS, STRUCTURES
+from ordered_index import OrderedIndex
+from recipe_manager import RecipeManager
+from storage import MemoryStorage
+
+# Jobs per worker, more jobs give more frequent partial results but more overhead
+CHUNKS_PER_WORKER = 8
+
+# Set in every worker process by init_worker
+_recipes = None
+
+
+def worker_cores():
+    if not hasattr(os, 'sched_getaffinity'):
+        return []
+    cores = sorted(os.sched_getaffinity(0))
+    # Leaving the first core to the GUI when there are cores to spare
+    return cores[1:] if len(cores) > 1 else cores
+
+
+def init_worker(recipes, cores):
+    global _recipes
+    _recipes = recipes
+    try:
+        core = cores.get_nowait()
+    except queue.Empty:
+        return
+    if hasattr(os, 'sched_setaffinity'):
+        try:
+            os.sched_setaffinity(0, {core})
+        except OSError:
+            pass
+
+
+# The same steps as PerformanceDialog.measure_operations, for the tests start..stop-1, for every structure
+def measure_chunk(start, stop, structures):
+    times = {structure: {op: [] for op in OPERATIONS} for structure in structures}
+    ingredients = ['Ingredient1', 'Ingredient2']
+    instructions = 'Mix well & serve hot.. or cold.'
+    for i in range(start, stop):
+        name = f'TestRecipe{i}'
+        recipe_manager = RecipeManager(storage=MemoryStorage())
+        recipe_manager.recipes_dict = dict(_recipes)
+        recipe_manager.recipes_list = list(_recipes.items())
+        recipe_manager.recipes_sorted = OrderedIndex.from_items(_recipes.items())
+        for structure in structures:
+            add, get, delete = (getattr(recipe_manager, method) for method in STRUCTURES[structure])
+            times[structure]['Add'].append(min(timeit.repeat(lambda: add(name, ingredients, instructions), repeat=5, number=10)))
+            add(name, ingredients, instructions)
+            times[structure]['Get'].append(min(timeit.repeat(lambda: get(name), repeat=5, number=10)))
+            times[structure]['Delete'].append(min(timeit.repeat(lambda: delete(name), repeat=5, number=10)))
+    return start, stop, times
+
+
+def _merge(slots, structures):
+    return {structure: {op: [t for t in slots[structure][op] if t is not None] for op in OPERATIONS} for structure in structures}
+
+
+def run_parallel(recipes, num_tests, structures=tuple(STRUCTURES), workers=None, on_partial=None, should_stop=None):
+    cores = worker_cores()
+    if workers is None:
+        workers = max(1, len(cores) or (os.cpu_count() or 2) - 1)
+    workers = min(workers, num_tests)
+    chunk_size = max(1, math.ceil(num_tests / (workers * CHUNKS_PER_WORKER)))
+    recipes = dict(recipes.items())
+
+    context = multiprocessing.get_context('spawn')
+    core_queue = context.Queue()
+    for i in range(workers):
+        if cores:
+            core_queue.put(cores[i % len(cores)])
+
+    # One slot per test, so the merged times are in the order of the tests whatever order the chunks finish in
+    slots = {structure: {op: [None] * num_tests for op in OPERATIONS} for structure in structures}
+    done = 0
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=init_worker, initargs=(recipes, core_queue))
+    try:
+        pending = {executor.submit(measure_chunk, start, min(start + chunk_size, num_tests), structures)
+                   for start in range(0, num_tests, chunk_size)}
+        while pending:
+            finished, pending = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+            if should_stop is not None:
+                should_stop()
+            for future in finished:
+                start, stop, times = future.result()
+                for structure in structures:
+                    for op in OPERATIONS:
+                        slots[structure][op][start:stop] = times[structure][op]
+                done += stop - start
+            if finished and on_partial is not None:
+                on_partial(done, num_tests, _merge(slots, structures))
+    finally:
+        # On cancel the queued chunks are dropped, the running ones are left to finish on their own
+        executor.shutdown(wait=False, cancel_futures=True)
+    return _merge(slots, structures)
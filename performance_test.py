@@ -1,9 +1,9 @@
 '''
 Performance Testing Module
 
-This module handles the performance testing of dictionary hashmaps vs list of tuples implementations
+This module handles the performance testing of dictionary hashmaps vs list of tuples vs ordered index implementations
 in managing recipes. The tests are designed to measure and compare the efficiency
-of add, get, and delete operations between the two data structures. It demonstrates
+of add, get, and delete operations between the three data structures. It demonstrates
 the application of time complexity concepts in a practical scenario, using the
 RecipeManager class as a test case - while keeping the originally added and saved recipes 'unharmed'.
 
@@ -14,15 +14,29 @@ the tests to try to reflect real-world usage patterns.
 Key Components:
 - PerformanceDialog: A Tkinter dialog window that provides a user interface for
   initiating performance tests and displaying results, where the user can manually add the amount of tests per check. 
-- test_add, test_delete, test_get: Functions to measure the performance of respective operations for dictionary 
-  and list data structures.
+- test_add, test_delete, test_get: Functions to measure the performance of respective operations for dictionary,
+  list and ordered index data structures.
 - display_big_o_graph: Visualizes the performance results, highlighting the time complexity differences between 
-  dictionary and list operations through bar graphs.
+  dictionary, list and ordered index operations through bar graphs.
+- The ordered index (see ordered_index.py) keeps the names sorted in small blocks, so its operations are O(log n): slower
+  than the dictionary's O(1), but it can also list the recipes in alphabetical order, which neither of the others can do cheaply.
+
+- The tests run in the background (see background.py), so the window stays responsive. Progress is shown while the tests run,
+  and the tests can be cancelled. The results are displayed when they are ready.
+- The test managers use a MemoryStorage engine, so the measured times are the data structure operations and not writing recipes.json.
+- Sweep: runs the headless benchmark runner (see benchmark.py) over growing synthetic catalogues, plots the median time per operation
+  against the catalogue size, shows the fitted complexity of each curve, and saves the results as JSON in benchmark_results/.
+- Use all cores: the tests are split over a pool of processes, one per core (see parallel_benchmark.py), and the chart is
+  drawn from the partial results while the tests run. Without it the tests run one after another in a background thread.
+- Every test and sweep is stored in the benchmark history database (see benchmark_history.py), together with the git commit.
+  The recipes are loaded, and the results saved and read back, on the background worker as well, so the window never waits for the disk.
+- HistoryDialog: plots the median time against the catalogue size for the stored runs, and lists the operations where the
+  latest run is significantly slower than the run before it.
 
 Usage:
 - The GUI allows users to input the number of test cases for the performance tests.
 - Upon executing the tests, average times for each operation are displayed, followed by a graph illustrating
-  the total time taken for each operation in both data structures.
+  the total time taken for each operation in all three data structures.
 
 '''
 
@@ -33,12 +47,23 @@ import timeit
 import numpy as np
 import matplotlib.pyplot as plt
 from recipe_manager import RecipeManager
+from background import BackgroundWorker
+from storage import MemoryStorage
+from benchmark import run_sweep, save_results, summarize
+from benchmark_history import record_run, list_runs, load_run, compare_runs, plot_history
+from parallel_benchmark import run_parallel
+from ordered_index import OrderedIndex
+import datetime
+import platform
+import time
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
 
 class PerformanceDialog(tk.Toplevel):
+    PARTIAL_REDRAW = 0.5
+
     def __init__(self, master):
         super().__init__(master)
-        self.title("Performance Comparison - Dictionary vs list of tuples")
+        self.title("Performance Comparison - Dictionary vs list of tuples vs ordered index")
         self.geometry("800x600")
         self.resizable(True, True)
 
@@ -51,9 +76,30 @@ class PerformanceDialog(tk.Toplevel):
         # Default value, but can be changed
         self.tests_entry.insert(0, "1000")  
 
-        self.test_button = tk.Button(self, text="Test", command=self.perform_tests)
+        self.test_button = tk.Button(self, text="Test", command=self.perform_tests, state=tk.DISABLED)
         self.test_button.pack(pady=5)
 
+        self.cancel_button = tk.Button(self, text="Cancel", command=self.cancel_tests, state=tk.DISABLED)
+        self.cancel_button.pack(pady=5)
+
+        self.parallel_var = tk.BooleanVar(value=True)
+        tk.Checkbutton(self, text="Use all cores", variable=self.parallel_var).pack()
+
+        # Sweep over catalogue sizes with the benchmark runner
+        sweep_frame = tk.Frame(self)
+        sweep_frame.pack(pady=5)
+        tk.Label(sweep_frame, text="Sweep sizes:").pack(side=tk.LEFT)
+        self.sweep_entry = tk.Entry(sweep_frame, width=30)
+        self.sweep_entry.pack(side=tk.LEFT, padx=5)
+        self.sweep_entry.insert(0, "100 1000 10000 100000")
+        self.sweep_button = tk.Button(sweep_frame, text="Run sweep", command=self.perform_sweep, state=tk.DISABLED)
+        self.sweep_button.pack(side=tk.LEFT)
+        self.history_button = tk.Button(sweep_frame, text="History", command=lambda: HistoryDialog(self))
+        self.history_button.pack(side=tk.LEFT, padx=5)
+
+        self.progress_var = tk.StringVar()
+        tk.Label(self, textvariable=self.progress_var).pack()
+
         # Frames for displaying results and graphs
         self.result_label_frame = tk.LabelFrame(self, text="Results - Average time per operation")
         self.result_label_frame.pack(fill=tk.BOTH, expand=True)
@@ -61,8 +107,29 @@ class PerformanceDialog(tk.Toplevel):
         self.canvas_frame = tk.Frame(self)
         self.canvas_frame.pack(fill=tk.BOTH, expand=True)
 
-        # Create a separate instance of RecipeManager for testing
-        self.recipe_manager = RecipeManager()
+        # The tests run in the background, and are cancelled if the window is closed
+        self.worker = BackgroundWorker(self)
+
+        # Loading a separate instance of RecipeManager for testing in the background, the buttons are enabled when it is loaded
+        self.recipe_manager = None
+        self.progress_var.set("Loading recipes...")
+        self.worker.submit(lambda task: RecipeManager(), on_done=self.on_loaded, on_error=self.on_load_error)
+        self.test_task = None
+        # The figure showing the partial results of a parallel test, redrawn at most every PARTIAL_REDRAW seconds
+        self.partial_figure = None
+        self.partial_canvas = None
+        self.last_redraw = 0.0
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def on_loaded(self, recipe_manager):
+        self.recipe_manager = recipe_manager
+        self.progress_var.set("")
+        self.test_button.config(state=tk.NORMAL)
+        self.sweep_button.config(state=tk.NORMAL)
+
+    def on_load_error(self, error):
+        self.progress_var.set("Recipes could not be loaded.")
+        tk.messagebox.showerror("Error", f"Recipes could not be loaded: {error}")
 
     def perform_tests(self):
         # Validates input and initiates performance tests
@@ -74,9 +141,94 @@ class PerformanceDialog(tk.Toplevel):
             tk.messagebox.showerror("Error", str(e))
             return
 
-        # Clearing previous results and performing new tests
+        # Clearing previous results and performing new tests in the background
+        self.clear_results()
+        self.start_tests()
+        measure = self.measure_operations_parallel if self.parallel_var.get() else self.measure_operations
+        self.test_task = self.worker.submit(measure, num_tests, on_progress=self.show_progress,
+                                            on_done=self.show_results, on_error=self.on_test_error)
+
+    def perform_sweep(self):
+        # Validates the sizes and runs the benchmark sweep in the background
+        try:
+            sizes = sorted(int(size) for size in self.sweep_entry.get().split())
+            if len(sizes) < 1 or sizes[0] <= 0:
+                raise ValueError("Sizes must be positive integers")
+        except ValueError as e:
+            tk.messagebox.showerror("Error", str(e))
+            return
+
         self.clear_results()
-        self.measure_operations(num_tests)
+        self.start_tests()
+        self.test_task = self.worker.submit(lambda task: run_sweep(sizes, samples=15, progress=task.report, should_stop=task.check),
+                                            on_progress=self.show_progress, on_done=self.show_sweep, on_error=self.on_test_error)
+
+    def start_tests(self):
+        self.test_button.config(state=tk.DISABLED)
+        self.sweep_button.config(state=tk.DISABLED)
+        self.cancel_button.config(state=tk.NORMAL)
+
+    def show_progress(self, done, total, label=None, partial=None):
+        self.progress_var.set(f"Running test {done} of {total}" + (f" - {label}" if label else ""))
+        if partial is not None and time.monotonic() - self.last_redraw >= self.PARTIAL_REDRAW:
+            self.last_redraw = time.monotonic()
+            self.display_partial_graph(*partial)
+
+    # Calculating and displaying average times, and then the Big O notation graph
+    def show_results(self, times):
+        times_dict, times_list, times_sorted = times
+        self.finish_tests("Done - recording the run...")
+        # Writing the history database on the worker too, as a serial task so closing the window does not cancel it
+        run = self.as_run(times_dict, times_list, times_sorted)
+        self.worker.submit(lambda task: record_run(run, label='performance dialog'), serial=True,
+                           on_done=lambda run_id: self.progress_var.set(f"Done - recorded as run #{run_id}"),
+                           on_error=self.on_record_error)
+        self.display_average_times(times_dict, times_list, times_sorted)
+        self.display_big_o_graph(times_dict, times_list, times_sorted)
+
+    # Converting the times of the tests to the same format as a benchmark run, so it can be stored in the history.
+    # Every time is the best of 5 repeats of 10 calls, so it is divided by 10 to get the time of one call.
+    def as_run(self, times_dict, times_list, times_sorted):
+        n = len(self.recipe_manager.recipes_dict)
+        results = []
+        for structure, times in (('dict', times_dict), ('list', times_list), ('sorted', times_sorted)):
+            for operation, samples in times.items():
+                samples = [t / 10 for t in samples]
+                results.append({'structure': structure, 'operation': operation, 'n': n, 'samples': samples, **summarize(samples)})
+        return {
+            'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'results': results,
+        }
+
+    def on_record_error(self, error):
+        self.progress_var.set("Done - the results could not be saved")
+        tk.messagebox.showerror("Error", f"The results could not be saved: {error}", parent=self)
+
+    def on_test_error(self, error):
+        self.finish_tests("Failed")
+        tk.messagebox.showerror("Error", str(error))
+
+    def cancel_tests(self):
+        if self.test_task is not None:
+            self.test_task.cancel()
+            self.finish_tests("Cancelled")
+
+    def finish_tests(self, status):
+        self.test_task = None
+        self.progress_var.set(status)
+        self.test_button.config(state=tk.NORMAL)
+        self.sweep_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+    def on_close(self):
+        # The history windows are closed with this one, stopping their workers too
+        for window in self.winfo_children():
+            if isinstance(window, HistoryDialog):
+                window.on_close()
+        self.worker.shutdown(cancel_pending=True)
+        self.destroy()
 
     def clear_results(self):
         # Clearing result labels and graph canvas for new test results. Widget is the input box in Tkinter.
@@ -86,23 +238,31 @@ class PerformanceDialog(tk.Toplevel):
         # Destroy all widgets in the canvas frame
         for widget in self.canvas_frame.winfo_children():
             widget.destroy()
+        if self.partial_figure is not None:
+            plt.close(self.partial_figure)
+        self.partial_figure = None
+        self.partial_canvas = None
+        self.last_redraw = 0.0
 
-    def measure_operations(self, num_tests):
-        # Core test function to measure operation times and display results
+    def measure_operations(self, task, num_tests):
+        # Core test function to measure operation times, running in the background. Returns the times for the results to be displayed.
         operations = ['Add', 'Get', 'Delete']
         times_dict = {op: [] for op in operations}
         times_list = {op: [] for op in operations}
+        times_sorted = {op: [] for op in operations}
         
         for i in range(num_tests):
+            task.check()
             name = f'TestRecipe{i}'
             ingredients = ['Ingredient1', 'Ingredient2']
             instructions = 'Mix well & serve hot.. or cold.'
-            # Using a fresh instance for each measurement
-            recipe_manager = RecipeManager()  
+            # Using a fresh instance for each measurement, kept in memory so no files are read or written while measuring
+            recipe_manager = RecipeManager(storage=MemoryStorage())
             
             # Reinitializing the RecipeManagers data structures before each test
             recipe_manager.recipes_dict = self.recipe_manager.recipes_dict.copy()
             recipe_manager.recipes_list = self.recipe_manager.recipes_list.copy()
+            recipe_manager.recipes_sorted = OrderedIndex.from_items(self.recipe_manager.recipes_dict.items())
             
             # Measuring Add operation
             add_dict_time = min(timeit.repeat(lambda: recipe_manager.add_recipe_dict(name, ingredients, instructions), repeat=5, number=10))
@@ -110,10 +270,14 @@ class PerformanceDialog(tk.Toplevel):
 
             add_list_time = min(timeit.repeat(lambda: recipe_manager.add_recipe_list(name, ingredients, instructions), repeat=5, number=10))
             times_list['Add'].append(add_list_time)
+
+            add_sorted_time = min(timeit.repeat(lambda: recipe_manager.add_recipe_sorted(name, ingredients, instructions), repeat=5, number=10))
+            times_sorted['Add'].append(add_sorted_time)
             
-            # Using the add recipe dict and list methods from recipe manager, add the recipes to the data structures
+            # Using the add recipe dict, list and sorted methods from recipe manager, add the recipes to the data structures
             recipe_manager.add_recipe_dict(name, ingredients, instructions)
             recipe_manager.add_recipe_list(name, ingredients, instructions)
+            recipe_manager.add_recipe_sorted(name, ingredients, instructions)
 
             # Measuring Get operation
             get_dict_time = min(timeit.repeat(lambda: recipe_manager.get_recipe(name), repeat=5, number=10))
@@ -122,6 +286,9 @@ class PerformanceDialog(tk.Toplevel):
             get_list_time = min(timeit.repeat(lambda: recipe_manager.get_recipe_list(name), repeat=5, number=10))
             times_list['Get'].append(get_list_time)
 
+            get_sorted_time = min(timeit.repeat(lambda: recipe_manager.get_recipe_sorted(name), repeat=5, number=10))
+            times_sorted['Get'].append(get_sorted_time)
+
             # Measuring Delete operation
             delete_dict_time = min(timeit.repeat(lambda: recipe_manager.delete_recipe_dict(name), repeat=5, number=10))
             times_dict['Delete'].append(delete_dict_time)
@@ -129,62 +296,197 @@ class PerformanceDialog(tk.Toplevel):
             delete_list_time = min(timeit.repeat(lambda: recipe_manager.delete_recipe_list(name), repeat=5, number=10))
             times_list['Delete'].append(delete_list_time)
 
-        # Calculating and displaying average times
-        self.display_average_times(times_dict, times_list)
+            delete_sorted_time = min(timeit.repeat(lambda: recipe_manager.delete_recipe_sorted(name), repeat=5, number=10))
+            times_sorted['Delete'].append(delete_sorted_time)
+            task.report(i + 1, num_tests)
+
+        return times_dict, times_list, times_sorted
 
-        # Displaying the Big O notation graph
-        self.display_big_o_graph(times_dict, times_list)
+    def measure_operations_parallel(self, task, num_tests):
+        # The same tests on a pool of processes, sending the times measured so far with every progress report
+        recipes = self.recipe_manager.recipes_dict
+        times = run_parallel(recipes, num_tests, on_partial=lambda done, total, partial: task.report(
+            done, total, None, (partial['dict'], partial['list'], partial['sorted'])), should_stop=task.check)
+        return times['dict'], times['list'], times['sorted']
 
-    def display_average_times(self, times_dict, times_list):
+    def display_average_times(self, times_dict, times_list, times_sorted):
         # Displaying average times for operations in the result label frame
         for operation in times_dict:
             avg_time_dict = np.mean(times_dict[operation]) * 1000  # Convert to milliseconds
             avg_time_list = np.mean(times_list[operation]) * 1000  # Convert to milliseconds
-            tk.Label(self.result_label_frame, text=f"{operation} Operation - Dict: {avg_time_dict:.6f} ms, List: {avg_time_list:.6f} ms").pack()
+            avg_time_sorted = np.mean(times_sorted[operation]) * 1000  # Convert to milliseconds
+            tk.Label(self.result_label_frame, text=f"{operation} Operation - Dict: {avg_time_dict:.6f} ms, List: {avg_time_list:.6f} ms, "
+                                                   f"Sorted: {avg_time_sorted:.6f} ms").pack()
 
-    def display_big_o_graph(self, times_dict, times_list):
-        # Creating and displaying Big O notation graphs for dict vs list of tuples comparisons
+    def display_big_o_graph(self, times_dict, times_list, times_sorted):
+        # Creating and displaying Big O notation graphs for dict vs list of tuples vs ordered index comparisons, replacing the partial graph
+        if self.partial_figure is not None:
+            self.partial_canvas.get_tk_widget().destroy()
+            plt.close(self.partial_figure)
+            self.partial_figure = None
+            self.partial_canvas = None
         fig, ax = plt.subplots(figsize=(10, 4))
-        
-        # Summing up the times for each operation for both data structures
+        self.plot_total_times(ax, times_dict, times_list, times_sorted)
+
+        canvas = FigureCanvasTkAgg(fig, master=self.canvas_frame)
+        canvas.draw()
+        canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+    def display_partial_graph(self, times_dict, times_list, times_sorted):
+        # Redrawing the same figure while a parallel test runs, instead of creating a new one for every partial result
+        if self.partial_figure is None:
+            self.partial_figure, _ = plt.subplots(figsize=(10, 4))
+            self.partial_canvas = FigureCanvasTkAgg(self.partial_figure, master=self.canvas_frame)
+            self.partial_canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        ax = self.partial_figure.axes[0]
+        ax.clear()
+        self.plot_total_times(ax, times_dict, times_list, times_sorted)
+        self.partial_canvas.draw_idle()
+
+    def plot_total_times(self, ax, times_dict, times_list, times_sorted):
+        # Summing up the times for each operation for all three data structures
         sum_times_dict = {op: sum(times_dict[op]) for op in times_dict}
         sum_times_list = {op: sum(times_list[op]) for op in times_list}
+        sum_times_sorted = {op: sum(times_sorted[op]) for op in times_sorted}
         
         # Creating lists of summed times and labels for plotting
         operations = ['Add', 'Get', 'Delete']
         dict_times = [sum_times_dict[op] for op in operations]
         list_times = [sum_times_list[op] for op in operations]
+        sorted_times = [sum_times_sorted[op] for op in operations]
         colors = ['blue', 'green', 'red', 'orange']
         
         # Plotting the times for each operation
-        bar_width = 0.35
+        bar_width = 0.25
         index = np.arange(len(operations))
         
         bars1 = ax.bar(index, dict_times, bar_width, color=colors[0], label='Dict Operations')
         bars2 = ax.bar(index + bar_width, list_times, bar_width, color=colors[1], label='List Operations')
+        bars3 = ax.bar(index + 2 * bar_width, sorted_times, bar_width, color=colors[3], label='Sorted Operations')
         
         # Adding labels and title
         ax.set_xlabel('Operations')
         ax.set_ylabel('Total Time (s)')
-        ax.set_title('Total Time for Operations - Dict vs List')
-        ax.set_xticks(index + bar_width / 2)
+        ax.set_title('Total Time for Operations - Dict vs List vs Sorted')
+        ax.set_xticks(index + bar_width)
         ax.set_xticklabels(operations)
         ax.legend()
 
         # Adding the total time above each bar for better visibility
-        for bar in bars1 + bars2:
+        for bar in bars1 + bars2 + bars3:
             height = bar.get_height()
             ax.annotate(f'{height:.4f}',
                         xy=(bar.get_x() + bar.get_width() / 2, height),
                         xytext=(0, 3),  # 3 points vertical offset
                         textcoords="offset points",
                         ha='center', va='bottom')
-        
+
+
+    def show_sweep(self, run):
+        # Showing the fitted complexity of every curve, and a log-log graph of the median time per operation against the size
+        self.finish_tests("Done - saving the results...")
+        self.worker.submit(lambda task: (save_results(run), record_run(run, label='performance dialog sweep')), serial=True,
+                           on_done=lambda saved: self.progress_var.set(f"Done - saved to {saved[0]}, recorded as run #{saved[1]}"),
+                           on_error=self.on_record_error)
+        for key, fit in run['fits'].items():
+            tk.Label(self.result_label_frame, text=f"{key}: {fit['best']}").pack()
+
+        fig, ax = plt.subplots(figsize=(10, 4))
+        curves = {}
+        for result in run['results']:
+            curves.setdefault(f"{result['structure']} {result['operation']}", []).append((result['n'], result['p50']))
+        for label, points in curves.items():
+            sizes, times = zip(*sorted(points))
+            ax.plot(sizes, [t * 1e6 for t in times], marker='o', label=label)
+        ax.set_xscale('log')
+        ax.set_yscale('log')
+        ax.set_xlabel('Number of recipes (n)')
+        ax.set_ylabel('Median time per operation (us)')
+        ax.set_title('Time per operation vs catalogue size')
+        ax.legend(fontsize='small')
+
         canvas = FigureCanvasTkAgg(fig, master=self.canvas_frame)
         canvas.draw()
         canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
 
 
+class HistoryDialog(tk.Toplevel):
+    def __init__(self, master, runs_to_show=10):
+        super().__init__(master)
+        self.title("Benchmark history")
+        self.geometry("900x600")
+        self.status_var = tk.StringVar(value="Loading the benchmark history...")
+        tk.Label(self, textvariable=self.status_var).pack(pady=5)
+        self.runs = []
+        self.comparisons = []
+
+        # Reading the history database in the background, the window is filled in when the runs are loaded
+        self.worker = BackgroundWorker(self)
+        self.worker.submit(load_history, runs_to_show, on_done=self.show_history, on_error=self.on_load_error)
+        self.protocol("WM_DELETE_WINDOW", self.on_close)
+
+    def show_history(self, history):
+        self.runs, self.comparisons, errors = history
+        self.status_var.set("")
+        if errors:
+            tk.messagebox.showerror("Error", "\n".join(errors), parent=self)
+
+        # Choosing which structure and operation to plot
+        keys = sorted({(r['structure'], r['operation']) for run in self.runs for r in run['results']})
+        structures = sorted({key[0] for key in keys}) or ['dict']
+        operations = sorted({key[1] for key in keys}) or ['Get']
+        controls = tk.Frame(self)
+        controls.pack(pady=5)
+        self.structure_var = tk.StringVar(value=structures[0])
+        self.operation_var = tk.StringVar(value=operations[0])
+        tk.OptionMenu(controls, self.structure_var, *structures, command=lambda _: self.draw()).pack(side=tk.LEFT, padx=5)
+        tk.OptionMenu(controls, self.operation_var, *operations, command=lambda _: self.draw()).pack(side=tk.LEFT, padx=5)
+
+        regressions = [c for c in self.comparisons if c['regression']]
+        if len(self.runs) < 2:
+            summary = "Run the tests at least twice to compare runs."
+        elif regressions:
+            summary = "Regressions in the latest run: " + ", ".join(
+                f"{c['structure']} {c['operation']} n={c['n']} ({c['ratio']:.2f}x)" for c in regressions)
+        else:
+            summary = "No significant regressions in the latest run."
+        tk.Label(self, text=summary, wraplength=850, fg='red' if regressions else 'black').pack(pady=5)
+
+        self.canvas_frame = tk.Frame(self)
+        self.canvas_frame.pack(fill=tk.BOTH, expand=True)
+        self.draw()
+
+    def on_load_error(self, error):
+        self.status_var.set("The benchmark history could not be loaded.")
+        tk.messagebox.showerror("Error", f"The benchmark history could not be loaded: {error}", parent=self)
+
+    def on_close(self):
+        self.worker.shutdown(cancel_pending=True)
+        self.destroy()
+
+    def draw(self):
+        for widget in self.canvas_frame.winfo_children():
+            widget.destroy()
+        fig, ax = plt.subplots(figsize=(10, 5))
+        plot_history(ax, self.runs, self.structure_var.get(), self.operation_var.get(), self.comparisons)
+        canvas = FigureCanvasTkAgg(fig, master=self.canvas_frame)
+        canvas.draw()
+        canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+# Reading the latest runs and comparing the latest run with the run before it, in the background.
+# Returns the runs, the comparisons and a message for every run that was deleted from the history since it was listed.
+def load_history(task, runs_to_show):
+    runs, errors = [], []
+    for run in list_runs(limit=runs_to_show):
+        task.check()
+        try:
+            runs.append(load_run(run['id']))
+        except ValueError as e:
+            errors.append(str(e))
+    comparisons = compare_runs(runs[-2], runs[-1]) if len(runs) >= 2 else []
+    return runs, comparisons, errors
+
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = PerformanceDialog(root)
@@ -0,0 +1,319 @@
+'''
+Recipe codecs module - the file formats a whole recipes dictionary can be saved in and loaded from.
+
+json.dump and json.load on the whole dictionary build the complete file as one string in memory before writing it (and read
+the complete file into one string before parsing it), so saving and loading a large catalogue needs several times the memory
+of the recipes themselves, and the time goes into encoding and decoding. A codec writes and reads the recipes one at a time:
+    dump(recipes, f)  - writes any mapping of recipes (a dict, LazyRecipeStore or CompactRecipeStore) to a binary file
+    iter_load(f)      - yields (name, details) pairs from a binary file, reading it in chunks
+    load(f)           - the dictionary of all recipes
+Codecs that need a package that is not installed are listed in CODECS but get_codec raises an ImportError for them.
+
+JsonCodec ('json') - stdlib json, in the same format as before, so existing recipes.json files can be read and the files can
+    be read by anything that reads JSON. The encoder writes 1000 recipes at a time, the decoder reads 1 MB at a time
+    and decodes one name and one recipe at a time with JSONDecoder.raw_decode, so the memory used is the recipes plus one chunk.
+OrjsonCodec ('orjson', optional) - the same JSON format with the orjson package, several times faster. Encoding is streamed like
+    JsonCodec. orjson can not decode part of a document, so the file is memory-mapped and decoded in one call, which reads the
+    pages from the file cache instead of copying the file into a string first.
+MarshalCodec ('marshal') and MsgpackCodec ('msgpack', optional) - a compact binary format. The file starts with a 4 byte magic
+    number and a version, followed by one record per recipe: a 4 byte little endian length, and the (name, details) pair
+    encoded with marshal or msgpack. Reading a record only needs its length, so decoding is a loop of reads and loads calls.
+    marshal is the fastest to encode and decode, but its format is only guaranteed for one Python version, so the marshal
+    version is stored in the header and a file from another version is refused (save it again as JSON to move it).
+
+best_json_codec() - orjson when it is installed, otherwise json. The journal engine writes its snapshot records with it.
+detect_codec(path) - picks the codec from the first bytes of a file, so a file can be loaded without knowing its format.
+    JsonFileStorage uses it when no codec is given, and to refuse a file that is in another format than its codec.
+Benchmark - codec_benchmark.py compares the size, encode time and decode time of the codecs.
+'''
+import codecs
+import io
+import json
+import marshal
+import mmap
+import re
+import struct
+
+# Binary records are written to the file in batches of this many bytes, and JSON files are read in chunks of this many bytes
+WRITE_BUFFER = 1 << 20
+READ_CHUNK = 1 << 20
+
+_LENGTH = struct.Struct('<I')
+_WHITESPACE = ' \t\n\r'
+_COLON = re.compile(r'[ \t\n\r]*:[ \t\n\r]*')
+_SEPARATOR = re.compile(r'[ \t\n\r]*([,}])[ \t\n\r]*')
+
+
+# Details are usually dictionaries, but read-only mappings (like CompactRecipe) are written as ordinary dictionaries too
+def _plain(details):
+    if isinstance(details, dict):
+        return details
+    return {key: list(value) if isinstance(value, tuple) else value for key, value in details.items()}
+
+
+class Codec:
+    name = None
+    extension = None
+
+    def load(self, f):
+        return dict(self.iter_load(f))
+
+    def dump(self, recipes, f):
+        raise NotImplementedError
+
+    def iter_load(self, f):
+        raise NotImplementedError
+
+
+class JsonCodec(Codec):
+    name = 'json'
+    extension = '.json'
+    # Recipes encoded per call, encoding a slice of the dictionary at a time keeps the loop in the C encoder
+    batch_size = 1000
+
+    def __init__(self):
+        self._encode = json.JSONEncoder(default=_plain).encode
+
+    def _dumps(self, value):
+        return self._encode(value).encode('utf-8')
+
+    # One value as JSON bytes, used by the journal engine's snapshot (see lazy_store.py), which encodes one recipe at a time
+    def dumps(self, value):
+        return self._dumps(value)
+
+    def dump(self, recipes, f):
+        f.write(b'{')
+        separator = b''
+        batch = {}
+        for name, details in recipes.items():
+            batch[name] = details
+            if len(batch) >= self.batch_size:
+                f.write(separator + self._dumps(batch)[1:-1])
+                separator = b', '
+                batch = {}
+        if batch:
+            f.write(separator + self._dumps(batch)[1:-1])
+        f.write(b'}')
+
+    def iter_load(self, f):
+        return _JsonReader(f).items()
+
+
+# Reading a JSON object one member at a time, refilling the buffer from the file whenever a value is not complete yet
+class _JsonReader:
+    def __init__(self, f):
+        self.f = f
+        self.decoder = json.JSONDecoder()
+        # Keeps the bytes of a character cut in half by a chunk boundary for the next chunk
+        self.utf8 = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.position = 0
+        self.eof = False
+
+    def _fill(self):
+        if self.eof:
+            return False
+        data = self.f.read(READ_CHUNK)
+        self.eof = not data
+        self.buffer = self.buffer[self.position:] + self.utf8.decode(data, final=self.eof)
+        self.position = 0
+        return not self.eof
+
+    # The next character that is not whitespace, or '' at the end of the file
+    def _peek(self):
+        while True:
+            while self.position < len(self.buffer) and self.buffer[self.position] in _WHITESPACE:
+                self.position += 1
+            if self.position < len(self.buffer):
+                return self.buffer[self.position]
+            if not self._fill():
+                return ''
+
+    def _expect(self, char):
+        found = self._peek()
+        if found != char:
+            raise ValueError(f'Expected {char!r} in the JSON file, found {found or "the end of the file"!r}')
+        self.position += 1
+
+    # A record is only accepted when the separator after it is in the buffer, so a value cut in half by the end of the chunk
+    # (which could still parse, like a number) is decoded again after the next chunk is read
+    def items(self):
+        # An empty file has no recipes
+        if self._peek() == '':
+            return
+        self._expect('{')
+        if self._peek() == '}':
+            return
+        raw_decode = self.decoder.raw_decode
+        while True:
+            try:
+                name, end = raw_decode(self.buffer, self.position)
+                end = _COLON.match(self.buffer, end).end()
+                details, end = raw_decode(self.buffer, end)
+                separator = _SEPARATOR.match(self.buffer, end)
+                if separator is None:
+                    raise ValueError('Expected "," or "}" after a recipe')
+            except (ValueError, AttributeError) as e:
+                if self._fill():
+                    # The whitespace before the record may only have arrived with the new chunk
+                    self._peek()
+                    continue
+                raise ValueError(f'Invalid JSON recipes file: {e}') from e
+            self.position = separator.end()
+            yield name, details
+            if separator.group(1) == '}':
+                return
+
+
+class OrjsonCodec(JsonCodec):
+    name = 'orjson'
+    extension = '.json'
+
+    def __init__(self):
+        import orjson
+        self.orjson = orjson
+
+    def _dumps(self, value):
+        return self.orjson.dumps(value, default=_plain)
+
+    def iter_load(self, f):
+        return iter(self.load(f).items())
+
+    def load(self, f):
+        try:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except io.UnsupportedOperation:
+            # Not a real file (like BytesIO)
+            recipes = self.orjson.loads(f.read() or b'{}')
+        except ValueError:
+            # mmap can not map an empty file
+            return {}
+        else:
+            with data:
+                with memoryview(data) as view:
+                    recipes = self.orjson.loads(view)
+        if not isinstance(recipes, dict):
+            raise ValueError('The JSON file does not contain an object')
+        return recipes
+
+
+class _RecordCodec(Codec):
+    magic = None
+
+    def _dumps(self, record):
+        raise NotImplementedError
+
+    def _loads(self, data):
+        raise NotImplementedError
+
+    def _header(self):
+        return self.magic + _LENGTH.pack(self.version)
+
+    def dump(self, recipes, f):
+        parts = [self._header()]
+        size = len(parts[0])
+        for name, details in recipes.items():
+            data = self._dumps((name, _plain(details)))
+            parts.append(_LENGTH.pack(len(data)))
+            parts.append(data)
+            size += 4 + len(data)
+            if size >= WRITE_BUFFER:
+                f.write(b''.join(parts))
+                parts = []
+                size = 0
+        f.write(b''.join(parts))
+
+    def iter_load(self, f):
+        header = f.read(8)
+        if not header:
+            return
+        if header[:4] != self.magic:
+            raise ValueError(f'Not a {self.name} recipes file')
+        version = _LENGTH.unpack(header[4:])[0]
+        if version != self.version:
+            raise ValueError(f'The {self.name} recipes file has version {version}, this program reads version {self.version}')
+        read = f.read
+        loads = self._loads
+        while True:
+            prefix = read(4)
+            if not prefix:
+                return
+            length = _LENGTH.unpack(prefix)[0]
+            data = read(length)
+            if len(prefix) < 4 or len(data) < length:
+                raise ValueError('The recipes file ends in the middle of a record')
+            name, details = loads(data)
+            yield name, details
+
+
+class MarshalCodec(_RecordCodec):
+    name = 'marshal'
+    extension = '.marshal'
+    magic = b'RCPM'
+    version = marshal.version
+
+    def _dumps(self, record):
+        return marshal.dumps(record, self.version)
+
+    def _loads(self, data):
+        return marshal.loads(data)
+
+
+class MsgpackCodec(_RecordCodec):
+    name = 'msgpack'
+    extension = '.msgpack'
+    magic = b'RCPP'
+    version = 1
+
+    def __init__(self):
+        import msgpack
+        self._packer = msgpack.Packer()
+        self._unpackb = msgpack.unpackb
+
+    def _dumps(self, record):
+        return self._packer.pack(record)
+
+    def _loads(self, data):
+        return self._unpackb(data, use_list=True)
+
+
+CODECS = {codec.name: codec for codec in (JsonCodec, OrjsonCodec, MarshalCodec, MsgpackCodec)}
+
+
+def get_codec(name='json'):
+    try:
+        codec = CODECS[name]
+    except KeyError:
+        raise ValueError(f'Unknown codec {name!r}, expected one of {", ".join(CODECS)}')
+    try:
+        return codec()
+    except ImportError as e:
+        raise ImportError(f'The {name} codec needs the {e.name} package (pip install {e.name})') from e
+
+
+def available_codecs():
+    names = []
+    for name in CODECS:
+        try:
+            get_codec(name)
+        except ImportError:
+            continue
+        names.append(name)
+    return names
+
+
+# The fastest installed JSON codec, for reading and writing files that have to stay JSON
+def best_json_codec():
+    try:
+        return get_codec('orjson')
+    except ImportError:
+        return get_codec('json')
+
+
+def detect_codec(path):
+    with open(path, 'rb') as f:
+        start = f.read(4)
+    for codec in (MarshalCodec, MsgpackCodec):
+        if start == codec.magic:
+            return get_codec(codec.name)
+    return best_json_codec()
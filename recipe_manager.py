@@ -1,23 +1,39 @@
 '''
-Importing the save_recipes and load_recipes from the storage module/file.
+Importing get_engine from the storage module/file, which returns the storage engine used for saving and loading recipes.
+Importing the IngredientIndex class from the ingredient_index module/file, used for looking up recipes by their ingredients.
+Importing the TextIndex class from the text_search module/file, used for full-text search and name autocomplete.
+Importing the FuzzyNameIndex class from the fuzzy_search module/file, used for finding recipe names with typos in them.
+Importing the RecipeRecommender class from the recommender module/file, used for finding recipes with similar ingredients.
+Importing the readers from the importers module/file, used for importing recipes from JSON-lines and CSV files.
+Importing the OrderedIndex class from the ordered_index module/file, used for listing recipe names in alphabetical order.
 
 Defining a class RecipeManager. This class will be responsible for managing the recipes, with methods for adding, deleting, getting and listing recipes.
 
 class RecipeManager:
     The constructor method is called when a new instance of RecipeManager is created.
-    Load the existing recipes from 'recipes.json' into the 'recipes' dictionary upon initialization of the RecipeManager.
-    If 'recipes.json' doesn't exist, load_recipes will return an empty dictionary.
+    A storage engine can be passed in, otherwise the default engine from the storage module is used.
+    Load the existing recipes from the storage engine into the 'recipes' dictionary upon initialization of the RecipeManager.
+    If 'recipes.json' doesn't exist, the engine will return an empty dictionary.
+    With the default engine the 'recipes' dictionary is a LazyRecipeStore, which only decodes a recipe when it is asked for.
+    The list of tuples is only built the first time recipes_list is used, since only the performance test needs it.
+    With compact=True the recipes are kept in a CompactRecipeStore (see compact_recipes.py) instead, which uses much less memory
+    per recipe. All recipes are then decoded at startup, so it is meant for keeping a large catalogue in memory.
+    The search indexes (like the ingredient index) are only built the first time they are used, and from then on
+    they are kept up to date by the add and delete methods instead of being rebuilt.
+    An index may be built in another thread (the GUI builds them on its worker). The build reads a snapshot of the names without
+    holding _index_lock, and the recipes added or deleted in the meantime are replayed on the new index before it is put in
+    place, so adding and deleting only wait for that short replay and never for the whole build (see _build_index).
 
     Method for adding new recipes:
         Check if the recipe name already exists in the dictionary. If it does, return False to indicate failure.
         If the recipe name does not exist, add the new recipe to the 'recipes' dictionary.
         The recipe is stored as a dictionary itself, with keys 'ingredients' and 'instructions'.
-        Saves the updated 'recipes' dictionary to 'recipes.json'.
+        Records the added recipe with the storage engine, which only writes the change and not the whole dictionary.
         Returns 'True' to indicate a successful add.
     
     Method for deleting recipes:
         Check if the recipe name exists in the 'recipes' dictionary. If so, deleting it.
-        Save the updated 'recipes' dictionary to 'recipes.json'
+        Records the deletion with the storage engine.
         Returns 'True' to indicate a successful delete.
         Returns 'False' if the recipe name does not exist.
     
@@ -25,42 +41,366 @@ class RecipeManager:
         Using the dictionary .get() method to return the recipe if it exists, or None if it doesn't.
 
     Method for listing recipe names:
-        Using the dictionary.keys() method to return a list of all recipe names.
+        Without arguments, using the dictionary.keys() method to return a list of all recipe names, in the order they were added.
+        With start, stop, prefix or limit, the names come from the ordered index (see ordered_index.py) in alphabetical order:
+        the names from start (inclusive) to stop (exclusive), only those starting with prefix, and at most limit of them.
+        page_recipes - cursor-based pagination, one page of names in alphabetical order and the cursor for the next page
+            (None on the last page). Passing that cursor back continues after the last name, even if recipes were added or
+            deleted in between. Both only look at the names they return, O(log n + k) for k names.
+        The ordered index is built the first time it is used, and kept up to date like the search indexes.
 
-    Finally, methods for doing the same functions but using a list instead of the dictionary. These are not used in the actual recipe management application -
+    Method for closing the manager:
+        Flushes the changes that are waiting, and lets the storage engine finish any background work and close its files.
+
+    Methods for finding recipes by ingredients:
+        find_recipes_by_ingredients - AND / OR / NOT query, returning the sorted names of the matching recipes.
+        recipes_for_pantry - "what can I cook", recipes ranked by how many of their ingredients are in the pantry.
+        With the SQLite storage engine these are SQL queries on the database (see sqlite_storage.py) instead of an index in memory.
+
+    Methods for full-text search:
+        search_recipes - BM25 ranked search over names and instructions, with "quoted phrases".
+        autocomplete - recipe names starting with a prefix.
+        The text index is loaded from recipes.search.json if it matches the recipe files, and saved there again on close.
+
+    Method for typo-tolerant name lookup:
+        closest_recipe_names - the recipe names closest to the typed name by edit distance, as (name, distance) tuples,
+            so "potbread" or "Frenchpress Cofee" still find the recipe. Uses a trigram index (see fuzzy_search.py).
+
+    Method for recommendations:
+        similar_recipes - "more like this", the recipes with the most similar ingredients as (name, score) tuples,
+            using Jaccard or cosine similarity (see recommender.py). Large catalogues use MinHash / LSH instead of comparing every recipe.
+
+    Methods for adding and deleting many recipes at once:
+        batch - a context manager, 'with manager.batch():'. Changes made inside the block are only persisted when the block exits,
+            with a single call to the storage engine instead of one call per recipe. Batches can be nested, the outermost one flushes.
+        flush - persists the changes that are waiting. With autoflush=False the manager never writes by itself, and flush is
+            called by whoever owns the manager - the GUI calls it from a background thread, so the window never waits for the disk.
+            If the storage engine fails (a full disk, no permission), the changes stay waiting and the next flush or close tries again.
+        add_recipes_bulk / delete_recipes_bulk - add or delete many recipes inside one batch, returning a BulkResult that counts
+            the records that were added (or deleted), skipped (duplicates, or missing names when deleting) and failed (invalid records).
+        import_jsonl / import_csv - stream recipes from a file through add_recipes_bulk.
+
+    Finally, methods for doing the same functions but using a list instead of the dictionary, and using an ordered index (recipes_sorted)
+    with a value per name. These are not used in the actual recipe management application -
     but for the testing section of the application in the performance_test.py module used from the performance testing button.
 '''
-from storage import load_recipes, save_recipes
+import os
+import threading
+from collections.abc import Mapping
+from contextlib import contextmanager
+from storage import get_engine
+from ingredient_index import IngredientIndex
+from text_search import TextIndex, SEARCH_INDEX_PATH
+from fuzzy_search import FuzzyNameIndex
+from recommender import RecipeRecommender
+from importers import parse_record, read_csv, read_jsonl
+from compact_recipes import CompactRecipeStore
+from ordered_index import OrderedIndex
+
+
+class BulkResult:
+    # Keeping at most this many error messages, a broken file should not fill the memory with errors
+    MAX_ERRORS = 100
+
+    def __init__(self, action='added'):
+        self.action = action
+        self.succeeded = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+
+    def add_error(self, message):
+        self.failed += 1
+        if len(self.errors) < self.MAX_ERRORS:
+            self.errors.append(message)
+
+    def merge(self, other):
+        self.succeeded += other.succeeded
+        self.skipped += other.skipped
+        self.failed += other.failed
+        self.errors.extend(other.errors[:self.MAX_ERRORS - len(self.errors)])
+
+    def __str__(self):
+        return f'{self.succeeded} {self.action}, {self.skipped} skipped, {self.failed} failed'
+
 
 class RecipeManager:
-    def __init__(self):
+    def __init__(self, storage=None, autoflush=True, compact=False):
+        self.storage = storage if storage is not None else get_engine()
+        self.autoflush = autoflush
         # Main dictionary storage
-        self.recipes_dict = load_recipes()  
-        # Convert to list of tuples (name, {details}) for comparison in performance test section
-        self.recipes_list = [(name, details) for name, details in self.recipes_dict.items()]
+        self.recipes_dict = self.storage.load()
+        if compact:
+            self.recipes_dict = CompactRecipeStore(self.recipes_dict)
+        self._recipes_list = None
+        self._recipes_sorted = None
+        # Indexes that have been built so far, updated on every add and delete
+        self._indexes = []
+        self._ingredient_index = None
+        self._storage_ingredient_index = False
+        self._text_index = None
+        self._fuzzy_index = None
+        self._recommender = None
+        self._ordered_index = None
+        # The lock is held while the recipes and the built indexes change, and while an index is put in place.
+        # An index is built without it (see _build_index), one at a time (_build_lock), and every build in progress has a
+        # set in _builds collecting the names changed since it started.
+        self._index_lock = threading.RLock()
+        self._build_lock = threading.Lock()
+        self._builds = []
+        # Changes waiting to be persisted, while inside a batch or when autoflush is off.
+        # The lock is needed because flush may be called from another thread than the one making changes.
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._batch_depth = 0
+
+    # Convert to list of tuples (name, {details}) for comparison in performance test section, the first time it is needed
+    @property
+    def recipes_list(self):
+        if self._recipes_list is None:
+            self._recipes_list = [(name, details) for name, details in self.recipes_dict.items()]
+        return self._recipes_list
+
+    @recipes_list.setter
+    def recipes_list(self, recipes_list):
+        self._recipes_list = recipes_list
+
+    # The recipes in an ordered index, the third structure compared in the performance test section
+    @property
+    def recipes_sorted(self):
+        if self._recipes_sorted is None:
+            self._recipes_sorted = OrderedIndex.from_items(self.recipes_dict.items())
+        return self._recipes_sorted
+
+    @recipes_sorted.setter
+    def recipes_sorted(self, recipes_sorted):
+        self._recipes_sorted = recipes_sorted
+
+    # Storage engines that can answer ingredient queries themselves (like SQLiteStorage) provide their own index,
+    # which is kept up to date by the engine, otherwise an IngredientIndex is built from the recipes
+    @property
+    def ingredient_index(self):
+        if self._ingredient_index is None:
+            with self._build_lock:
+                if self._ingredient_index is None and hasattr(self.storage, 'ingredient_index'):
+                    self._storage_ingredient_index = True
+                    self._ingredient_index = self.storage.ingredient_index()
+                elif self._ingredient_index is None:
+                    self._ingredient_index = self._build_index(IngredientIndex.build)
+        return self._ingredient_index
+
+    # The engine's index only sees what has been written, so pending changes are flushed before asking it
+    def _ingredient_query_index(self):
+        index = self.ingredient_index
+        if self._storage_ingredient_index and self._pending:
+            self.flush()
+        return index
+
+    @property
+    def text_index(self):
+        if self._text_index is None:
+            with self._build_lock:
+                if self._text_index is None:
+                    self._text_index = self._build_index(lambda recipes: self._load_text_index() or TextIndex.build(recipes))
+        return self._text_index
+
+    @property
+    def fuzzy_index(self):
+        if self._fuzzy_index is None:
+            with self._build_lock:
+                if self._fuzzy_index is None:
+                    self._fuzzy_index = self._build_index(FuzzyNameIndex.build)
+        return self._fuzzy_index
+
+    @property
+    def recommender(self):
+        if self._recommender is None:
+            with self._build_lock:
+                if self._recommender is None:
+                    self._recommender = self._build_index(RecipeRecommender.build)
+        return self._recommender
+
+    @property
+    def ordered_index(self):
+        if self._ordered_index is None:
+            with self._build_lock:
+                if self._ordered_index is None:
+                    self._ordered_index = self._build_index(OrderedIndex)
+        return self._ordered_index
+
+    # Building an index from a snapshot of the names without holding _index_lock, so a build on another thread does not block
+    # adding and deleting. The recipes changed during the build are then removed from the new index and added again as
+    # they are now, under the lock, and the index is added to the ones kept up to date.
+    def _build_index(self, build):
+        changed = set()
+        with self._index_lock:
+            names = list(self.recipes_dict)
+            self._builds.append(changed)
+        try:
+            index = build(_RecipesSnapshot(self.recipes_dict, names))
+            with self._index_lock:
+                for name in changed:
+                    index.remove_recipe(name)
+                    if name in self.recipes_dict:
+                        index.add_recipe(name, self.recipes_dict[name])
+                self._indexes.append(index)
+            return index
+        finally:
+            with self._index_lock:
+                self._builds.remove(changed)
+
+    # The text index file is kept next to the recipe snapshot, and can only be reused if the engine can tell that the files are unchanged
+    def _search_index_path(self):
+        snapshot_path = getattr(self.storage, 'snapshot_path', None) or getattr(self.storage, 'path', None)
+        if snapshot_path is None:
+            return SEARCH_INDEX_PATH
+        return os.path.splitext(snapshot_path)[0] + '.search.json'
+
+    def _load_text_index(self):
+        if not hasattr(self.storage, 'state_token'):
+            return None
+        return TextIndex.load(self.storage.state_token(), self._search_index_path())
 
     def add_recipe_dict(self, name, ingredients, instructions):
-        if name in self.recipes_dict:
-            return False
-        self.recipes_dict[name] = {
-            'ingredients': ingredients,
-            'instructions': instructions
-        }
-        save_recipes(self.recipes_dict)
-        return True
+        with self._index_lock:
+            if name in self.recipes_dict:
+                return False
+            self.recipes_dict[name] = {
+                'ingredients': ingredients,
+                'instructions': instructions
+            }
+            self._persist('add', name, self.recipes_dict[name])
+            for index in self._indexes:
+                index.add_recipe(name, self.recipes_dict[name])
+            for changed in self._builds:
+                changed.add(name)
+            return True
 
     def delete_recipe_dict(self, name):
-        if name in self.recipes_dict:
-            del self.recipes_dict[name]
-            save_recipes(self.recipes_dict)
-            return True
-        return False
+        with self._index_lock:
+            if name in self.recipes_dict:
+                del self.recipes_dict[name]
+                self._persist('delete', name)
+                for index in self._indexes:
+                    index.remove_recipe(name)
+                for changed in self._builds:
+                    changed.add(name)
+                return True
+            return False
+
+    def _persist(self, action, name, details=None):
+        if self._batch_depth or not self.autoflush:
+            with self._pending_lock:
+                self._pending.append((action, name, details))
+        elif self._pending:
+            # Earlier changes failed to be written, they have to go first
+            with self._pending_lock:
+                self._pending.append((action, name, details))
+            self.flush()
+        else:
+            try:
+                self.storage.record_change(action, name, details)
+            except BaseException:
+                with self._pending_lock:
+                    self._pending.append((action, name, details))
+                raise
+
+    @contextmanager
+    def batch(self):
+        self._batch_depth += 1
+        try:
+            yield self
+        finally:
+            self._batch_depth -= 1
+            # Flushing even if the block failed, the changes made before the error are already in the dictionary
+            if self._batch_depth == 0 and self.autoflush:
+                self.flush()
+
+    def has_pending_changes(self):
+        return bool(self._pending)
+
+    def flush(self):
+        with self._pending_lock:
+            changes, self._pending = self._pending, []
+        if changes:
+            try:
+                self.storage.record_changes(changes)
+            except BaseException:
+                # Putting the changes back in front of the ones made in the meantime, so the next flush (or close) writes them
+                with self._pending_lock:
+                    self._pending[:0] = changes
+                raise
+
+    def add_recipes_bulk(self, records):
+        result = BulkResult('added')
+        with self.batch():
+            for record in records:
+                try:
+                    name, ingredients, instructions = parse_record(record)
+                except ValueError as e:
+                    result.add_error(str(e))
+                    continue
+                if self.add_recipe_dict(name, ingredients, instructions):
+                    result.succeeded += 1
+                else:
+                    result.skipped += 1
+        return result
+
+    def delete_recipes_bulk(self, names):
+        result = BulkResult('deleted')
+        with self.batch():
+            for name in names:
+                if not isinstance(name, str):
+                    result.add_error(f'Recipe name must be a string, got {name!r}')
+                elif self.delete_recipe_dict(name):
+                    result.succeeded += 1
+                else:
+                    result.skipped += 1
+        return result
+
+    def import_jsonl(self, path):
+        return self.add_recipes_bulk(read_jsonl(path))
+
+    def import_csv(self, path):
+        return self.add_recipes_bulk(read_csv(path))
 
     def get_recipe(self, name):
         return self.recipes_dict.get(name, None)
 
-    def list_recipes(self):
-        return list(self.recipes_dict.keys())
+    def list_recipes(self, start=None, limit=None, prefix=None, stop=None):
+        if start is None and limit is None and prefix is None and stop is None:
+            return list(self.recipes_dict.keys())
+        return list(self.ordered_index.range(start=start, stop=stop, prefix=prefix, limit=limit))
+
+    def page_recipes(self, cursor=None, limit=50, prefix=None, start=None, stop=None):
+        return self.ordered_index.page(cursor, limit, prefix, start, stop)
+
+    def find_recipes_by_ingredients(self, all_of=(), any_of=(), none_of=()):
+        return self._ingredient_query_index().query(all_of, any_of, none_of)
+
+    def recipes_for_pantry(self, pantry, min_coverage=0.0, limit=None):
+        return self._ingredient_query_index().recipes_for_pantry(pantry, min_coverage, limit)
+
+    def search_recipes(self, query, limit=10):
+        return self.text_index.search(query, limit)
+
+    def autocomplete(self, prefix, limit=10):
+        return self.text_index.autocomplete(prefix, limit)
+
+    # The GUI asks from its worker thread while recipes are added on the Tk thread, so the index is not changed during the query
+    def closest_recipe_names(self, name, limit=5, max_distance=None):
+        fuzzy_index = self.fuzzy_index
+        with self._index_lock:
+            return fuzzy_index.closest(name, limit, max_distance)
+
+    def similar_recipes(self, name, limit=5, metric='jaccard'):
+        return self.recommender.similar(name, limit, metric)
+
+    def close(self):
+        self.flush()
+        if self._text_index is not None and self._text_index.dirty and hasattr(self.storage, 'state_token'):
+            self._text_index.save(self.storage.state_token(), self._search_index_path())
+        self.storage.close()
     
     # List-based operations for comparison
     def add_recipe_list(self, name, ingredients, instructions):
@@ -82,4 +422,40 @@ class RecipeManager:
         for recipe in self.recipes_list:
             if recipe[0] == name:
                 return recipe[1]
-        return None
\ No newline at end of file
+        return None
+
+    # Ordered index operations for comparison
+    def add_recipe_sorted(self, name, ingredients, instructions):
+        if name in self.recipes_sorted:
+            return False
+        self.recipes_sorted.insert(name, {'ingredients': ingredients, 'instructions': instructions})
+        return True
+
+    def delete_recipe_sorted(self, name):
+        return self.recipes_sorted.remove(name) is not None
+
+    def get_recipe_sorted(self, name):
+        return self.recipes_sorted.get(name)
+
+
+# The recipes as they were when an index build started: the names are fixed, and a recipe deleted since then is skipped
+# (the build replays it afterwards), so the build can read the recipes while another thread changes them
+class _RecipesSnapshot(Mapping):
+    def __init__(self, recipes, names):
+        self.recipes = recipes
+        self.names = names
+
+    def __getitem__(self, name):
+        return self.recipes[name]
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def items(self):
+        for name in self.names:
+            details = self.recipes.get(name)
+            if details is not None:
+                yield name, details
@@ -0,0 +1,346 @@
+'''
+Recommender module - "more like this", the recipes with the most similar ingredients.
+
+Every recipe is a row of bits in a NumPy matrix, with one bit for every different (normalized) ingredient in the catalogue,
+set when the recipe uses that ingredient. 64 ingredients fit in one uint64 word, so a recipe with a few ingredients out of
+thousands takes a few words instead of a long row of zeros and ones. Comparing one recipe with all the others is then a
+bitwise AND of its row with the whole matrix and a count of the bits that are set, done by NumPy for all rows at once:
+- Jaccard similarity: shared ingredients / ingredients in either recipe.
+- Cosine similarity: shared ingredients / sqrt(ingredients in the one * ingredients in the other).
+
+For catalogues too big to compare with every recipe, there is a MinHash / LSH (locality sensitive hashing) mode.
+Each recipe gets a MinHash signature: for each of a number of random hash functions, the smallest hash of its ingredients.
+Two recipes have the same value at a position with a probability equal to their Jaccard similarity. The signature is cut
+into bands, and recipes with an identical band land in the same bucket. Only recipes sharing a bucket with the recipe are
+candidates, and the candidates are then scored exactly with the bit matrix. Similar recipes share a bucket with a high
+probability, and unrelated recipes almost never, so only a small part of the catalogue is scored.
+The signatures and buckets are built the first time LSH is used, with NumPy for the whole catalogue at once.
+
+RecipeRecommender Class
+    build - creates the recommender from an existing recipes dictionary.
+    add_recipe / remove_recipe - updates the rows (and the LSH buckets) of a single recipe, like the other indexes.
+        Rows of deleted recipes are reused, and the matrix grows (doubling) when it is full or a new ingredient does not fit.
+    similar - the top k most similar recipes as (name, score) tuples, best first. Recipes sharing no ingredient are left out.
+        mode='auto' uses LSH when there are more than lsh_threshold recipes, 'exact' or 'lsh' choose one.
+    The results are cached per recipe. When a recipe is added, only the cached results of recipes sharing an ingredient
+    with it are dropped, and when one is deleted only the results it appears in, the other results cannot have changed.
+    Since similar changes the cache (and builds the LSH buckets on first use), it holds a lock, as do add_recipe and
+    remove_recipe, so several threads (like the server's readers) can ask for recommendations at the same time.
+'''
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from ingredient_index import normalize_ingredients
+
+METRICS = ('jaccard', 'cosine')
+MODES = ('auto', 'exact', 'lsh')
+
+# A large prime for the MinHash hash functions (a * x + b) % prime
+_PRIME = (1 << 31) - 1
+
+if hasattr(np, 'bitwise_count'):
+    def _popcount(words):
+        return np.bitwise_count(words).sum(axis=-1, dtype=np.int64)
+else:
+    # Older NumPy versions, counting the bits of every byte with a lookup table
+    _BYTE_BITS = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+    def _popcount(words):
+        words = np.ascontiguousarray(words)
+        return _BYTE_BITS[words.view(np.uint8)].reshape(words.shape[:-1] + (-1,)).sum(axis=-1, dtype=np.int64)
+
+
+class RecipeRecommender:
+    def __init__(self, mode='auto', lsh_threshold=50000, num_perm=64, bands=16, cache_size=1024, seed=0):
+        if mode not in MODES:
+            raise ValueError(f'Unknown mode {mode!r}, expected one of {MODES}')
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.mode = mode
+        self.lsh_threshold = lsh_threshold
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        # ingredient -> column, and recipe name <-> row
+        self._columns = {}
+        self._rows = {}
+        self._names = []
+        self._free_rows = []
+        self._bits = np.zeros((16, 1), dtype=np.uint64)
+        self._counts = np.zeros(16, dtype=np.int64)
+        self._active = np.zeros(16, dtype=bool)
+        # MinHash hash functions, and the signatures and buckets, which are only built when LSH is first used
+        rng = np.random.default_rng(seed)
+        self._hash_a = rng.integers(1, _PRIME, num_perm, dtype=np.int64)
+        self._hash_b = rng.integers(0, _PRIME, num_perm, dtype=np.int64)
+        self._band_mix = rng.integers(1, 1 << 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._signatures = None
+        self._row_keys = None
+        self._sorted_keys = None
+        self._sorted_rows = None
+        self._buckets = None
+        self._bucketed = 0
+        # (name, k, metric, mode) -> results, the least recently used results are dropped when the cache is full.
+        # For the invalidation, the cached results using each ingredient column and mentioning each recipe name.
+        self._cache = OrderedDict()
+        self.cache_size = cache_size
+        self._cache_columns = {}
+        self._cached_by_column = {}
+        self._cached_by_name = {}
+        self._lock = threading.RLock()
+
+    # Setting the bits of all recipes at once, instead of one add_recipe call per recipe
+    @classmethod
+    def build(cls, recipes, **kwargs):
+        recommender = cls(**kwargs)
+        rows, columns, counts = [], [], []
+        for row, (name, details) in enumerate(recipes.items()):
+            recipe_columns = [recommender._column(ingredient) for ingredient in normalize_ingredients(details['ingredients'])]
+            recommender._names.append(name)
+            recommender._rows[name] = row
+            rows.extend([row] * len(recipe_columns))
+            columns.extend(recipe_columns)
+            counts.append(len(recipe_columns))
+        size = len(counts)
+        capacity = max(16, 1 << (size - 1).bit_length())
+        words = max(1, -(-len(recommender._columns) // 64))
+        recommender._bits = np.zeros((capacity, words), dtype=np.uint64)
+        recommender._counts = np.zeros(capacity, dtype=np.int64)
+        recommender._counts[:size] = counts
+        recommender._active = np.zeros(capacity, dtype=bool)
+        recommender._active[:size] = True
+        rows = np.asarray(rows, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        np.bitwise_or.at(recommender._bits, (rows, columns // 64), np.left_shift(np.uint64(1), (columns % 64).astype(np.uint64)))
+        return recommender
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, name):
+        return name in self._rows
+
+    def _column(self, ingredient):
+        column = self._columns.get(ingredient)
+        if column is None:
+            column = self._columns[ingredient] = len(self._columns)
+            words = self._bits.shape[1]
+            if column >= words * 64:
+                self._bits = np.hstack([self._bits, np.zeros_like(self._bits)])
+        return column
+
+    def _allocate_row(self, name):
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._names)
+            if row >= len(self._counts):
+                capacity = 2 * len(self._counts)
+                self._bits = np.resize(self._bits, (capacity, self._bits.shape[1]))
+                self._bits[row:] = 0
+                self._counts = np.resize(self._counts, capacity)
+                self._counts[row:] = 0
+                self._active = np.resize(self._active, capacity)
+                self._active[row:] = False
+                if self._signatures is not None:
+                    self._signatures = np.resize(self._signatures, (capacity, self._signatures.shape[1]))
+                    self._row_keys = np.resize(self._row_keys, (capacity, self.bands))
+            self._names.append(None)
+        self._names[row] = name
+        self._rows[name] = row
+        return row
+
+    def add_recipe(self, name, details):
+        with self._lock:
+            self._add_recipe(name, details)
+
+    def _add_recipe(self, name, details):
+        if name in self._rows:
+            self.remove_recipe(name)
+        columns = [self._column(ingredient) for ingredient in normalize_ingredients(details['ingredients'])]
+        row = self._allocate_row(name)
+        self._bits[row] = 0
+        for column in columns:
+            self._bits[row, column // 64] |= np.uint64(1 << (column % 64))
+        self._counts[row] = len(columns)
+        self._active[row] = True
+        if self._signatures is not None:
+            self._add_signature(row, columns)
+        for column in columns:
+            for key in list(self._cached_by_column.get(column, ())):
+                self._drop_cached(key)
+
+    def remove_recipe(self, name):
+        with self._lock:
+            return self._remove_recipe(name)
+
+    def _remove_recipe(self, name):
+        row = self._rows.pop(name, None)
+        if row is None:
+            return False
+        if self._buckets is not None:
+            for band, key in enumerate(self._row_keys[row].tolist()):
+                bucket = self._buckets[band].get(key)
+                if bucket is not None:
+                    bucket.discard(row)
+                    if not bucket:
+                        del self._buckets[band][key]
+        self._active[row] = False
+        self._counts[row] = 0
+        self._bits[row] = 0
+        self._names[row] = None
+        self._free_rows.append(row)
+        for key in list(self._cached_by_name.get(name, ())):
+            self._drop_cached(key)
+        return True
+
+    # The result cache. A new recipe can only appear in the results of recipes sharing an ingredient with it,
+    # and a deleted recipe only changes the results it was part of, so only those results are dropped.
+    def _cache_results(self, key, row, results):
+        self._cache[key] = results
+        columns = self._columns_of(row)
+        self._cache_columns[key] = columns
+        for column in columns:
+            self._cached_by_column.setdefault(column, set()).add(key)
+        for name in {key[0], *(name for name, _ in results)}:
+            self._cached_by_name.setdefault(name, set()).add(key)
+        if len(self._cache) > self.cache_size:
+            self._drop_cached(next(iter(self._cache)))
+
+    def _drop_cached(self, key):
+        results = self._cache.pop(key)
+        for column in self._cache_columns.pop(key):
+            self._discard(self._cached_by_column, column, key)
+        for name in {key[0], *(name for name, _ in results)}:
+            self._discard(self._cached_by_name, name, key)
+
+    @staticmethod
+    def _discard(registry, item, key):
+        keys = registry[item]
+        keys.discard(key)
+        if not keys:
+            del registry[item]
+
+    # MinHash / LSH
+    def _minhash(self, columns):
+        if not columns:
+            return np.full(len(self._hash_a), _PRIME, dtype=np.int64)
+        columns = np.asarray(columns, dtype=np.int64)
+        return ((np.outer(columns, self._hash_a) + self._hash_b) % _PRIME).min(axis=0)
+
+    # One number for every band of the signatures (one row per signature), mixing the band's values with random multipliers
+    def _band_keys(self, signatures):
+        signatures = np.atleast_2d(signatures).astype(np.uint64)
+        mixed = signatures * self._band_mix
+        return mixed.reshape(len(signatures), self.bands, self.rows_per_band).sum(axis=2, dtype=np.uint64)
+
+    def _columns_of(self, row):
+        words = self._bits[row].astype('<u8')
+        bits = np.unpackbits(words.view(np.uint8), bitorder='little')
+        return np.flatnonzero(bits).tolist()
+
+    def _add_signature(self, row, columns):
+        self._signatures[row] = self._minhash(columns)
+        self._row_keys[row] = self._band_keys(self._signatures[row])[0]
+        # Recipes without ingredients are never similar to anything, they are kept out of the buckets
+        if columns:
+            for band, key in enumerate(self._row_keys[row].tolist()):
+                self._buckets[band].setdefault(key, set()).add(row)
+            self._bucketed += 1
+
+    # Building all signatures at once from the (row, column) pairs of the set bits, one hash function at a time:
+    # the pairs are sorted by row, so the minimum for every row is a reduceat over its part of the pairs.
+    # The buckets of every band are a sorted array of band keys with the rows next to them, found with a binary search.
+    # Recipes added later go in small dictionaries instead, until there are enough of them to build everything again.
+    def _build_lsh(self):
+        size = len(self._names)
+        self._signatures = np.full((len(self._counts), len(self._hash_a)), _PRIME, dtype=np.int64)
+        # Going through the matrix one word (64 columns) at a time, only unpacking the rows with a bit set in that word
+        pairs = []
+        for word in range(self._bits.shape[1]):
+            rows = np.flatnonzero(self._bits[:size, word])
+            bits = np.unpackbits(self._bits[rows, word].astype('<u8').view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+            row_positions, bit_positions = np.nonzero(bits)
+            pairs.append((rows[row_positions], bit_positions + 64 * word))
+        rows = np.concatenate([rows for rows, _ in pairs])
+        columns = np.concatenate([columns for _, columns in pairs]).astype(np.int64)
+        order = np.argsort(rows, kind='stable')
+        rows, columns = rows[order], columns[order]
+        if len(rows):
+            starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]])
+            for i in range(len(self._hash_a)):
+                hashes = (columns * self._hash_a[i] + self._hash_b[i]) % _PRIME
+                self._signatures[rows[starts], i] = np.minimum.reduceat(hashes, starts)
+
+        self._row_keys = self._band_keys(self._signatures)
+        rows = np.flatnonzero(self._active[:size] & (self._counts[:size] > 0))
+        keys = self._row_keys[rows].T
+        order = np.argsort(keys, axis=1)
+        self._sorted_keys = np.take_along_axis(keys, order, axis=1)
+        self._sorted_rows = rows[order]
+        self._buckets = [{} for _ in range(self.bands)]
+        self._bucketed = 0
+
+    def _lsh_candidates(self, row):
+        if self._signatures is None or self._bucketed > max(1000, self._sorted_rows.shape[1]):
+            self._build_lsh()
+        keys = self._row_keys[row]
+        parts = []
+        for band, key in enumerate(keys.tolist()):
+            lo = np.searchsorted(self._sorted_keys[band], np.uint64(key), side='left')
+            hi = np.searchsorted(self._sorted_keys[band], np.uint64(key), side='right')
+            parts.append(self._sorted_rows[band, lo:hi])
+            parts.append(np.fromiter(self._buckets[band].get(key, ()), dtype=np.int64))
+        candidates = np.unique(np.concatenate(parts))
+        # Deleted recipes are still in the sorted arrays, and their rows may have been reused by other recipes,
+        # so only the rows that are in use and still share a band key with the recipe are kept
+        candidates = candidates[(candidates != row) & self._active[candidates]]
+        return candidates[(self._row_keys[candidates] == keys).any(axis=1)]
+
+    def _scores(self, row, candidates, metric):
+        shared = _popcount(self._bits[candidates] & self._bits[row])
+        counts = self._counts[candidates]
+        if metric == 'jaccard':
+            union = counts + self._counts[row] - shared
+            return np.divide(shared, union, out=np.zeros(len(shared)), where=union > 0)
+        norms = np.sqrt(counts * self._counts[row])
+        return np.divide(shared, norms, out=np.zeros(len(shared)), where=norms > 0)
+
+    def similar(self, name, k=5, metric='jaccard', mode=None):
+        with self._lock:
+            return self._similar(name, k, metric, mode)
+
+    def _similar(self, name, k, metric, mode):
+        if metric not in METRICS:
+            raise ValueError(f'Unknown metric {metric!r}, expected one of {METRICS}')
+        mode = mode or self.mode
+        if mode == 'auto':
+            mode = 'lsh' if len(self._rows) > self.lsh_threshold else 'exact'
+        row = self._rows.get(name)
+        if row is None or k <= 0:
+            return []
+        key = (name, k, metric, mode)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        if mode == 'lsh':
+            candidates = self._lsh_candidates(row)
+        else:
+            candidates = np.flatnonzero(self._active[:len(self._names)])
+            candidates = candidates[candidates != row]
+        scores = self._scores(row, candidates, metric)
+        keep = scores > 0
+        candidates, scores = candidates[keep], scores[keep]
+        # Taking the k best with argpartition, then sorting those few (by score, then name for equal scores)
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            threshold = scores[top].min()
+            top = np.flatnonzero(scores >= threshold)
+        else:
+            top = np.arange(len(scores))
+        results = sorted(((self._names[candidates[i]], float(scores[i])) for i in top), key=lambda item: (-item[1], item[0]))[:k]
+
+        self._cache_results(key, row, results)
+        return results
@@ -0,0 +1,427 @@
+'''
+Server module - a small HTTP/JSON service for the recipes, built on RecipeManager and asyncio (no extra packages needed).
+
+Endpoints:
+    GET    /recipes?prefix=Pot&limit=100  - recipe names, streamed (see below). Without a prefix in the stored order, with a prefix
+                                            every name starting with it, in alphabetical order (like order=name below).
+    GET    /recipes?order=name&limit=50&start=B&stop=D&after=<cursor>
+                                          - recipe names in alphabetical order from the ordered index (see ordered_index.py),
+                                            from start (inclusive) to stop (exclusive) and only those starting with prefix.
+                                            When there are more names than limit, the X-Next-Cursor header holds the cursor
+                                            for the next page, passed back as after=. Any of prefix, start, stop or after implies order=name.
+    GET    /recipes/<name>                - one recipe, {"name", "ingredients", "instructions"}, or 404
+    POST   /recipes                       - add a recipe, body {"name", "ingredients", "instructions"}. 201, or 409 if it exists
+    POST   /recipes/bulk                  - add a list of recipes, returns the counts of added, skipped and failed recipes
+    DELETE /recipes/<name>                - delete a recipe, or 404
+    GET    /search?q=bake&limit=10        - full-text search, [{"name", "score"}]
+    GET    /closest?q=potbred&limit=5     - typo-tolerant name lookup, [{"name", "distance"}]
+    GET    /similar/<name>?limit=5        - recipes with similar ingredients, [{"name", "score"}]
+    GET    /stats                         - number of recipes, requests served and write batches
+    GET    /metrics                       - the call counters and histograms in the Prometheus text format (see instrumentation.py),
+                                            empty unless the server was started with --instrument
+
+Concurrency:
+- Readers and writers - the manager is used from a thread pool, so a slow read (decoding a recipe from disk, or a query on the
+  SQLite database) does not stop the server from accepting other requests. A ReadWriteLock lets any number of reads run at
+  the same time, while a write runs alone. Waiting writers go first, so a steady stream of reads cannot starve them.
+- Request batching - writes are put in a queue, and a single writer task takes every write that is waiting, applies them all
+  inside one manager.batch() and one write lock, and then answers each request. Under load many writes share one call to
+  the storage engine (one journal append and fsync), instead of one each.
+- Streaming - a large list is sent with chunked transfer encoding, a few thousand names at a time, so the whole response is
+  never built in memory and the client can start reading right away. Only the list of names is copied under the read lock.
+
+Connections are kept open between requests (HTTP/1.1 keep-alive) unless the client asks to close them.
+SIGTERM and SIGINT (Ctrl+C) stop the server cleanly: it stops accepting connections, writes the queued changes, and the
+manager is closed, so a write that was answered is on disk even with a write-behind buffer (see cached_storage.py) in front.
+
+Usage:
+    python cli.py serve --port 8080
+    python server.py --port 8080
+'''
+import argparse
+import asyncio
+import json
+import signal
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from urllib.parse import parse_qs, quote, unquote, urlsplit
+
+from importers import parse_record
+from recipe_manager import RecipeManager
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8080
+# Names per chunk when streaming a list, and the most writes applied in one batch
+STREAM_CHUNK = 2000
+MAX_WRITE_BATCH = 1000
+
+_REASONS = {200: 'OK', 201: 'Created', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+            409: 'Conflict', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+MAX_BODY = 64 * 1024 * 1024
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class ReadWriteLock:
+    def __init__(self):
+        self._readers = 0
+        self._writing = False
+        self._waiting_writers = 0
+        self._condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def read(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: not self._writing and not self._waiting_writers)
+            self._readers += 1
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+
+    @asynccontextmanager
+    async def write(self):
+        async with self._condition:
+            self._waiting_writers += 1
+            try:
+                await self._condition.wait_for(lambda: not self._writing and not self._readers)
+            finally:
+                self._waiting_writers -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            async with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+
+class RecipeServer:
+    def __init__(self, manager, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=4):
+        self.manager = manager
+        self.host = host
+        self.port = port
+        self.lock = ReadWriteLock()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='recipe-server')
+        self.requests = 0
+        self.write_batches = 0
+        self.writes = 0
+        self._write_queue = None
+        self._writer = None
+        self._server = None
+
+    async def start(self):
+        self._write_queue = asyncio.Queue()
+        # The indexes are built lazily on first use, building them all here means reads never change the manager.
+        # The recommender's result cache is the one thing a read changes, it has a lock of its own.
+        await self._run(self._build_indexes)
+        self._writer = asyncio.create_task(self._write_loop())
+        self._server = await asyncio.start_server(self._handle_connection, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    def _build_indexes(self):
+        self.manager.text_index
+        self.manager.fuzzy_index
+        self.manager.recommender
+        self.manager.ingredient_index
+        self.manager.ordered_index
+
+    async def serve_forever(self):
+        await self.start()
+        async with self._server:
+            await self._server.serve_forever()
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._writer is not None:
+            self._writer.cancel()
+        await self._run(self.manager.flush)
+        self.executor.shutdown(wait=True)
+
+    def _run(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    async def read(self, fn, *args):
+        async with self.lock.read():
+            return await self._run(fn, *args)
+
+    # Queuing a write and waiting for the writer task to apply it. fn is called with the manager.
+    async def write(self, fn):
+        future = asyncio.get_running_loop().create_future()
+        await self._write_queue.put((fn, future))
+        return await future
+
+    async def _write_loop(self):
+        while True:
+            batch = [await self._write_queue.get()]
+            while len(batch) < MAX_WRITE_BATCH and not self._write_queue.empty():
+                batch.append(self._write_queue.get_nowait())
+            try:
+                async with self.lock.write():
+                    results = await self._run(self._apply_writes, [fn for fn, _ in batch])
+            except Exception as e:
+                # The storage engine failed to persist the batch, every request in it gets the error.
+                # The changes stay waiting in the manager, and are written again with the next batch or on shutdown.
+                results = [(False, e)] * len(batch)
+            self.write_batches += 1
+            self.writes += len(batch)
+            for (_, future), (ok, value) in zip(batch, results):
+                if future.done():
+                    continue
+                if ok:
+                    future.set_result(value)
+                else:
+                    future.set_exception(value)
+
+    # All the writes of a batch are persisted with one storage call when the batch block ends
+    def _apply_writes(self, writes):
+        results = []
+        with self.manager.batch():
+            for fn in writes:
+                try:
+                    results.append((True, fn(self.manager)))
+                except Exception as e:
+                    results.append((False, e))
+        return results
+
+    # HTTP
+    async def _handle_connection(self, reader, writer):
+        try:
+            while True:
+                try:
+                    request = await self._read_request(reader)
+                except HttpError as e:
+                    # Without a valid length the end of the body is unknown, so the connection can not be used for another request
+                    await self._send_json(writer, e.status, {'error': str(e)}, False)
+                    break
+                if request is None:
+                    break
+                method, path, headers, body = request
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                self.requests += 1
+                try:
+                    await self._dispatch(writer, method, path, body, keep_alive)
+                except HttpError as e:
+                    await self._send_json(writer, e.status, {'error': str(e)}, keep_alive)
+                except Exception as e:
+                    await self._send_json(writer, 500, {'error': f'{type(e).__name__}: {e}'}, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_request(self, reader):
+        try:
+            request_line = await reader.readline()
+        except ConnectionError:
+            return None
+        if not request_line.strip():
+            return None
+        try:
+            method, target, _ = request_line.decode('latin-1').split(' ', 2)
+        except ValueError:
+            raise ConnectionError('Malformed request line')
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        try:
+            length = int(headers.get('content-length') or 0)
+        except ValueError:
+            length = -1
+        if length < 0:
+            raise HttpError(400, 'Invalid Content-Length')
+        if length > MAX_BODY:
+            raise HttpError(413, 'Request body too large')
+        body = await reader.readexactly(length) if length else b''
+        return method.upper(), target, headers, body
+
+    async def _dispatch(self, writer, method, target, body, keep_alive):
+        url = urlsplit(target)
+        parts = [unquote(part) for part in url.path.strip('/').split('/')] if url.path.strip('/') else []
+        query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+        limit = _int_param(query, 'limit', None)
+        # The same check for every endpoint, a limit of 0 is not "the default" and a negative one is not "no limit"
+        if limit is not None and limit < 1:
+            raise HttpError(400, 'limit must be at least 1')
+
+        if parts == ['recipes'] and method == 'GET':
+            await self._stream_names(writer, query, limit, keep_alive)
+        elif parts == ['recipes'] and method == 'POST':
+            name, ingredients, instructions = _parse_body_record(body)
+            added = await self.write(lambda manager: manager.add_recipe_dict(name, ingredients, instructions))
+            if not added:
+                raise HttpError(409, f'Recipe {name!r} already exists')
+            await self._send_json(writer, 201, {'name': name, 'ingredients': ingredients, 'instructions': instructions}, keep_alive)
+        elif parts == ['recipes', 'bulk'] and method == 'POST':
+            records = _parse_body(body)
+            if not isinstance(records, list):
+                raise HttpError(400, 'Expected a list of recipes')
+            result = await self.write(lambda manager: manager.add_recipes_bulk(records))
+            await self._send_json(writer, 200, {'added': result.succeeded, 'skipped': result.skipped,
+                                                'failed': result.failed, 'errors': result.errors}, keep_alive)
+        elif len(parts) == 2 and parts[0] == 'recipes' and method == 'GET':
+            recipe = await self.read(self.manager.get_recipe, parts[1])
+            if recipe is None:
+                raise HttpError(404, f'No recipe named {parts[1]!r}')
+            await self._send_json(writer, 200, {'name': parts[1], **dict(recipe)}, keep_alive)
+        elif len(parts) == 2 and parts[0] == 'recipes' and method == 'DELETE':
+            deleted = await self.write(lambda manager: manager.delete_recipe_dict(parts[1]))
+            if not deleted:
+                raise HttpError(404, f'No recipe named {parts[1]!r}')
+            await self._send_json(writer, 200, {'deleted': parts[1]}, keep_alive)
+        elif parts == ['search'] and method == 'GET':
+            results = await self.read(self.manager.search_recipes, query.get('q', ''), 10 if limit is None else limit)
+            await self._send_json(writer, 200, [{'name': name, 'score': score} for name, score in results], keep_alive)
+        elif parts == ['closest'] and method == 'GET':
+            results = await self.read(self.manager.closest_recipe_names, query.get('q', ''), 5 if limit is None else limit)
+            await self._send_json(writer, 200, [{'name': name, 'distance': distance} for name, distance in results], keep_alive)
+        elif len(parts) == 2 and parts[0] == 'similar' and method == 'GET':
+            results = await self.read(self.manager.similar_recipes, parts[1], 5 if limit is None else limit)
+            await self._send_json(writer, 200, [{'name': name, 'score': score} for name, score in results], keep_alive)
+        elif parts == ['stats'] and method == 'GET':
+            count = await self.read(len, self.manager.recipes_dict)
+            await self._send_json(writer, 200, {'recipes': count, 'requests': self.requests,
+                                                'writes': self.writes, 'write_batches': self.write_batches}, keep_alive)
+        elif parts == ['metrics'] and method == 'GET':
+            import instrumentation
+            await self._send(writer, 200, 'text/plain; version=0.0.4', instrumentation.prometheus_text().encode('utf-8'), keep_alive)
+        elif parts and parts[0] in ('recipes', 'search', 'closest', 'similar', 'stats', 'metrics'):
+            raise HttpError(405, f'{method} is not allowed on {url.path}')
+        else:
+            raise HttpError(404, f'Unknown path {url.path}')
+
+    # The names to send and the cursor of the next page (only for the alphabetical order)
+    def _names(self, query, limit):
+        prefix = query.get('prefix')
+        if query.get('order') == 'name' or any(key in query for key in ('prefix', 'start', 'stop', 'after')):
+            if limit is None:
+                return list(self.manager.ordered_index.range(query.get('start'), query.get('stop'), prefix, query.get('after'))), None
+            return self.manager.page_recipes(query.get('after'), limit, prefix, query.get('start'), query.get('stop'))
+        names = self.manager.list_recipes()
+        return (names if limit is None else names[:limit]), None
+
+    async def _stream_names(self, writer, query, limit, keep_alive):
+        names, cursor = await self.read(self._names, query, limit)
+        headers = {'Content-Type': 'application/json', 'Transfer-Encoding': 'chunked'}
+        if cursor is not None:
+            # Quoted, since a header can only hold latin-1 text and the name is passed back in the query string anyway
+            headers['X-Next-Cursor'] = quote(cursor, safe='')
+        writer.write(_head(200, headers, keep_alive))
+        for start in range(0, max(len(names), 1), STREAM_CHUNK):
+            chunk = json.dumps(names[start:start + STREAM_CHUNK])[1:-1]
+            data = ('[' if start == 0 else ',') + chunk + (']' if start + STREAM_CHUNK >= len(names) else '')
+            encoded = data.encode('utf-8')
+            writer.write(b'%x\r\n%s\r\n' % (len(encoded), encoded))
+            await writer.drain()
+        writer.write(b'0\r\n\r\n')
+        await writer.drain()
+
+    async def _send_json(self, writer, status, payload, keep_alive):
+        await self._send(writer, status, 'application/json', json.dumps(payload, default=dict).encode('utf-8'), keep_alive)
+
+    async def _send(self, writer, status, content_type, body, keep_alive):
+        writer.write(_head(status, {'Content-Type': content_type, 'Content-Length': str(len(body))}, keep_alive) + body)
+        await writer.drain()
+
+
+def _head(status, headers, keep_alive):
+    lines = [f'HTTP/1.1 {status} {_REASONS.get(status, "")}']
+    lines.extend(f'{key}: {value}' for key, value in headers.items())
+    lines.append(f'Connection: {"keep-alive" if keep_alive else "close"}')
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+
+def _int_param(query, key, default):
+    if key not in query:
+        return default
+    try:
+        return int(query[key])
+    except ValueError:
+        raise HttpError(400, f'{key} must be a number')
+
+
+def _parse_body(body):
+    try:
+        return json.loads(body or b'null')
+    except (json.JSONDecodeError, UnicodeDecodeError) as e:
+        raise HttpError(400, f'Invalid JSON: {e}')
+
+
+def _parse_body_record(body):
+    try:
+        return parse_record(_parse_body(body))
+    except ValueError as e:
+        raise HttpError(400, str(e))
+
+
+async def serve(manager, host=DEFAULT_HOST, port=DEFAULT_PORT, workers=4):
+    server = RecipeServer(manager, host, port, workers)
+    loop = asyncio.get_running_loop()
+    stopping = asyncio.Event()
+    signals = []
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        try:
+            loop.add_signal_handler(signum, stopping.set)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on Windows, or not in the main thread
+            continue
+        signals.append(signum)
+    try:
+        await server.start()
+        print(f'Serving {len(manager.recipes_dict)} recipes on http://{server.host}:{server.port}', flush=True)
+        serving = asyncio.ensure_future(server._server.serve_forever())
+        stopped = asyncio.ensure_future(stopping.wait())
+        await asyncio.wait({serving, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        stopped.cancel()
+        if serving.done():
+            # serve_forever only ends by itself with an error
+            serving.result()
+        serving.cancel()
+    finally:
+        for signum in signals:
+            loop.remove_signal_handler(signum)
+        await server.stop()
+
+
+def main(argv=None):
+    from cli import add_storage_arguments, configure_storage
+    parser = argparse.ArgumentParser(description='Serve the recipes over HTTP.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=4, help='threads running the recipe manager calls')
+    add_storage_arguments(parser)
+    parser.add_argument('--instrument', action='store_true', help='count and time the recipe manager and storage calls, see /metrics')
+    args = parser.parse_args(argv)
+    configure_storage(args)
+    if args.instrument:
+        import instrumentation
+        instrumentation.enable()
+    try:
+        manager = RecipeManager(compact=args.compact)
+    except ValueError as e:
+        raise SystemExit(f'Could not load the recipes: {e}')
+    try:
+        asyncio.run(serve(manager, args.host, args.port, args.workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        manager.close()
+
+
+if __name__ == '__main__':
+    main()
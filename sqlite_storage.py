@@ -0,0 +1,312 @@
+'''
+SQLite storage module - a storage engine keeping the recipes in an SQLite database instead of a JSON file.
+
+With a JSON file every read loads the whole file and every write rewrites it, and two programs using the same file overwrite
+each other's changes. SQLite only reads the rows that are asked for, and every change is its own small transaction, so two
+processes can add recipes at the same time without losing anything. The database uses WAL (write-ahead logging) mode, which
+lets other processes keep reading while one process is writing.
+
+Tables:
+    recipes             - id, name (unique), instructions and the number of different ingredients
+    ingredients         - every different normalized ingredient (case-folded and stripped, see ingredient_index.py) once
+    recipe_ingredients  - which ingredients each recipe has, in order, with the ingredient as it was written
+    meta                - small key/value settings, like the version number that is increased on every write
+With indexes on the recipe names, the ingredient names and the ingredient -> recipe links, looking up a recipe by name or
+finding the recipes with an ingredient are index lookups and do not read the other recipes.
+
+SQLiteStorage Class - the storage engine, with the same methods as the engines in storage.py.
+    The first time the database is opened, the recipes in recipes.json (and recipes.journal) are copied into it in one
+    transaction. This only happens once, the JSON file is left as it is. A damaged recipes.json raises ValueError and is
+    not marked as migrated.
+    load - returns a SQLiteRecipeMapping instead of loading every recipe.
+    ingredient_index - returns a SQLiteIngredientIndex, RecipeManager uses it instead of building its own ingredient index.
+    state_token - the write version number, so the saved search index is only reused if nothing has been written since.
+
+SQLiteRecipeMapping Class - behaves like the recipes dictionary. Reads are queries. Changes made by RecipeManager are kept in
+    memory until the manager persists them with record_change(s), after which they are read from the database again
+    (unless the recipe was changed again in the meantime, then the newer change is kept until it is written too).
+
+SQLiteIngredientIndex Class - the same query and recipes_for_pantry methods as IngredientIndex, answered with SQL.
+'''
+import sqlite3
+import threading
+import weakref
+from collections.abc import MutableMapping
+
+from ingredient_index import normalize_ingredient, normalize_ingredients
+from storage import JournalStorage, SNAPSHOT_PATH, JOURNAL_PATH
+
+DATABASE_PATH = 'recipes.db'
+
+_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS recipes (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE,
+    instructions TEXT NOT NULL,
+    ingredient_count INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS ingredients (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS recipe_ingredients (
+    recipe_id INTEGER NOT NULL REFERENCES recipes(id) ON DELETE CASCADE,
+    position INTEGER NOT NULL,
+    ingredient_id INTEGER REFERENCES ingredients(id),
+    text TEXT NOT NULL,
+    PRIMARY KEY (recipe_id, position)
+);
+CREATE INDEX IF NOT EXISTS recipe_ingredients_by_ingredient ON recipe_ingredients (ingredient_id, recipe_id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value
+);
+'''
+
+
+class SQLiteStorage:
+    def __init__(self, path=DATABASE_PATH, json_path=SNAPSHOT_PATH, journal_path=JOURNAL_PATH):
+        self.path = path
+        self.json_path = json_path
+        self.journal_path = journal_path
+        # One connection shared by the threads using the manager (the GUI saves from a worker thread), guarded by a lock
+        self._lock = threading.RLock()
+        self._db = None
+        # The mappings returned by load, told when their pending changes have been written
+        # (weak references, a mapping compares by its contents so it cannot go in a WeakSet)
+        self._mappings = []
+
+    def _connection(self):
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('PRAGMA synchronous=NORMAL')
+            self._db.execute('PRAGMA foreign_keys=ON')
+            self._db.executescript(_SCHEMA)
+            try:
+                self._migrate_from_json()
+            except Exception:
+                # A recipes.json that can not be read is not marked as migrated, the next open tries again
+                self._db.close()
+                self._db = None
+                raise
+        return self._db
+
+    def execute(self, sql, parameters=()):
+        with self._lock:
+            return self._connection().execute(sql, parameters).fetchall()
+
+    # Copying the JSON recipes into the database the first time it is opened
+    def _migrate_from_json(self):
+        db = self._db
+        if db.execute("SELECT 1 FROM meta WHERE key = 'migrated'").fetchone():
+            return
+        with db:
+            if not db.execute('SELECT 1 FROM recipes LIMIT 1').fetchone():
+                recipes = JournalStorage(self.json_path, self.journal_path).load()
+                for name, details in recipes.items():
+                    self._insert(db, name, details)
+            db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('migrated', 1)")
+
+    def _ingredient_id(self, db, token):
+        row = db.execute('SELECT id FROM ingredients WHERE name = ?', (token,)).fetchone()
+        if row is not None:
+            return row[0]
+        return db.execute('INSERT INTO ingredients (name) VALUES (?)', (token,)).lastrowid
+
+    # Adding or updating a recipe in place, so a row written by another connection keeps its id and only its ingredients are replaced
+    def _insert(self, db, name, details):
+        ingredients = list(details['ingredients'])
+        db.execute('INSERT INTO recipes (name, instructions, ingredient_count) VALUES (?, ?, ?) '
+                   'ON CONFLICT(name) DO UPDATE SET instructions = excluded.instructions, ingredient_count = excluded.ingredient_count',
+                   (name, details['instructions'], len(normalize_ingredients(ingredients))))
+        recipe_id = db.execute('SELECT id FROM recipes WHERE name = ?', (name,)).fetchone()[0]
+        db.execute('DELETE FROM recipe_ingredients WHERE recipe_id = ?', (recipe_id,))
+        rows = []
+        for position, text in enumerate(ingredients):
+            token = normalize_ingredient(text)
+            rows.append((recipe_id, position, self._ingredient_id(db, token) if token else None, text))
+        db.executemany('INSERT INTO recipe_ingredients (recipe_id, position, ingredient_id, text) VALUES (?, ?, ?, ?)', rows)
+
+    def _bump_version(self, db):
+        db.execute("INSERT INTO meta (key, value) VALUES ('version', 1) ON CONFLICT(key) DO UPDATE SET value = value + 1")
+
+    def load(self):
+        mapping = SQLiteRecipeMapping(self)
+        self._mappings = [ref for ref in self._mappings if ref() is not None] + [weakref.ref(mapping)]
+        return mapping
+
+    def save(self, recipes):
+        recipes = list(recipes.items())
+        with self._lock:
+            db = self._connection()
+            with db:
+                db.execute('DELETE FROM recipes')
+                for name, details in recipes:
+                    self._insert(db, name, details)
+                self._bump_version(db)
+
+    def record_change(self, action, name, details=None):
+        self.record_changes([(action, name, details)])
+
+    # Every call is one transaction, so a batch of changes is either written completely or not at all
+    def record_changes(self, changes):
+        with self._lock:
+            db = self._connection()
+            with db:
+                for action, name, details in changes:
+                    if action == 'add':
+                        self._insert(db, name, details)
+                    elif action == 'delete':
+                        db.execute('DELETE FROM recipes WHERE name = ?', (name,))
+                self._bump_version(db)
+            # Still under the lock, so a change made to a mapping while this runs is not mistaken for a written one
+            for ref in self._mappings:
+                mapping = ref()
+                if mapping is not None:
+                    mapping.forget_changes(changes)
+
+    def get(self, name):
+        with self._lock:
+            db = self._connection()
+            row = db.execute('SELECT id, instructions FROM recipes WHERE name = ?', (name,)).fetchone()
+            if row is None:
+                return None
+            ingredients = [text for (text,) in db.execute(
+                'SELECT text FROM recipe_ingredients WHERE recipe_id = ? ORDER BY position', (row[0],))]
+        return {'ingredients': ingredients, 'instructions': row[1]}
+
+    def ingredient_index(self):
+        return SQLiteIngredientIndex(self)
+
+    def state_token(self):
+        row = self.execute("SELECT value FROM meta WHERE key = 'version'")
+        return ['sqlite', row[0][0] if row else 0]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        with self._lock:
+            if self._db is not None:
+                self._db.close()
+                self._db = None
+
+
+class SQLiteRecipeMapping(MutableMapping):
+    def __init__(self, storage):
+        self.storage = storage
+        # Changes that have not been written to the database yet
+        self._overlay = {}
+        self._deleted = set()
+
+    def __getitem__(self, name):
+        if name in self._overlay:
+            return self._overlay[name]
+        if name in self._deleted:
+            raise KeyError(name)
+        details = self.storage.get(name)
+        if details is None:
+            raise KeyError(name)
+        return details
+
+    def __setitem__(self, name, details):
+        with self.storage._lock:
+            self._overlay[name] = details
+            self._deleted.discard(name)
+
+    def __delitem__(self, name):
+        with self.storage._lock:
+            if name not in self:
+                raise KeyError(name)
+            self._overlay.pop(name, None)
+            self._deleted.add(name)
+
+    def __contains__(self, name):
+        if name in self._overlay:
+            return True
+        if name in self._deleted:
+            return False
+        return bool(self.storage.execute('SELECT 1 FROM recipes WHERE name = ?', (name,)))
+
+    def __iter__(self):
+        for (name,) in self.storage.execute('SELECT name FROM recipes ORDER BY id'):
+            if name not in self._deleted and name not in self._overlay:
+                yield name
+        yield from list(self._overlay)
+
+    def __len__(self):
+        count = self.storage.execute('SELECT COUNT(*) FROM recipes')[0][0]
+        for name in self._overlay:
+            if not self.storage.execute('SELECT 1 FROM recipes WHERE name = ?', (name,)):
+                count += 1
+        for name in self._deleted:
+            if self.storage.execute('SELECT 1 FROM recipes WHERE name = ?', (name,)):
+                count -= 1
+        return count
+
+    # Called by the storage engine after the changes are written, so reads go to the database again.
+    # Only the changes that were written are forgotten: a name changed again since then keeps its newer pending change.
+    def forget_changes(self, changes):
+        written = {name: (action, details) for action, name, details in changes}
+        for name, (action, details) in written.items():
+            if action == 'add':
+                if self._overlay.get(name) is details:
+                    del self._overlay[name]
+            else:
+                self._deleted.discard(name)
+
+    def copy(self):
+        return dict(self.items())
+
+
+class SQLiteIngredientIndex:
+    def __init__(self, storage):
+        self.storage = storage
+
+    # The names of the recipes having all (or at least one) of the ingredients, as SQL and parameters
+    def _matching(self, tokens, require_all):
+        placeholders = ', '.join('?' * len(tokens))
+        having = f'HAVING COUNT(DISTINCT ri.ingredient_id) = {len(tokens)}' if require_all else ''
+        sql = (f'SELECT r.name FROM recipe_ingredients ri JOIN ingredients i ON i.id = ri.ingredient_id '
+               f'JOIN recipes r ON r.id = ri.recipe_id WHERE i.name IN ({placeholders}) GROUP BY ri.recipe_id {having}')
+        return sql, list(tokens)
+
+    def query(self, all_of=(), any_of=(), none_of=()):
+        all_of = normalize_ingredients(all_of)
+        any_of = normalize_ingredients(any_of)
+        none_of = normalize_ingredients(none_of)
+
+        parts, parameters = [], []
+        for tokens, require_all in ((all_of, True), (any_of, False)):
+            if tokens:
+                sql, values = self._matching(tokens, require_all)
+                parts.append(sql)
+                parameters.extend(values)
+        sql = ' INTERSECT '.join(parts) if parts else 'SELECT name FROM recipes'
+        if none_of:
+            excluded, values = self._matching(none_of, False)
+            sql = f'{sql} EXCEPT {excluded}'
+            parameters.extend(values)
+        return [name for (name,) in self.storage.execute(f'SELECT name FROM ({sql}) ORDER BY name', parameters)]
+
+    def recipes_for_pantry(self, pantry, min_coverage=0.0, limit=None):
+        pantry = normalize_ingredients(pantry)
+        if not pantry:
+            return []
+        placeholders = ', '.join('?' * len(pantry))
+        rows = self.storage.execute(
+            f'SELECT r.id, r.name, COUNT(DISTINCT ri.ingredient_id) * 1.0 / r.ingredient_count AS coverage, '
+            f'r.ingredient_count - COUNT(DISTINCT ri.ingredient_id) AS missing '
+            f'FROM recipe_ingredients ri JOIN ingredients i ON i.id = ri.ingredient_id JOIN recipes r ON r.id = ri.recipe_id '
+            f'WHERE i.name IN ({placeholders}) GROUP BY r.id HAVING coverage >= ? '
+            f'ORDER BY coverage DESC, missing, r.name' + (' LIMIT ?' if limit is not None else ''),
+            list(pantry) + [min_coverage] + ([limit] if limit is not None else []))
+
+        results = []
+        for recipe_id, name, coverage, _ in rows:
+            tokens = {token for (token,) in self.storage.execute(
+                'SELECT i.name FROM recipe_ingredients ri JOIN ingredients i ON i.id = ri.ingredient_id WHERE ri.recipe_id = ?',
+                (recipe_id,))}
+            results.append((name, coverage, sorted(tokens - pantry)))
+        return results
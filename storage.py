@@ -1,30 +1,339 @@
 '''
-Importing the json module, as we are using json for storing the recipes.
+Storage module - handles saving and loading the recipes to and from disk.
 
-Defining the save_recipes function.
-    It opens(or creates if it does not exist) the recipes.json file in write mode. 'f' is the file object that is obtained from opening the file. 
-    Use json.dump to serialize the 'recipes' dictionary and write it to the 'recipes.json' file.
-    The 'recipes' parameter is expected to be a dictionary where the keys are recipe names and the values are their corresponding details.
+Originally every change rewrote the whole recipes.json file with json.dump, which makes each add or delete
+take time proportional to the size of the whole catalogue. The storage is now done through a pluggable storage engine.
+An engine is any object with these methods:
+    load()                                  - returns the dictionary of all recipes
+    save(recipes)                           - writes the full recipes dictionary to disk
+    record_change(action, name, details)    - persists a single 'add' or 'delete' of one recipe
+    record_changes(changes)                 - persists a list of (action, name, details) tuples in one go
+    flush() / close()                       - makes sure everything is on disk before the program stops
+    state_token()                           - (optional) a small value that changes whenever the files on disk change,
+                                              used to check if a saved search index still matches the recipes
 
-Defining the load_recipes function.
-    It tries to open the recipes.json file in read mode, placed in an try-except block in case it does not exist.
-    Deserialize the json data from the file, and returning the resulting dictionary.
+JsonFileStorage - The original behaviour, the whole dictionary is written to recipes.json on every change.
+    Kept as a simple engine for small catalogues, and as a reference for how the data looks on disk.
+    The file is written and read with a codec (see recipe_codecs.py), one recipe at a time instead of one json.dump of the
+    whole dictionary. The default is JSON (with orjson when it is installed), codec='marshal' or 'msgpack' use a binary format.
+    Without a codec, the format of an existing file is detected from its first bytes (detect_codec). A file that is in another
+    format than the codec, or that can not be read, raises a ValueError instead of loading as an empty catalogue, since the
+    next change would then overwrite the file with only that change. Only a missing or empty JSON file is an empty catalogue.
 
+JournalStorage - The default engine. recipes.json is used as a snapshot, and every add/delete is appended as one
+    JSON line to recipes.journal. Loading reads the snapshot and then replays the journal on top of it.
+    When the journal grows past a size threshold it is renamed to recipes.journal.old and a background thread
+    merges it into a new snapshot. The snapshot is always written to a temporary file first and then renamed over
+    the old one, so a crash in the middle of a write leaves either the old or the new snapshot - never half of one.
+    The rotated journal is only removed after the new snapshot is in place, and replaying a journal twice gives the
+    same result, so a crash during compaction does not lose any changes either.
+    The snapshot is loaded as a LazyRecipeStore (see lazy_store.py), so only the offset table is read at startup and
+    recipes are decoded from the memory-mapped snapshot when they are asked for. On systems that do not allow replacing
+    a file that is memory-mapped (Windows), the compaction is skipped and tried again later, the rotated journal keeps the changes.
+
+MemoryStorage - Keeps nothing on disk. Used by the benchmarks and the performance tests, so that the in-memory operations
+    can be measured without the time spent writing files.
+
+SQLiteStorage (sqlite_storage.py) is a third engine keeping the recipes in an SQLite database.
+CachedStorage (cached_storage.py) wraps any of the engines with a read cache and a write-behind buffer.
+
+The module level save_recipes and load_recipes functions are kept, and use the current engine (get_engine/set_engine).
 '''
 import json
+import os
+import threading
+from lazy_store import LazyRecipeStore, write_snapshot
+from recipe_codecs import best_json_codec, detect_codec, get_codec
 
-def save_recipes(recipes):
-    with open('recipes.json', 'w') as f:
-        json.dump(recipes, f)
+SNAPSHOT_PATH = 'recipes.json'
+JOURNAL_PATH = 'recipes.journal'
+# Compact the journal into a new snapshot when it grows past 1 MB
+COMPACT_THRESHOLD = 1024 * 1024
 
-def load_recipes():
+
+def _read_snapshot(path, codec):
     try:
-        with open('recipes.json', 'r') as f:
-            return json.load(f)
+        with open(path, 'rb') as f:
+            return codec.load(f)
     except FileNotFoundError:
         # Return an empty dictionary if the file does not exist
         return {}
-    except json.JSONDecodeError:
-        # Handle the case where the file exists but does not contain valid JSON data
-        # Return an empty dictionary as a fallback
-        return {}
+    except ValueError:
+        # A blank recipes.json (which older versions could leave behind) is an empty catalogue, any other error is passed on
+        if codec.extension == '.json' and _is_blank(path):
+            return {}
+        raise
+
+
+def _is_blank(path):
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 16), b''):
+            if chunk.strip():
+                return False
+    return True
+
+
+# Writing to a temporary file next to the target and renaming it over the target, so readers never see a half written file.
+def _atomic_write(path, recipes, codec):
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        codec.dump(recipes, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+# Applying one journal entry to the recipes dictionary. Adding a recipe overwrites, deleting a missing recipe is ignored,
+# which makes replaying the same journal twice harmless.
+def _apply_entry(recipes, entry):
+    if entry['op'] == 'add':
+        recipes[entry['name']] = entry['recipe']
+    elif entry['op'] == 'delete' and entry['name'] in recipes:
+        del recipes[entry['name']]
+
+
+def _replay_journal(path, recipes):
+    try:
+        with open(path, 'r') as f:
+            for line in f:
+                if not line.endswith('\n'):
+                    # A torn last line from a crash in the middle of an append, the change was never completed
+                    break
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                _apply_entry(recipes, entry)
+    except FileNotFoundError:
+        pass
+    return recipes
+
+
+# Size and modification time of a file, or None if it does not exist
+def _file_state(path):
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def _encode_entry(action, name, details=None):
+    entry = {'op': action, 'name': name}
+    if action == 'add':
+        entry['recipe'] = details
+    # default=dict lets recipes that are read-only mappings (like CompactRecipe) be written as ordinary dictionaries
+    return json.dumps(entry, default=dict) + '\n'
+
+
+class JsonFileStorage:
+    def __init__(self, path=SNAPSHOT_PATH, codec=None):
+        self.path = path
+        if isinstance(codec, str):
+            codec = get_codec(codec)
+        elif codec is None:
+            codec = detect_codec(path) if os.path.exists(path) else best_json_codec()
+        self.codec = codec
+
+    # A file written with another codec is refused, reading it as an empty catalogue would lose it on the next change
+    def _read(self):
+        try:
+            detected = detect_codec(self.path)
+        except FileNotFoundError:
+            return {}
+        if detected.extension != self.codec.extension:
+            raise ValueError(f'{self.path} is a {detected.name} file, it can not be read with the {self.codec.name} codec')
+        return _read_snapshot(self.path, self.codec)
+
+    def load(self):
+        return self._read()
+
+    def save(self, recipes):
+        _atomic_write(self.path, recipes, self.codec)
+
+    def record_change(self, action, name, details=None):
+        self.record_changes([(action, name, details)])
+
+    # Every change still rewrites the whole file, this is what the journal engine avoids
+    def record_changes(self, changes):
+        recipes = self._read()
+        for action, name, details in changes:
+            _apply_entry(recipes, {'op': action, 'name': name, 'recipe': details})
+        _atomic_write(self.path, recipes, self.codec)
+
+    def state_token(self):
+        return [_file_state(self.path)]
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class JournalStorage:
+    def __init__(self, snapshot_path=SNAPSHOT_PATH, journal_path=JOURNAL_PATH, compact_threshold=COMPACT_THRESHOLD):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path
+        self.rotated_path = journal_path + '.old'
+        self.compact_threshold = compact_threshold
+        # The lock protects the journal file object, appends may come from more than one thread
+        self._lock = threading.Lock()
+        self._journal = None
+        self._compactor = None
+
+    def load(self):
+        self.wait_for_compaction()
+        recipes = LazyRecipeStore(self.snapshot_path)
+        # Replaying a rotated journal first, it is only left behind if a compaction did not finish
+        _replay_journal(self.rotated_path, recipes)
+        _replay_journal(self.journal_path, recipes)
+        return recipes
+
+    # Writing a full snapshot, after which the journals are no longer needed
+    def save(self, recipes):
+        self.wait_for_compaction()
+        with self._lock:
+            write_snapshot(self.snapshot_path, recipes)
+            self._close_journal()
+            for path in (self.rotated_path, self.journal_path):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def record_change(self, action, name, details=None):
+        self.record_changes([(action, name, details)])
+
+    # Appending the changes as JSON lines, and syncing them to disk before returning
+    def record_changes(self, changes):
+        data = ''.join(_encode_entry(action, name, details) for action, name, details in changes)
+        if not data:
+            return
+        with self._lock:
+            journal = self._open_journal()
+            journal.write(data)
+            journal.flush()
+            os.fsync(journal.fileno())
+            size = journal.tell()
+        if size > self.compact_threshold:
+            self.compact()
+
+    # Starting a background compaction, unless one is already running
+    def compact(self):
+        with self._lock:
+            if self._compactor is not None and self._compactor.is_alive():
+                return
+            # A leftover rotated journal is merged first, the current journal is then rotated by a later compaction
+            if not os.path.exists(self.rotated_path):
+                self._close_journal()
+                if not os.path.exists(self.journal_path):
+                    return
+                os.replace(self.journal_path, self.rotated_path)
+            self._compactor = threading.Thread(target=self._compact, daemon=True)
+            self._compactor.start()
+
+    # Unchanged recipes are copied from the old snapshot as they are, only the journal entries are encoded again
+    def _compact(self):
+        recipes = LazyRecipeStore(self.snapshot_path)
+        try:
+            _replay_journal(self.rotated_path, recipes)
+            write_snapshot(self.snapshot_path, recipes)
+        except PermissionError:
+            # The snapshot is still mapped by this process on Windows, keeping the rotated journal for the next try
+            return
+        finally:
+            recipes.close()
+        os.remove(self.rotated_path)
+
+    def wait_for_compaction(self):
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    # Waiting for a running compaction first, it changes the files when it finishes
+    def state_token(self):
+        self.wait_for_compaction()
+        self.flush()
+        return [_file_state(path) for path in (self.snapshot_path, self.rotated_path, self.journal_path)]
+
+    def flush(self):
+        with self._lock:
+            if self._journal is not None:
+                self._journal.flush()
+                os.fsync(self._journal.fileno())
+
+    def close(self):
+        self.wait_for_compaction()
+        with self._lock:
+            self._close_journal()
+
+    def _open_journal(self):
+        if self._journal is None:
+            self._truncate_torn_tail()
+            self._journal = open(self.journal_path, 'a')
+        return self._journal
+
+    def _close_journal(self):
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+
+    # Cutting off a half written last line, otherwise the next append would be glued onto it
+    def _truncate_torn_tail(self):
+        try:
+            with open(self.journal_path, 'rb+') as f:
+                data = f.read()
+                if data and not data.endswith(b'\n'):
+                    f.truncate(data.rfind(b'\n') + 1)
+        except FileNotFoundError:
+            pass
+
+
+class MemoryStorage:
+    def __init__(self, recipes=None):
+        self.recipes = recipes if recipes is not None else {}
+
+    def load(self):
+        return self.recipes
+
+    def save(self, recipes):
+        self.recipes = recipes
+
+    def record_change(self, action, name, details=None):
+        pass
+
+    def record_changes(self, changes):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+# The engine used by the module level functions and by RecipeManager when no engine is given
+_engine = JournalStorage()
+
+
+def get_engine():
+    return _engine
+
+
+def set_engine(engine):
+    global _engine
+    _engine = engine
+
+
+def save_recipes(recipes):
+    _engine.save(recipes)
+
+
+def load_recipes():
+    return _engine.load()
+
+
+def record_change(action, name, details=None):
+    _engine.record_change(action, name, details)
@@ -0,0 +1,24 @@
+'''
+Shared test setup - the modules live in the repository root, and the storage engines use paths relative to the working
+directory (recipes.json, recipes.journal, recipes.db), so every test runs in its own temporary directory.
+'''
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(autouse=True)
+def in_tmp_path(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+def make_recipes(count, ingredients_per_recipe=3, seed=0):
+    import random
+    rng = random.Random(seed)
+    pantry = [f'Ingredient {i}' for i in range(40)]
+    return {f'Recipe {i:05d}': {'ingredients': rng.sample(pantry, ingredients_per_recipe), 'instructions': f'Step {i}. Mix well.'}
+            for i in range(count)}
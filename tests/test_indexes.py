@@ -0,0 +1,160 @@
+'''
+Tests for the indexes, each compared against a brute-force answer over the same recipes.
+'''
+import random
+
+import pytest
+
+from conftest import make_recipes
+from fuzzy_search import FuzzyNameIndex
+from ingredient_index import IngredientIndex, normalize_ingredients
+from ordered_index import OrderedIndex
+from recipe_manager import RecipeManager
+from recommender import RecipeRecommender
+from storage import MemoryStorage
+
+
+def _order(name):
+    return (name.casefold(), name)
+
+
+def _levenshtein(a, b):
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def _random_names(rng, count):
+    letters = 'abcABC xyz'
+    return {''.join(rng.choice(letters) for _ in range(rng.randint(1, 6))) for _ in range(count)}
+
+
+def test_ordered_index_matches_a_sorted_list():
+    rng = random.Random(1)
+    index = OrderedIndex(load=4)
+    reference = set()
+    for _ in range(3000):
+        name = ''.join(rng.choice('abcAB') for _ in range(rng.randint(1, 4)))
+        if rng.random() < 0.6:
+            index.insert(name)
+            reference.add(name)
+        else:
+            position = index.remove(name)
+            assert (position is not None) == (name in reference)
+            reference.discard(name)
+        if rng.random() < 0.05:
+            expected = sorted(reference, key=_order)
+            assert list(index) == expected
+            assert len(index) == len(expected)
+            assert [index[i] for i in range(len(expected))] == expected
+            assert all(index.position(name) == i for i, name in enumerate(expected))
+
+
+def test_ordered_index_ranges_and_prefixes():
+    rng = random.Random(2)
+    names = _random_names(rng, 500)
+    index = OrderedIndex(names, load=8)
+    expected = sorted(names, key=_order)
+    for _ in range(200):
+        prefix = ''.join(rng.choice('abAB ') for _ in range(rng.randint(0, 2)))
+        start, stop = sorted(''.join(rng.choice('abcx') for _ in range(2)) for _ in range(2))
+        matching = [name for name in expected if name.casefold().startswith(prefix.casefold())]
+        assert list(index.range(prefix=prefix)) == matching
+        low, high = index.prefix_range(prefix)
+        assert [index[i] for i in range(low, high)] == matching
+        in_range = [name for name in expected if start <= name.casefold() < stop]
+        assert list(index.range(start, stop)) == in_range
+        assert list(index.range(start, stop, limit=3)) == in_range[:3]
+
+
+def test_ordered_index_pages_cover_every_name_once():
+    rng = random.Random(3)
+    names = _random_names(rng, 300)
+    index = OrderedIndex(names, load=8)
+    for limit in (1, 7, 50, 1000):
+        seen, cursor = [], None
+        while True:
+            page, cursor = index.page(cursor, limit)
+            seen.extend(page)
+            if cursor is None:
+                break
+        assert seen == sorted(names, key=_order)
+    with pytest.raises(ValueError):
+        index.page(limit=0)
+
+
+def test_fuzzy_index_matches_brute_force():
+    rng = random.Random(4)
+    names = sorted(_random_names(rng, 400))
+    index = FuzzyNameIndex.build(dict.fromkeys(names))
+    for name in names[::3]:
+        index.remove_recipe(name)
+    names = names[1::3] + names[2::3]
+    for _ in range(300):
+        query = ''.join(rng.choice('abcABxz ') for _ in range(rng.randint(1, 7))).strip()
+        if not query:
+            continue
+        limit = rng.choice((1, 3, 5, 10))
+        max_distance = max(2, len(query.casefold()) // 3)
+        distances = [(_levenshtein(query.casefold(), name.casefold()), name) for name in names]
+        expected = sorted((distance, name) for distance, name in distances if distance <= max_distance)[:limit]
+        assert index.closest(query, limit) == [(name, distance) for distance, name in expected]
+
+
+def test_ingredient_index_matches_brute_force():
+    rng = random.Random(5)
+    recipes = make_recipes(300, seed=5)
+    index = IngredientIndex.build(recipes)
+    pantry = [f'ingredient {i}' for i in range(40)]
+    for _ in range(100):
+        all_of, any_of, none_of = (rng.sample(pantry, rng.randint(0, 2)) for _ in range(3))
+        expected = sorted(
+            name for name, details in recipes.items()
+            if set(all_of) <= normalize_ingredients(details['ingredients'])
+            and (not any_of or set(any_of) & normalize_ingredients(details['ingredients']))
+            and not set(none_of) & normalize_ingredients(details['ingredients']))
+        assert index.query(all_of, any_of, none_of) == expected
+
+
+def test_recommender_matches_brute_force_jaccard():
+    recipes = make_recipes(300, ingredients_per_recipe=4, seed=6)
+    recommender = RecipeRecommender.build(recipes, mode='exact')
+    sets = {name: normalize_ingredients(details['ingredients']) for name, details in recipes.items()}
+    for name in list(recipes)[:30]:
+        scores = [(len(sets[name] & other) / len(sets[name] | other), candidate)
+                  for candidate, other in sets.items() if candidate != name]
+        expected = sorted(((-score, candidate) for score, candidate in scores if score > 0))[:5]
+        results = recommender.similar(name, 5)
+        assert [candidate for candidate, _ in results] == [candidate for _, candidate in expected]
+        assert [score for _, score in results] == pytest.approx([-score for score, _ in expected])
+
+
+def test_manager_indexes_follow_adds_and_deletes():
+    manager = RecipeManager(storage=MemoryStorage(make_recipes(100, seed=7)))
+    manager.ordered_index, manager.fuzzy_index, manager.ingredient_index
+    manager.add_recipe_dict('Zucchini bread', ['Zucchini', 'Flour'], 'Bake.')
+    manager.delete_recipe_dict('Recipe 00010')
+    assert list(manager.ordered_index) == sorted(manager.recipes_dict, key=_order)
+    assert manager.closest_recipe_names('zuchini bread', 1) == [('Zucchini bread', 1)]
+    assert manager.find_recipes_by_ingredients(all_of=['zucchini']) == ['Zucchini bread']
+    assert manager.list_recipes(prefix='recipe 0001') == [f'Recipe {i:05d}' for i in range(11, 20)]
+
+
+def test_index_build_replays_changes_made_while_it_runs():
+    manager = RecipeManager(storage=MemoryStorage(make_recipes(50, seed=8)))
+
+    # Adding and deleting recipes in the middle of the build, as the Tk thread would while a worker builds the index
+    def build(recipes):
+        manager.add_recipe_dict('Added during build', ['Salt'], 'Stir.')
+        manager.delete_recipe_dict('Recipe 00001')
+        return OrderedIndex(recipes)
+
+    index = manager._build_index(build)
+    assert list(index) == sorted(manager.recipes_dict, key=_order)
+    manager.add_recipe_dict('Added after build', ['Salt'], 'Stir.')
+    assert 'Added after build' in index
+    assert manager._builds == []
@@ -0,0 +1,111 @@
+'''
+Tests for the HTTP server - the endpoints, their error answers, and the writes reaching the storage engine.
+'''
+import asyncio
+import json
+
+import pytest
+
+from conftest import make_recipes
+from recipe_manager import RecipeManager
+from server import RecipeServer
+from storage import JournalStorage
+
+
+async def _request(port, method, path, body=None, raw_headers=''):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    data = json.dumps(body).encode('utf-8') if body is not None else b''
+    head = f'{method} {path} HTTP/1.1\r\nHost: test\r\nConnection: close\r\n'
+    head += raw_headers or f'Content-Length: {len(data)}\r\n'
+    writer.write(head.encode('latin-1') + b'\r\n' + data)
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, payload = response.partition(b'\r\n\r\n')
+    lines = head.decode('latin-1').split('\r\n')
+    headers = dict(line.split(': ', 1) for line in lines[1:])
+    if headers.get('Transfer-Encoding') == 'chunked':
+        chunks = []
+        while True:
+            size, _, payload = payload.partition(b'\r\n')
+            size = int(size, 16)
+            if not size:
+                break
+            chunks.append(payload[:size])
+            payload = payload[size + 2:]
+        payload = b''.join(chunks)
+    return int(lines[0].split()[1]), headers, json.loads(payload) if payload else None
+
+
+def _run(scenario):
+    async def main():
+        manager = RecipeManager(storage=JournalStorage())
+        server = RecipeServer(manager, port=0, workers=2)
+        await server.start()
+        try:
+            return await scenario(server.port)
+        finally:
+            await server.stop()
+            manager.close()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def catalogue():
+    JournalStorage().save(make_recipes(60))
+
+
+def test_add_get_delete(catalogue):
+    async def scenario(port):
+        recipe = {'name': 'Soup', 'ingredients': ['Water', 'Salt'], 'instructions': 'Boil.'}
+        assert (await _request(port, 'POST', '/recipes', recipe))[0] == 201
+        assert (await _request(port, 'POST', '/recipes', recipe))[0] == 409
+        status, _, body = await _request(port, 'GET', '/recipes/Soup')
+        assert (status, body) == (200, recipe)
+        assert (await _request(port, 'DELETE', '/recipes/Recipe%2000001'))[0] == 200
+        assert (await _request(port, 'GET', '/recipes/Recipe%2000001'))[0] == 404
+    _run(scenario)
+
+    recipes = JournalStorage().load()
+    assert 'Soup' in recipes and 'Recipe 00001' not in recipes
+
+
+def test_prefix_listing_pages_through_the_sorted_names(catalogue):
+    async def scenario(port):
+        names, cursor = [], None
+        while True:
+            path = '/recipes?prefix=recipe%200000&limit=4' + (f'&after={cursor}' if cursor else '')
+            status, headers, page = await _request(port, 'GET', path)
+            assert status == 200
+            names.extend(page)
+            cursor = headers.get('X-Next-Cursor')
+            if cursor is None:
+                return names
+    assert _run(scenario) == [f'Recipe {i:05d}' for i in range(10)]
+
+
+@pytest.mark.parametrize('path', ['/recipes?limit=0', '/search?q=mix&limit=0', '/closest?q=recipe&limit=-1',
+                                  '/similar/Recipe%2000001?limit=0', '/search?q=mix&limit=many'])
+def test_invalid_limits_are_rejected(catalogue, path):
+    async def scenario(port):
+        return await _request(port, 'GET', path)
+    assert _run(scenario)[0] == 400
+
+
+@pytest.mark.parametrize('header', ['Content-Length: abc\r\n', 'Content-Length: -5\r\n'])
+def test_invalid_content_length_is_rejected(catalogue, header):
+    async def scenario(port):
+        return await _request(port, 'POST', '/recipes', raw_headers=header)
+    assert _run(scenario)[0] == 400
+
+
+def test_search_closest_and_similar(catalogue):
+    async def scenario(port):
+        search = await _request(port, 'GET', '/search?q=step&limit=3')
+        closest = await _request(port, 'GET', '/closest?q=recipe%2000012&limit=1')
+        similar = await _request(port, 'GET', '/similar/Recipe%2000001?limit=2')
+        return search, closest, similar
+    search, closest, similar = _run(scenario)
+    assert search[0] == 200 and len(search[2]) == 3
+    assert closest[2] == [{'name': 'Recipe 00012', 'distance': 0}]
+    assert similar[0] == 200 and len(similar[2]) <= 2
@@ -0,0 +1,275 @@
+'''
+Tests for the storage engines - round trips, damaged files and failing writes.
+'''
+import json
+import os
+import threading
+
+import pytest
+
+from conftest import make_recipes
+from cached_storage import CachedRecipeMapping, CachedStorage
+from lazy_store import LazyRecipeStore, scan_offsets, write_snapshot
+from recipe_codecs import available_codecs, get_codec
+from recipe_manager import RecipeManager
+from sqlite_storage import SQLiteStorage
+from storage import JournalStorage, JsonFileStorage, MemoryStorage
+
+RECIPE = {'ingredients': ['Water', 'Flour'], 'instructions': 'Mix well.'}
+
+
+def test_journal_round_trip():
+    storage = JournalStorage()
+    storage.save({'A': RECIPE, 'B': RECIPE})
+    storage.record_changes([('add', 'C', RECIPE), ('delete', 'A', None)])
+    storage.record_change('add', 'Pâté', {'ingredients': ['Liver'], 'instructions': 'Blend.'})
+    storage.close()
+
+    recipes = JournalStorage().load()
+    assert list(recipes) == ['B', 'C', 'Pâté']
+    assert recipes['Pâté'] == {'ingredients': ['Liver'], 'instructions': 'Blend.'}
+
+
+def test_journal_compaction_keeps_every_change():
+    storage = JournalStorage(compact_threshold=200)
+    storage.save(make_recipes(50))
+    expected = dict(storage.load().items())
+    for i in range(30):
+        storage.record_change('add', f'New {i}', RECIPE)
+        expected[f'New {i}'] = RECIPE
+    storage.record_change('delete', 'Recipe 00003')
+    del expected['Recipe 00003']
+    storage.wait_for_compaction()
+    storage.close()
+
+    assert not os.path.exists('recipes.journal.old')
+    assert dict(JournalStorage().load().items()) == expected
+
+
+def test_journal_ignores_torn_last_line():
+    storage = JournalStorage()
+    storage.record_change('add', 'A', RECIPE)
+    storage.close()
+    with open('recipes.journal', 'a') as f:
+        f.write('{"op": "add", "name": "B", "rec')
+
+    storage = JournalStorage()
+    assert list(storage.load()) == ['A']
+    storage.record_change('add', 'C', RECIPE)
+    storage.close()
+    assert list(JournalStorage().load()) == ['A', 'C']
+
+
+@pytest.mark.parametrize('content', [
+    '{"A": {"ingredients": ["x"], "instructions": "y"}, "B": {"ingr',
+    '{"A": {"ingredients": ["x"], "instructions": "y"}',
+    '["A", "B"]',
+    '{"A" {}}',
+])
+def test_journal_refuses_damaged_snapshot(content):
+    with open('recipes.json', 'w') as f:
+        f.write(content)
+    with pytest.raises(ValueError):
+        JournalStorage().load()
+    with pytest.raises(ValueError):
+        RecipeManager(storage=JournalStorage())
+    with open('recipes.json') as f:
+        assert f.read() == content
+
+
+def test_journal_blank_snapshot_is_empty():
+    with open('recipes.json', 'w') as f:
+        f.write('  \n')
+    assert len(JournalStorage().load()) == 0
+
+
+def test_lazy_store_offsets_match_a_full_parse():
+    recipes = make_recipes(200)
+    recipes['Quote " and é'] = {'ingredients': ['ü'], 'instructions': 'Line\nbreak'}
+    write_snapshot('recipes.json', recipes)
+    with open('recipes.json', 'rb') as f:
+        data = f.read()
+    assert json.loads(data) == recipes
+
+    # With the offset table, and after it is removed (the offsets are then scanned from the file)
+    for remove_offsets in (False, True):
+        if remove_offsets:
+            os.remove('recipes.json.idx')
+        store = LazyRecipeStore('recipes.json')
+        assert list(store) == list(recipes)
+        assert all(store[name] == details for name, details in recipes.items())
+        store.close()
+
+    names, spans = scan_offsets(data)
+    assert names == list(recipes)
+    assert all(json.loads(data[spans[2 * i]:spans[2 * i + 1]]) == recipes[name] for i, name in enumerate(names))
+
+
+def test_lazy_store_rescans_a_file_changed_by_something_else():
+    write_snapshot('recipes.json', {'A': RECIPE})
+    with open('recipes.json', 'w') as f:
+        json.dump({'B': RECIPE, 'C': RECIPE}, f)
+    assert list(LazyRecipeStore('recipes.json')) == ['B', 'C']
+
+
+@pytest.mark.parametrize('codec', available_codecs())
+def test_file_storage_round_trip(codec):
+    path = 'recipes' + get_codec(codec).extension
+    recipes = make_recipes(100)
+    storage = JsonFileStorage(path, codec)
+    storage.save(recipes)
+    storage.record_changes([('add', 'X', RECIPE), ('delete', 'Recipe 00000', None)])
+    recipes['X'] = RECIPE
+    del recipes['Recipe 00000']
+    assert JsonFileStorage(path, codec).load() == recipes
+    # Without a codec the format is detected from the file
+    assert JsonFileStorage(path).load() == recipes
+
+
+def test_file_storage_refuses_another_format():
+    JsonFileStorage('recipes.json', 'marshal').save({'A': RECIPE})
+    with pytest.raises(ValueError):
+        JsonFileStorage('recipes.json', 'json').load()
+
+
+def test_file_storage_refuses_invalid_json_and_keeps_the_file():
+    with open('recipes.json', 'w') as f:
+        f.write('{"A": ')
+    storage = JsonFileStorage('recipes.json', 'json')
+    with pytest.raises(ValueError):
+        storage.load()
+    with pytest.raises(ValueError):
+        storage.record_change('add', 'B', RECIPE)
+    with open('recipes.json') as f:
+        assert f.read() == '{"A": '
+
+
+def test_file_storage_blank_or_missing_file_is_empty():
+    assert JsonFileStorage('recipes.json', 'json').load() == {}
+    with open('recipes.json', 'w') as f:
+        f.write('\n')
+    assert JsonFileStorage('recipes.json', 'json').load() == {}
+
+
+def test_sqlite_round_trip_and_update_in_place():
+    storage = SQLiteStorage()
+    recipes = storage.load()
+    recipes['A'] = RECIPE
+    storage.record_change('add', 'A', RECIPE)
+    recipe_id = storage.execute("SELECT id FROM recipes WHERE name = 'A'")[0][0]
+
+    changed = {'ingredients': ['Salt'], 'instructions': 'Boil.'}
+    recipes['A'] = changed
+    storage.record_change('add', 'A', changed)
+    assert storage.execute("SELECT id FROM recipes WHERE name = 'A'")[0][0] == recipe_id
+    assert storage.execute('SELECT COUNT(*) FROM recipe_ingredients')[0][0] == 1
+    storage.close()
+
+    storage = SQLiteStorage()
+    assert dict(storage.load().items()) == {'A': changed}
+    assert storage.ingredient_index().query(all_of=['salt']) == ['A']
+    storage.close()
+
+
+def test_sqlite_keeps_a_change_made_after_the_write():
+    storage = SQLiteStorage()
+    recipes = storage.load()
+    first = {'ingredients': ['Salt'], 'instructions': 'First.'}
+    second = {'ingredients': ['Sugar'], 'instructions': 'Second.'}
+    recipes['A'] = first
+    recipes['A'] = second
+    # Only the first change has been written, the mapping still has to show the second one
+    storage.record_changes([('add', 'A', first)])
+    assert recipes['A'] == second
+    storage.close()
+
+
+def test_sqlite_migrates_recipes_json_once():
+    JournalStorage().save({'A': RECIPE, 'B': RECIPE})
+    storage = SQLiteStorage()
+    assert sorted(storage.load()) == ['A', 'B']
+    storage.close()
+
+
+def test_sqlite_does_not_mark_a_damaged_recipes_json_as_migrated():
+    with open('recipes.json', 'w') as f:
+        f.write('{"A": {"ingredients": ["x"]')
+    storage = SQLiteStorage()
+    with pytest.raises(ValueError):
+        len(storage.load())
+    JournalStorage().save({'A': RECIPE})
+    assert list(storage.load()) == ['A']
+    storage.close()
+
+
+class FailingStorage(MemoryStorage):
+    def __init__(self):
+        super().__init__()
+        self.fail = True
+        self.written = []
+
+    def record_changes(self, changes):
+        if self.fail:
+            raise OSError('No space left on device')
+        self.written.extend(changes)
+
+    def record_change(self, action, name, details=None):
+        self.record_changes([(action, name, details)])
+
+
+def test_cached_storage_keeps_changes_when_the_write_fails():
+    engine = FailingStorage()
+    storage = CachedStorage(engine, flush_every=2, flush_interval=60)
+    storage.record_change('add', 'A', RECIPE)
+    with pytest.raises(OSError):
+        storage.record_change('add', 'B', RECIPE)
+    assert storage.has_pending_changes()
+
+    engine.fail = False
+    storage.flush()
+    assert [name for _, name, _ in engine.written] == ['A', 'B']
+    assert not storage.has_pending_changes()
+    storage.close()
+
+
+def test_cached_storage_coalesces_changes_to_the_same_recipe():
+    engine = FailingStorage()
+    engine.fail = False
+    storage = CachedStorage(engine, flush_every=100, flush_interval=60)
+    storage.record_changes([('add', 'A', RECIPE), ('add', 'B', RECIPE), ('delete', 'A', None)])
+    storage.flush()
+    assert engine.written == [('add', 'B', RECIPE), ('delete', 'A', None)]
+    storage.close()
+
+
+def test_cached_mapping_reads_from_many_threads():
+    mapping = CachedRecipeMapping({str(i): i for i in range(500)}, cache_size=50)
+    errors = []
+
+    def read(seed):
+        try:
+            for i in range(20000):
+                assert mapping[str((i * seed) % 500)] == (i * seed) % 500
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=read, args=(seed,)) for seed in (1, 3, 7, 11, 13, 17)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert errors == []
+    assert len(mapping.cache) <= 50
+
+
+def test_manager_keeps_changes_when_the_storage_fails():
+    engine = FailingStorage()
+    manager = RecipeManager(storage=engine, autoflush=False)
+    manager.add_recipe_dict('A', ['Water'], 'Pour.')
+    with pytest.raises(OSError):
+        manager.flush()
+    manager.add_recipe_dict('B', ['Water'], 'Pour.')
+    engine.fail = False
+    manager.flush()
+    assert [name for _, name, _ in engine.written] == ['A', 'B']
+    assert not manager.has_pending_changes()
@@ -0,0 +1,235 @@
+'''
+Text search module - full-text search over recipe names and instructions.
+
+TextIndex Class - a positional inverted index. Every word (token) maps to the recipes containing it, and for each recipe
+the positions where the word appears. The name and the instructions of a recipe are indexed together, the name first.
+    tokenize - splits text into lowercase words and numbers, so "Bake 250 degrees." becomes ['bake', '250', 'degrees'].
+    add_recipe / remove_recipe - updates the index when a single recipe is added or deleted.
+    search - ranks recipes with BM25, the usual ranking function for search engines. Words that are rare in the catalogue count
+        more than common words, words that appear several times count more (with diminishing returns), and long recipes are
+        penalized a little so they do not win just by containing more words.
+        Words in double quotes are a phrase, "bake 250" only matches recipes where the words come right after each other.
+    autocomplete - recipe names starting with the typed prefix (case-insensitive), found with a prefix trie.
+    save / load - the index is stored as JSON next to recipes.json, together with a token from the storage engine describing
+        the state of the recipe files. If the files have changed since the index was saved, the index is rebuilt instead.
+
+NameTrie Class - a character trie of the case-folded recipe names. Every node stores the children for the next character
+    and the recipe names that end at the node, so finding the names with a prefix only walks the prefix and the names below it.
+'''
+import json
+import math
+import os
+import re
+
+SEARCH_INDEX_PATH = 'recipes.search.json'
+INDEX_VERSION = 1
+
+_TOKEN_RE = re.compile(r'\w+')
+_PHRASE_RE = re.compile(r'"([^"]*)"')
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(text.casefold())
+
+
+class _TrieNode:
+    __slots__ = ('children', 'names')
+
+    def __init__(self):
+        self.children = {}
+        self.names = None
+
+
+class NameTrie:
+    def __init__(self):
+        self._root = _TrieNode()
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, name):
+        node = self._root
+        for char in name.casefold():
+            node = node.children.setdefault(char, _TrieNode())
+        if node.names is None:
+            node.names = set()
+        if name not in node.names:
+            node.names.add(name)
+            self._size += 1
+
+    def remove(self, name):
+        # Walking down while remembering the path, so empty nodes can be pruned on the way back up
+        path = [self._root]
+        key = name.casefold()
+        for char in key:
+            node = path[-1].children.get(char)
+            if node is None:
+                return False
+            path.append(node)
+        node = path[-1]
+        if not node.names or name not in node.names:
+            return False
+        node.names.discard(name)
+        self._size -= 1
+        if not node.names:
+            node.names = None
+        for depth in range(len(key), 0, -1):
+            node = path[depth]
+            if node.children or node.names:
+                break
+            del path[depth - 1].children[key[depth - 1]]
+        return True
+
+    # Depth first walk below the prefix, children in sorted order so the names come out alphabetically
+    def complete(self, prefix, limit=10):
+        node = self._root
+        for char in prefix.casefold():
+            node = node.children.get(char)
+            if node is None:
+                return []
+        results = []
+        stack = [node]
+        while stack and (limit is None or len(results) < limit):
+            node = stack.pop()
+            if node.names:
+                results.extend(sorted(node.names))
+            stack.extend(node.children[char] for char in sorted(node.children, reverse=True))
+        return results if limit is None else results[:limit]
+
+
+class TextIndex:
+    def __init__(self, k1=1.2, b=0.75):
+        # BM25 parameters, k1 controls how fast repeated words stop counting, b how much long recipes are penalized
+        self.k1 = k1
+        self.b = b
+        # word -> {recipe name: [positions]}
+        self._postings = {}
+        # recipe name -> number of words, and the distinct words (needed when the recipe is removed)
+        self._lengths = {}
+        self._doc_terms = {}
+        self._total_length = 0
+        self.names = NameTrie()
+        self.dirty = False
+
+    @classmethod
+    def build(cls, recipes):
+        index = cls()
+        for name, details in recipes.items():
+            index.add_recipe(name, details)
+        return index
+
+    def __len__(self):
+        return len(self._lengths)
+
+    def add_recipe(self, name, details):
+        if name in self._lengths:
+            self.remove_recipe(name)
+        tokens = tokenize(name) + tokenize(details.get('instructions', ''))
+        positions = {}
+        for position, token in enumerate(tokens):
+            positions.setdefault(token, []).append(position)
+        for token, token_positions in positions.items():
+            self._postings.setdefault(token, {})[name] = token_positions
+        self._lengths[name] = len(tokens)
+        self._doc_terms[name] = tuple(positions)
+        self._total_length += len(tokens)
+        self.names.add(name)
+        self.dirty = True
+
+    def remove_recipe(self, name):
+        terms = self._doc_terms.pop(name, None)
+        if terms is None:
+            return False
+        for token in terms:
+            docs = self._postings[token]
+            del docs[name]
+            if not docs:
+                del self._postings[token]
+        self._total_length -= self._lengths.pop(name)
+        self.names.remove(name)
+        self.dirty = True
+        return True
+
+    def autocomplete(self, prefix, limit=10):
+        return self.names.complete(prefix, limit)
+
+    # Returning (name, score) tuples, the best match first
+    def search(self, query, limit=10):
+        phrases = [tokenize(phrase) for phrase in _PHRASE_RE.findall(query)]
+        phrases = [phrase for phrase in phrases if phrase]
+        terms = tokenize(_PHRASE_RE.sub(' ', query))
+        for phrase in phrases:
+            terms.extend(phrase)
+        terms = [term for term in dict.fromkeys(terms) if term in self._postings]
+        if not terms:
+            return []
+
+        # Every recipe containing at least one of the words is a candidate, phrases then filter the candidates
+        scores = self._bm25(terms)
+        for phrase in phrases:
+            scores = {name: score for name, score in scores.items() if self._contains_phrase(name, phrase)}
+
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return ranked if limit is None else ranked[:limit]
+
+    def _bm25(self, terms):
+        doc_count = len(self._lengths)
+        average_length = self._total_length / doc_count
+        scores = {}
+        for term in terms:
+            docs = self._postings[term]
+            idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+            for name, positions in docs.items():
+                frequency = len(positions)
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[name] / average_length)
+                scores[name] = scores.get(name, 0.0) + idf * frequency * (self.k1 + 1) / (frequency + norm)
+        return scores
+
+    def _contains_phrase(self, name, phrase):
+        try:
+            position_lists = [self._postings[token][name] for token in phrase]
+        except KeyError:
+            return False
+        following = [set(positions) for positions in position_lists[1:]]
+        for start in position_lists[0]:
+            if all(start + offset + 1 in positions for offset, positions in enumerate(following)):
+                return True
+        return False
+
+    def save(self, state_token, path=SEARCH_INDEX_PATH):
+        data = {
+            'version': INDEX_VERSION,
+            'state': state_token,
+            'postings': self._postings,
+            'lengths': self._lengths,
+        }
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        self.dirty = False
+
+    # Returning the saved index if it matches the current state of the recipe files, otherwise None
+    @classmethod
+    def load(cls, state_token, path=SEARCH_INDEX_PATH):
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        if data.get('version') != INDEX_VERSION or data.get('state') != state_token:
+            return None
+
+        index = cls()
+        index._postings = data['postings']
+        index._lengths = data['lengths']
+        index._total_length = sum(index._lengths.values())
+        doc_terms = {name: [] for name in index._lengths}
+        for token, docs in index._postings.items():
+            for name in docs:
+                doc_terms[name].append(token)
+        index._doc_terms = {name: tuple(terms) for name, terms in doc_terms.items()}
+        for name in index._lengths:
+            index.names.add(name)
+        return index
@@ -0,0 +1,147 @@
+'''
+Virtual list module - a list view for the recipe names that only shows the rows that fit in the window.
+
+Inserting every recipe name into a tk.Listbox makes the window freeze for seconds with a large catalogue, and most of the rows
+can never be seen at the same time anyway. The VirtualListView shows the names of an OrderedIndex (see ordered_index.py) -
+the recipe manager's own ordered_index, which the manager keeps up to date - and the Listbox only ever contains the handful
+of names that are visible. Scrolling just replaces those rows.
+The index keeps the names sorted case-insensitively in small blocks, so an insert or delete only moves one block of names,
+the name at a position is found in O(log n), and prefix_range finds all names starting with a prefix with two binary searches,
+because the names starting with the same text are next to each other.
+
+VirtualListView Class - a frame with a Listbox and a Scrollbar.
+    set_index - shows the names of an index (used on startup and by the refresh button).
+    changed - redraws the visible rows after a name was added to or removed from the index.
+    set_filter - narrows the list to names starting with the typed text. This only changes the range that is shown.
+    selected - the selected recipe name, or None.
+'''
+import tkinter as tk
+import tkinter.font as tkfont
+
+from ordered_index import OrderedIndex
+
+
+class VirtualListView(tk.Frame):
+    def __init__(self, master, **kwargs):
+        super().__init__(master)
+        self.index = OrderedIndex()
+        # The names shown are index[start:end], and the first visible row is index[top]
+        self._start = 0
+        self._end = 0
+        self._top = 0
+        self._rows = 10
+        self._filter = ''
+        self._selected = None
+
+        self.listbox = tk.Listbox(self, exportselection=False, **kwargs)
+        self._row_height = tkfont.Font(font=self.listbox.cget('font')).metrics('linespace') + 1
+        self.scrollbar = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.listbox.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.listbox.bind('<<ListboxSelect>>', self._on_select)
+        self.listbox.bind('<Configure>', self._on_configure)
+        self.listbox.bind('<MouseWheel>', self._on_mousewheel)
+        # Linux sends mouse wheel events as button 4 and 5
+        self.listbox.bind('<Button-4>', lambda event: self.scroll(-3))
+        self.listbox.bind('<Button-5>', lambda event: self.scroll(3))
+        self.listbox.bind('<Up>', lambda event: self._move_selection(-1))
+        self.listbox.bind('<Down>', lambda event: self._move_selection(1))
+
+    def set_index(self, index):
+        self.index = index
+        if self._selected is not None and self.index.position(self._selected) is None:
+            self._selected = None
+        self._apply_filter()
+
+    # The index is changed by its owner (the recipe manager), the view only redraws the rows
+    def changed(self):
+        if self._selected is not None and self._selected not in self.index:
+            self._selected = None
+        self._update_range()
+        self._render()
+
+    def set_filter(self, text):
+        self._filter = text
+        self._apply_filter()
+
+    def selected(self):
+        return self._selected
+
+    def visible_count(self):
+        return self._end - self._start
+
+    def see(self, name):
+        position = self.index.position(name)
+        if position is None or not self._start <= position < self._end:
+            return
+        if not self._top <= position < self._top + self._rows:
+            self._top = position - self._rows // 2
+            self._render()
+
+    def scroll(self, rows):
+        self._top += rows
+        self._render()
+
+    def _apply_filter(self):
+        self._update_range()
+        self._top = self._start
+        self._render()
+
+    def _update_range(self):
+        self._start, self._end = self.index.prefix_range(self._filter)
+
+    # Replacing the rows of the listbox with the names that are visible from the current top row
+    def _render(self):
+        self._top = max(self._start, min(self._top, self._end - self._rows))
+        visible = [self.index[position] for position in range(self._top, min(self._top + self._rows, self._end))]
+        self.listbox.delete(0, tk.END)
+        if visible:
+            self.listbox.insert(tk.END, *visible)
+        if self._selected in visible:
+            self.listbox.selection_set(visible.index(self._selected))
+
+        total = self._end - self._start
+        if total <= self._rows:
+            self.scrollbar.set(0, 1)
+        else:
+            first = (self._top - self._start) / total
+            self.scrollbar.set(first, first + self._rows / total)
+
+    def _on_select(self, event):
+        selection = self.listbox.curselection()
+        if selection:
+            self._selected = self.listbox.get(selection[0])
+
+    def _on_configure(self, event):
+        # Working out how many rows fit from the height of one line of text in the listbox font
+        rows = max(1, event.height // self._row_height)
+        if rows != self._rows:
+            self._rows = rows
+            self._render()
+
+    def _on_mousewheel(self, event):
+        self.scroll(-3 if event.delta > 0 else 3)
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        total = self._end - self._start
+        if action == tk.MOVETO:
+            self._top = self._start + int(float(amount) * total)
+        elif action == tk.SCROLL:
+            step = self._rows if unit == tk.PAGES else 1
+            self._top += int(amount) * step
+        self._render()
+
+    def _move_selection(self, step):
+        position = self.index.position(self._selected) if self._selected is not None else None
+        if position is None:
+            position = self._top - step
+        position = max(self._start, min(position + step, self._end - 1))
+        if self._start <= position < self._end:
+            self._selected = self.index[position]
+            if position < self._top:
+                self._top = position
+            elif position >= self._top + self._rows:
+                self._top = position - self._rows + 1
+            self._render()
+        return 'break'